@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import instrumentation
+from ocr_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_ARTIFACT_DIR = os.path.join(DEFAULT_CACHE_DIR, "artifacts")
+# About 8 protocols at native photo size (~240 MB each), or 20 at --target-dpi 200
+DEFAULT_ARTIFACT_MAX_BYTES = 2 * 1024 ** 3
+
+# Bump a stage's version when its algorithm changes, so its old artifacts stop matching
+STAGE_VERSIONS = {"normalize": 1, "straighten": 1, "cells": 1}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """sha256 of a file's bytes."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Content-addressed store of page-stage outputs (normalize, straighten, cells).
+
+    Each artifact is keyed on a hash of its stage, the stage version, the key of its
+    input and its parameters, so the chain is:
+
+        scan bytes -> normalize (decoded RGB, EXIF applied) -> straighten (target_dpi, pyramid)
+                   -> cells (grid layout for the margins)
+
+    A changed scan or parameter changes every key downstream of it and only those
+    stages are recomputed; unchanged work is found again whatever the scan's file
+    name or location. Images are stored as uncompressed .npy (a 12MP page loads in
+    ~30ms, where PNG takes over a second to encode and decode; the price is disk, about
+    73MB per normalized photo and 11MB per page straightened at 200 dpi), small
+    metadata as JSON and grids as .npz, below root/<stage>/<key[:2]>/. Writes go
+    through a temporary file and a rename, so worker processes can share a store.
+
+    Like the OCRCache the store has a size budget: after each write the least
+    recently used files are deleted until it fits. A read refreshes a file's mtime,
+    which is what recency is measured by, so it holds across processes. A stage whose
+    image was evicted is simply recomputed.
+
+    Args:
+        root: Folder holding the artifacts
+        max_bytes: Size budget of the folder
+    """
+
+    def __init__(self, root=DEFAULT_ARTIFACT_DIR, max_bytes=DEFAULT_ARTIFACT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self.hits = {}
+        self.misses = {}
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Sent to batch worker processes: just the folder and budget, counters start fresh there
+        return {"root": self.root, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["root"], state["max_bytes"])
+
+    def source_key(self, path):
+        """Content hash of a scan, memoized per (path, size, mtime) for this process."""
+        st = os.stat(path)
+        memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(memo)
+        if digest is None:
+            with instrumentation.span("hash_source", cat="io", file=os.path.basename(path)):
+                digest = file_digest(path)
+            with self._lock:
+                self._digests[memo] = digest
+        return digest
+
+    def key(self, stage, input_key, **params):
+        """Key of a stage output: its stage, version, input key and parameters."""
+        h = hashlib.sha256()
+        h.update(f"{stage}\0{STAGE_VERSIONS[stage]}\0{input_key}\0".encode())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _path(self, stage, key, ext):
+        return os.path.join(self.root, stage, key[:2], key + ext)
+
+    def count(self, stage, hit):
+        """Record a lookup of a stage as a hit or a miss (see stats)."""
+        counts = self.hits if hit else self.misses
+        with self._lock:
+            counts[stage] = counts.get(stage, 0) + 1
+
+    def _write(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._evict(keep=path)
+
+    def _read(self, path, read):
+        """read(path), or None when the file is missing (never written, or evicted meanwhile)."""
+        try:
+            value = read(path)
+        except FileNotFoundError:
+            return None
+        try:
+            # A read is a use: refresh the file's recency for the LRU eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def _files(self):
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime_ns, st.st_size, path
+
+    def size(self):
+        """Bytes used by the stored artifacts."""
+        return sum(size for _, size, _ in self._files())
+
+    def _evict(self, keep=None):
+        """Delete the least recently used files until the store fits max_bytes (never `keep`)."""
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        with instrumentation.span("artifact_evict", cat="io", bytes=total):
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def get_image(self, stage, key, count=True):
+        """Stored RGB image, or None (count=False leaves the hit/miss counts to the caller)."""
+        path = self._path(stage, key, ".npy")
+        with instrumentation.span("artifact_get", cat="io", stage=stage):
+            img = self._read(path, np.load)
+        if count:
+            self.count(stage, img is not None)
+        return img
+
+    def put_image(self, stage, key, image):
+        """Store an RGB uint8 image."""
+        with instrumentation.span("artifact_put", cat="io", stage=stage):
+            self._write(self._path(stage, key, ".npy"), lambda f: np.save(f, np.ascontiguousarray(image)))
+
+    def get_json(self, stage, key):
+        """Stored metadata dict, or None (not counted; it accompanies an image)."""
+        def read(path):
+            with open(path) as f:
+                return json.load(f)
+        return self._read(self._path(stage, key, ".json"), read)
+
+    def put_json(self, stage, key, data):
+        self._write(self._path(stage, key, ".json"), lambda f: f.write(json.dumps(data).encode()))
+
+    def get_arrays(self, stage, key):
+        """Stored {name: array}, or None."""
+        def read(path):
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        arrays = self._read(self._path(stage, key, ".npz"), read)
+        self.count(stage, arrays is not None)
+        return arrays
+
+    def put_arrays(self, stage, key, **arrays):
+        self._write(self._path(stage, key, ".npz"), lambda f: np.savez(f, **arrays))
+
+    def merge_stats(self, stats):
+        """Add counts reported by another process's store (see stats)."""
+        with self._lock:
+            for stage, s in stats.items():
+                self.hits[stage] = self.hits.get(stage, 0) + s["hits"]
+                self.misses[stage] = self.misses.get(stage, 0) + s["misses"]
+
+    def stats(self):
+        """{stage: {"hits", "misses"}} for this process."""
+        with self._lock:
+            return {stage: {"hits": self.hits.get(stage, 0), "misses": self.misses.get(stage, 0)}
+                    for stage in sorted(set(self.hits) | set(self.misses))}
+
+
+def print_artifact_stats(store):
+    stats = store.stats()
+    if stats:
+        print("Artifact store: " + ", ".join(f"{stage} {s['hits']} hit(s) / {s['misses']} miss(es)"
+                                            for stage, s in stats.items()))
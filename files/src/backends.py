@@ -0,0 +1,395 @@
+import gc
+import time
+import instrumentation
+
+OCR_PROMPT = "Extract the handwritten number from this image. Output only the number or EMPTY."
+
+# Row mode: one strip of 10 answer boxes per call
+ROW_PROMPT = ("This image shows a row of 10 answer boxes, each with a handwritten number or left blank. "
+              "Read the boxes from left to right and output exactly 10 comma-separated values, "
+              "using EMPTY for a blank box. Output nothing else.")
+ROW_MAX_TOKENS = 80
+
+# Ensemble used by the scanner, smallest model first
+DEFAULT_MODEL_IDS = [
+    "mlx-community/Qwen2-VL-2B-Instruct-4bit",
+    "mlx-community/Qwen2-VL-7B-Instruct-4bit"
+]
+
+# The CPU backend runs the unquantized upstream checkpoints through transformers
+CPU_MODEL_IDS = {
+    "mlx-community/Qwen2-VL-2B-Instruct-4bit": "Qwen/Qwen2-VL-2B-Instruct",
+    "mlx-community/Qwen2-VL-7B-Instruct-4bit": "Qwen/Qwen2-VL-7B-Instruct",
+}
+
+# Approximate peak resident memory of each model while recognizing (weights plus
+# activations at the default max_pixels), used to pick an execution schedule
+MODEL_MEMORY_MB = {
+    "mlx-community/Qwen2-VL-2B-Instruct-4bit": 2000,
+    "mlx-community/Qwen2-VL-7B-Instruct-4bit": 5500,
+    "Qwen/Qwen2-VL-2B-Instruct": 10000,   # float32 on the CPU
+    "Qwen/Qwen2-VL-7B-Instruct": 32000,
+}
+DEFAULT_MODEL_MEMORY_MB = 8000
+
+
+def build_messages(prompt=OCR_PROMPT):
+    """Chat messages for a single image + instruction turn."""
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "image"},
+                {"type": "text", "text": prompt}
+            ]
+        }
+    ]
+
+
+class PromptTemplate:
+    """
+    A prompt rendered through a model's chat template, built once per model and prompt.
+
+    Attributes:
+        prompt: Instruction text
+        text: Full templated prompt (with the model's image placeholder)
+    """
+    __slots__ = ("prompt", "text")
+
+    def __init__(self, prompt, text):
+        self.prompt = prompt
+        self.text = text
+
+
+class RecognizerBackend:
+    """
+    Base class for answer-cell recognizers.
+
+    A backend turns a list of cell images into a list of results, one per image,
+    each a dict {"ans": str, "score": float}. "ans" is the stripped, upper-cased
+    model output and "score" is a confidence in [0, 1] (mean token probability
+    for the VLM backends); the VLM backends also report "prompt_tokens" and
+    "generation_tokens" for the instrumentation layer. Images are grouped into batches of `batch_size` and
+    handed to `_recognize_batch`, so backends that support batched forward passes
+    pay the per-call overhead once per batch instead of once per cell.
+
+    Each prompt is templated once per model (prompt_template) and handed to
+    `_recognize_batch` as a PromptTemplate; templates_built counts how often a
+    template was rendered.
+
+    thread_safe tells whether two instances may generate at the same time from
+    threads of one process; ParallelEnsemble runs members of backends that are
+    not in processes of their own.
+
+    supports_prefix_reuse tells whether the backend can prefill a template's text
+    before the image once and resume every cell from that cached KV prefix. No
+    backend can yet, so the prompt is prefilled with every cell.
+
+    Args:
+        model_id: Model identifier understood by the backend
+        max_pixels: Upper bound on pixels per image fed to the vision encoder
+        max_tokens: Maximum number of generated tokens per cell
+        temp: Sampling temperature (0.0 = greedy)
+        batch_size: Number of cells per forward pass
+    """
+    name = "base"
+    thread_safe = True
+    supports_prefix_reuse = False
+
+    def __init__(self, model_id, max_pixels=512 * 512, max_tokens=20, temp=0.0, batch_size=8):
+        self.model_id = model_id
+        self.max_pixels = max_pixels
+        self.max_tokens = max_tokens
+        self.temp = temp
+        self.batch_size = max(1, int(batch_size))
+        self.loaded = False
+        self.templates = {}
+        self.templates_built = 0
+
+    def load(self):
+        self.loaded = True
+        return self
+
+    def unload(self):
+        self.loaded = False
+        # Templates belong to the loaded processor
+        self.templates = {}
+
+    def prompt_template(self, prompt):
+        """The PromptTemplate for `prompt`, built on first use and then reused for every cell."""
+        template = self.templates.get(prompt)
+        if template is None:
+            with instrumentation.span("prompt_template", cat="model", model=self.model_id):
+                template = self._build_template(prompt)
+            self.templates[prompt] = template
+            self.templates_built += 1
+        return template
+
+    def _build_template(self, prompt):
+        return PromptTemplate(prompt, prompt)
+
+    @property
+    def memory_mb(self):
+        """Estimated peak memory of this model while loaded (see MODEL_MEMORY_MB)."""
+        return MODEL_MEMORY_MB.get(self.model_id, DEFAULT_MODEL_MEMORY_MB)
+
+    def recognize(self, images, prompt=OCR_PROMPT, keys=None, max_tokens=None):
+        """
+        Recognize a list of cell images.
+
+        Args:
+            images: List of PIL images (or HxW[xC] uint8 NumPy arrays)
+            prompt: Instruction text sent with every image (templated once per model)
+            keys: Optional identifiers (question numbers) parallel to `images`.
+                  Real backends ignore them; the stub uses them to replay answers.
+            max_tokens: Per-call override of the generation budget (e.g. for row strips)
+
+        Returns:
+            List of {"ans": str, "score": float} dicts in input order
+        """
+        if not self.loaded:
+            # First inference: heavy frameworks are imported and weights loaded only now
+            with instrumentation.span("load_model", cat="model", model=self.model_id):
+                self.load()
+        if keys is None:
+            keys = [None] * len(images)
+        max_tokens = max_tokens or self.max_tokens
+        template = self.prompt_template(prompt)
+        results = []
+        for start in range(0, len(images), self.batch_size):
+            batch = images[start:start + self.batch_size]
+            batch_keys = keys[start:start + self.batch_size]
+            with instrumentation.span("model_call", cat="model", model=self.model_id, images=len(batch)) as sp:
+                out = self._recognize_batch(batch, template, batch_keys, max_tokens)
+            if instrumentation.enabled():
+                self._record_call(sp, out)
+            results.extend(out)
+        return results
+
+    def _record_call(self, sp, out):
+        # Backends may attach per-image "prompt_tokens"/"generation_tokens" to their results
+        prompt_tokens = sum(r.get("prompt_tokens", 0) for r in out)
+        gen_tokens = sum(r.get("generation_tokens", 0) for r in out)
+        seconds = sp.duration_ms / 1000
+        sp.set(prompt_tokens=prompt_tokens, generation_tokens=gen_tokens)
+        instrumentation.observe("model_latency_ms", sp.duration_ms, model=self.model_id)
+        instrumentation.record("model_call", model=self.model_id, backend=self.name, images=len(out),
+                               latency_ms=round(sp.duration_ms, 3), prompt_tokens=prompt_tokens,
+                               generation_tokens=gen_tokens,
+                               tokens_per_sec=round(gen_tokens / seconds, 2) if seconds > 0 else 0.0)
+
+    def _recognize_batch(self, images, template, keys, max_tokens):
+        raise NotImplementedError
+
+
+class MLXBackend(RecognizerBackend):
+    """Qwen2-VL through mlx_vlm on Apple Silicon."""
+    name = "mlx"
+    # Concurrent generate calls on one Metal device are not known to be safe
+    thread_safe = False
+    # Qwen2-VL's M-RoPE positions are computed from the whole sequence, and
+    # mlx_vlm's generate cannot resume from a cached KV prefix
+    supports_prefix_reuse = False
+
+    def load(self):
+        if self.loaded:
+            return self
+        from mlx_vlm import load
+        print(f"Loading Model: {self.model_id}...")
+        self.model, self.processor = load(self.model_id)
+        self.processor.image_processor.max_pixels = self.max_pixels
+        self.loaded = True
+        return self
+
+    def unload(self):
+        if not self.loaded:
+            # Nothing to free, and MLX may not even be installed on this host
+            super().unload()
+            return
+        import mlx.core as mx
+        self.model = None
+        self.processor = None
+        super().unload()
+        # Hand the freed weights back to the system before the next model is loaded
+        gc.collect()
+        clear_cache = getattr(mx, "clear_cache", None) or mx.metal.clear_cache
+        clear_cache()
+
+    def _build_template(self, prompt):
+        text = self.processor.apply_chat_template(build_messages(prompt), add_generation_prompt=True)
+        return PromptTemplate(prompt, text)
+
+    def _recognize_batch(self, images, template, keys, max_tokens):
+        # mlx_vlm only exposes single-sequence generation, so the batch is run
+        # back to back on the once-templated prompt. The text before the image is
+        # prefilled on every call (see supports_prefix_reuse).
+        import mlx.core as mx
+        from mlx_vlm import stream_generate
+
+        prompt_text = template.text
+        results = []
+        for img in images:
+            img = _to_pil(img)
+            text = ""
+            logprobs = []
+            chunk = None
+            with instrumentation.span("generate", cat="model", model=self.model_id) as sp:
+                for chunk in stream_generate(self.model, self.processor, prompt_text, [img],
+                                             max_tokens=max_tokens, temp=self.temp):
+                    text += chunk.text
+                    if getattr(chunk, "logprobs", None) is not None and chunk.token is not None:
+                        logprobs.append(chunk.logprobs[chunk.token].item())
+                prompt_tokens = getattr(chunk, "prompt_tokens", 0) or 0
+                gen_tokens = getattr(chunk, "generation_tokens", 0) or len(logprobs)
+                sp.set(prompt_tokens=prompt_tokens, generation_tokens=gen_tokens)
+            score = float(mx.exp(mx.array(logprobs).mean()).item()) if logprobs else 0.0
+            results.append({"ans": text.strip().upper(), "score": score,
+                            "prompt_tokens": prompt_tokens, "generation_tokens": gen_tokens})
+        return results
+
+
+class CPUBackend(RecognizerBackend):
+    """Qwen2-VL through transformers/torch on the CPU, with true batched generation."""
+    name = "cpu"
+    # transformers computes Qwen2-VL's rope deltas only when the prefill starts at
+    # position 0, so generate() cannot continue from a cached KV prefix
+    supports_prefix_reuse = False
+
+    def __init__(self, model_id, **kwargs):
+        super().__init__(CPU_MODEL_IDS.get(model_id, model_id), **kwargs)
+
+    def load(self):
+        if self.loaded:
+            return self
+        import torch
+        from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+        print(f"Loading Model: {self.model_id} (CPU)...")
+        self.torch = torch
+        self.model = Qwen2VLForConditionalGeneration.from_pretrained(
+            self.model_id, torch_dtype=torch.float32, device_map="cpu")
+        self.model.eval()
+        self.processor = AutoProcessor.from_pretrained(self.model_id, max_pixels=self.max_pixels)
+        # Left padding keeps every sequence's generated tokens aligned at the end
+        self.processor.tokenizer.padding_side = "left"
+        self.loaded = True
+        return self
+
+    def unload(self):
+        self.model = None
+        self.processor = None
+        super().unload()
+        gc.collect()
+
+    def _build_template(self, prompt):
+        text = self.processor.apply_chat_template(build_messages(prompt), add_generation_prompt=True)
+        return PromptTemplate(prompt, text)
+
+    def _recognize_batch(self, images, template, keys, max_tokens):
+        # The whole prompt is prefilled for every sequence (see supports_prefix_reuse)
+        torch = self.torch
+        prompt_text = template.text
+        inputs = self.processor(text=[prompt_text] * len(images),
+                                images=[_to_pil(img) for img in images],
+                                padding=True, return_tensors="pt")
+        gen_kwargs = {"max_new_tokens": max_tokens,
+                      "return_dict_in_generate": True, "output_scores": True}
+        if self.temp > 0:
+            gen_kwargs.update(do_sample=True, temperature=self.temp)
+        else:
+            gen_kwargs["do_sample"] = False
+        with torch.inference_mode():
+            out = self.model.generate(**inputs, **gen_kwargs)
+        new_tokens = out.sequences[:, inputs["input_ids"].shape[1]:]
+        token_scores = self.model.compute_transition_scores(out.sequences, out.scores, normalize_logits=True)
+        texts = self.processor.batch_decode(new_tokens, skip_special_tokens=True)
+
+        pad_id = self.processor.tokenizer.pad_token_id
+        prompt_lengths = inputs["attention_mask"].sum(dim=1).tolist()
+        results = []
+        for i, text in enumerate(texts):
+            mask = new_tokens[i] != pad_id
+            logprobs = token_scores[i][mask]
+            score = float(torch.exp(logprobs.mean())) if logprobs.numel() else 0.0
+            results.append({"ans": text.strip().upper(), "score": score,
+                            "prompt_tokens": int(prompt_lengths[i]), "generation_tokens": int(mask.sum())})
+        return results
+
+
+class StubBackend(RecognizerBackend):
+    """
+    Deterministic stand-in for the VLMs, for testing and benchmarking without model weights.
+
+    Row strips are keyed by a tuple of question numbers; the stub answers them
+    with the comma-separated answers of those questions, like a VLM reading a row.
+
+    Args:
+        model_id: Used for labelling and for the memory estimate of the model it stands in for
+        answers: Optional mapping of key (question number) -> answer to replay
+        default: Answer returned for cells without a recorded answer
+        score: Score attached to every answer
+        call_latency: Simulated fixed cost per batch, in seconds
+        image_latency: Simulated cost per image, in seconds
+        token_latency: Simulated prefill cost per visual token, in seconds (Qwen2-VL token count)
+    """
+    name = "stub"
+
+    def __init__(self, model_id="stub", answers=None, default="EMPTY", score=1.0,
+                 call_latency=0.0, image_latency=0.0, token_latency=0.0, **kwargs):
+        super().__init__(model_id, **kwargs)
+        self.answers = dict(answers or {})
+        self.default = default
+        self.score = score
+        self.call_latency = call_latency
+        self.image_latency = image_latency
+        self.token_latency = token_latency
+        self.calls = 0
+        self.images_seen = 0
+        self.loads = 0
+
+    def load(self):
+        if not self.loaded:
+            self.loads += 1
+        return super().load()
+
+    def _build_template(self, prompt):
+        # Shaped like Qwen2-VL's chat template, so templating is exercised without a processor
+        return PromptTemplate(prompt, "<|im_start|>user\n<|vision_start|><|image_pad|><|vision_end|>"
+                                      f"{prompt}<|im_end|>\n<|im_start|>assistant\n")
+
+    def _recognize_batch(self, images, template, keys, max_tokens):
+        self.calls += 1
+        self.images_seen += len(images)
+        delay = self.call_latency + self.image_latency * len(images)
+        if self.token_latency:
+            from cell_encoding import visual_tokens
+            sizes = [_to_pil(img).size for img in images]
+            delay += self.token_latency * sum(visual_tokens(h, w, self.max_pixels) for w, h in sizes)
+        if delay > 0:
+            time.sleep(delay)
+        return [{"ans": self._answer(k), "score": self.score} for k in keys]
+
+    def _answer(self, key):
+        if isinstance(key, tuple):
+            return ", ".join(self._answer(k) for k in key)
+        return str(self.answers.get(key, self.default)).strip().upper()
+
+
+BACKENDS = {
+    "mlx": MLXBackend,
+    "cpu": CPUBackend,
+    "stub": StubBackend,
+}
+
+
+def create_backend(name, model_id, **kwargs):
+    """Instantiate a backend by name ("mlx", "cpu" or "stub")."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](model_id, **kwargs)
+
+
+def _to_pil(img):
+    from PIL import Image
+    if isinstance(img, Image.Image):
+        return img
+    return Image.fromarray(img)
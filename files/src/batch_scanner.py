@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import argparse
+import instrumentation
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from backends import BACKENDS
+from config import score_results
+from cell_encoding import CELL_MODES, CellEncoder, parse_cell_target
+from digit_classifier import DEFAULT_DIGIT_MODEL, DigitClassifier
+from debug_writer import DEBUG_LEVELS, IMAGE_FORMATS, DebugWriter
+from image_utils import load_page
+from ocr_cache import DEFAULT_CACHE_DIR, OCRCache
+from artifact_store import DEFAULT_ARTIFACT_DIR, DEFAULT_ARTIFACT_MAX_BYTES, ArtifactStore, print_artifact_stats
+from results_store import DEFAULT_RESULTS_DB, ResultsStore
+from ensemble import close_backends
+from prefilter import BLANK_INK_THRESHOLD
+from result_overlay import DEFAULT_OVERLAY_FORMAT, DEFAULT_OVERLAY_WIDTH, OVERLAY_FORMATS
+from main_scanner import (ESCALATE_SCORE, SCHEDULES, choose_schedule, create_colored_visualization,
+                          load_backends, prepare_pages, prepare_row_images, scan_answer_items,
+                          scan_model_major, write_disagreements)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".heic", ".tif", ".tiff")
+
+# Files written by the pipeline next to the scans; never treated as pages
+DERIVED_SUFFIXES = ("_clean", "_straight")
+
+RESULTS_FILENAME = "results.json"
+
+
+def find_page_images(subject_dir):
+    """Scanned page images directly inside a subject folder, in file name order."""
+    pages = []
+    for name in sorted(os.listdir(subject_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in IMAGE_EXTENSIONS or stem.endswith(DERIVED_SUFFIXES):
+            continue
+        path = os.path.join(subject_dir, name)
+        if os.path.isfile(path):
+            pages.append(path)
+    return pages
+
+
+def discover_subjects(root):
+    """
+    Find every data/user-*/sub-*/ folder below root and pair its page images.
+
+    Returns:
+        List of {"user", "subject", "dir", "pages"} dicts for folders with exactly two pages
+    """
+    subjects = []
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames.sort()
+        if not os.path.basename(dirpath).startswith("sub-"):
+            continue
+        dirnames[:] = []  # debug_cells/ etc. never hold subjects
+        pages = find_page_images(dirpath)
+        if len(pages) != 2:
+            print(f"Skipping {dirpath}: expected 2 page images, found {len(pages)}")
+            continue
+        subjects.append({
+            "user": os.path.basename(os.path.dirname(dirpath)),
+            "subject": os.path.basename(dirpath),
+            "dir": dirpath,
+            "pages": pages,
+        })
+    return subjects
+
+
+def _init_worker(trace):
+    if trace:
+        instrumentation.enable(keep_events=True)
+
+
+def _prepare_subject(subject, debug_settings, row_mode=False, store=None):
+    # Runs in a worker process: decode / straighten / cropping. Spans recorded here
+    # and the artifact store's hit counts are shipped back with the result and
+    # merged into the main process.
+    p1, p2 = subject["pages"]
+    writer = DebugWriter(**debug_settings)
+    try:
+        with instrumentation.span("prepare_subject", subject=subject["subject"]):
+            pages = [load_page(p, write_intermediates=writer.wants("intermediates"), writer=writer, store=store)
+                     for p in (p1, p2)]
+            answer_items = prepare_pages(p1, p2, subject["dir"], debug=writer, pages=pages)
+            row_images = prepare_row_images(p1, p2, pages=pages) if row_mode else None
+    finally:
+        writer.close()
+    return answer_items, row_images, instrumentation.drain(), store.stats() if store is not None else {}
+
+
+def _visualize_subject(subject, report, store=None, overlay=None):
+    create_colored_visualization(report, subject["pages"][0], subject["pages"][1], subject["dir"], store=store,
+                                 **(overlay or {}))
+
+
+def run_batch(root, backend="mlx", batch_size=8, workers=None, cache=None,
+              blank_threshold=BLANK_INK_THRESHOLD, cascade=False, escalate_score=ESCALATE_SCORE,
+              summary_path=None, visualize=True, debug=False, score_all=False, row_mode=False,
+              schedule="auto", memory_budget_mb=None, digits=None, encoder=None, parallel=1, store=None,
+              overlay_format=DEFAULT_OVERLAY_FORMAT, overlay_width=DEFAULT_OVERLAY_WIDTH, results_store=None):
+    """
+    Scan and score every subject below root with a single model load.
+
+    Page preprocessing runs in a process pool while the main process runs inference
+    on subjects whose cells are ready. At most 2 x workers subjects are in flight so
+    prepared crops don't pile up in memory when preprocessing outpaces the models.
+    The model-major schedule instead collects the crops of every subject and loads
+    each model once for the whole run (see scan_model_major).
+
+    Args:
+        root: Folder searched for sub-* subject folders
+        workers: Preprocessing processes (default: CPU count)
+        summary_path: Where to write the run summary (default: root/batch_summary.json)
+        visualize: Also write the colored result pages for each subject
+        overlay_format: "png", "jpeg", "webp" or "json" (see result_overlay.write_overlays)
+        overlay_width: Downscale the colored pages to this width (None or 0 = full size)
+        debug: DebugWriter or debug level name for each subject ("off", "sampled", "full",
+               "disagreements"); True = "sampled"
+        score_all: Scan and score all 160 items, ignoring the ceiling
+        row_mode: Read each answer row in one model call (per-cell fallback)
+        schedule: "interleaved", "model-major" or "auto" (see choose_schedule)
+        memory_budget_mb: Peak model memory the auto schedule must stay within
+        digits: Optional DigitClassifier; confidently read cells skip the VLMs
+        encoder: Optional CellEncoder; cells are normalized to a fixed visual-token budget
+        parallel: Ensemble members run at the same time (see main_scanner.load_backends)
+        store: ArtifactStore shared by the worker processes, so unchanged scans are not
+               decoded, straightened or grid-detected again (None = recompute)
+        results_store: ResultsStore each subject's report is added to as it is scored
+
+    Returns:
+        Run summary dict
+    """
+    subjects = discover_subjects(root)
+    print(f"Found {len(subjects)} subjects under {root}")
+    summary_path = summary_path or os.path.join(root, "batch_summary.json")
+    run_start = time.time()
+
+    # Models are loaded once for the whole run, on the first cell that needs them
+    # (a re-run answered entirely from the OCR cache never imports the ML framework)
+    backends = load_backends(backend, batch_size=batch_size, cache=cache, load=False, parallel=parallel)
+    schedule = choose_schedule(backends, schedule, memory_budget_mb)
+    print(f"Execution schedule: {schedule}")
+
+    workers = workers or os.cpu_count() or 1
+    # Worker processes write their own debug images; disagreement crops are written here
+    writer = debug if isinstance(debug, DebugWriter) else DebugWriter(debug)
+    entries = []
+    viz_futures = []
+    prepared = []  # model-major: (subject, started, answer_items, row_images) until every subject is ready
+    trace = instrumentation.enabled()
+
+    def finish_subject(subject, started, answer_items, scanned):
+        entry = {"user": subject["user"], "subject": subject["subject"], "dir": subject["dir"]}
+        try:
+            with instrumentation.span("score_subject", subject=subject["subject"]):
+                raw_score, report = score_results(scanned, apply_ceiling=not score_all)
+            write_disagreements(answer_items, scanned, subject["dir"], writer)
+        except Exception as e:
+            print(f"Failed {subject['dir']}: {e}")
+            entry.update(status="error", error=str(e))
+            entries.append(entry)
+            return
+
+        elapsed = time.time() - started
+        instrumentation.record("subject", subject=subject["subject"], raw_score=raw_score,
+                               elapsed_sec=round(elapsed, 3))
+        result = {"user": subject["user"], "subject": subject["subject"], "pages": subject["pages"],
+                  "raw_score": raw_score, "elapsed_sec": round(elapsed, 3), "report": report}
+        result_path = os.path.join(subject["dir"], RESULTS_FILENAME)
+        with open(result_path, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Raw score {raw_score} -> {result_path}")
+        if results_store is not None:
+            results_store.add_protocol(report, raw_score, os.path.abspath(subject["dir"]), user=subject["user"],
+                                       subject=subject["subject"], scanned=scanned, backend=backend)
+
+        if visualize:
+            viz_futures.append(pool.submit(_visualize_subject, subject, report, store,
+                                           {"image_format": overlay_format, "max_width": overlay_width}))
+        entry.update(status="ok", raw_score=raw_score, elapsed_sec=round(elapsed, 3), results=result_path)
+        entries.append(entry)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(trace,)) as pool:
+            queue = list(subjects)
+            in_flight = {}
+            while queue or in_flight:
+                while queue and len(in_flight) < 2 * workers:
+                    subject = queue.pop(0)
+                    in_flight[pool.submit(_prepare_subject, subject, writer.settings(), row_mode, store)] = (subject, time.time())
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    subject, started = in_flight.pop(fut)
+                    try:
+                        answer_items, row_images, events, artifact_stats = fut.result()
+                        instrumentation.merge(events)
+                        if store is not None:
+                            store.merge_stats(artifact_stats)
+                        if schedule == "model-major":
+                            prepared.append((subject, started, answer_items, row_images))
+                            continue
+                        print(f"\n--- {subject['user']}/{subject['subject']} ---")
+                        with instrumentation.span("scan_subject", subject=subject["subject"]):
+                            scanned = scan_answer_items(answer_items, backends, blank_threshold=blank_threshold,
+                                                        cascade=cascade, escalate_score=escalate_score, cache=cache,
+                                                        stop_at_ceiling=not score_all, row_images=row_images,
+                                                        digits=digits, encoder=encoder)
+                    except Exception as e:
+                        print(f"Failed {subject['dir']}: {e}")
+                        entries.append({"user": subject["user"], "subject": subject["subject"], "dir": subject["dir"],
+                                        "status": "error", "error": str(e)})
+                        continue
+                    finish_subject(subject, started, answer_items, scanned)
+
+            if prepared:
+                print(f"\n--- {len(prepared)} subjects, one model at a time ---")
+                with instrumentation.span("scan_model_major", subjects=len(prepared)):
+                    per_subject = scan_model_major([(items, rows) for _, _, items, rows in prepared], backends,
+                                                   blank_threshold=blank_threshold, cascade=cascade,
+                                                   escalate_score=escalate_score, cache=cache,
+                                                   stop_at_ceiling=not score_all, digits=digits,
+                                                   encoder=encoder)
+                for (subject, started, answer_items, _), results in zip(prepared, per_subject):
+                    finish_subject(subject, started, answer_items, [results[item[0]] for item in answer_items])
+
+            for fut in viz_futures:
+                try:
+                    fut.result()
+                except Exception as e:
+                    print(f"Visualization failed: {e}")
+    finally:
+        close_backends(backends)
+    if writer is not debug:
+        writer.close()
+    else:
+        writer.flush()
+
+    ok = [e for e in entries if e["status"] == "ok"]
+    summary = {
+        "root": root,
+        "backend": backend,
+        "subjects": len(subjects),
+        "succeeded": len(ok),
+        "failed": len(entries) - len(ok),
+        "elapsed_sec": round(time.time() - run_start, 3),
+        "mean_raw_score": (sum(e["raw_score"] for e in ok) / len(ok)) if ok else None,
+        "results": sorted(entries, key=lambda e: (e["user"], e["subject"])),
+    }
+    if cache is not None:
+        summary["cache"] = cache.stats()
+    if store is not None:
+        summary["artifacts"] = store.stats()
+        print_artifact_stats(store)
+    if results_store is not None:
+        summary["results_db"] = results_store.path
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"\nBatch done: {summary['succeeded']}/{summary['subjects']} subjects in {summary['elapsed_sec']}s")
+    print(f"Run summary saved to: {summary_path}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WJ-IV Math batch scanner over data/user-*/sub-*/ folders")
+    parser.add_argument("--root", type=str, required=True, help="Folder containing user-*/sub-*/ subject folders")
+    parser.add_argument("--workers", type=int, default=None, help="Preprocessing processes (default: CPU count)")
+    parser.add_argument("--summary", type=str, default=None, help="Run summary path (default: ROOT/batch_summary.json)")
+    parser.add_argument("--no-viz", action="store_true", help="Skip the colored result overlays")
+    parser.add_argument("--overlay-format", choices=OVERLAY_FORMATS, default=DEFAULT_OVERLAY_FORMAT, help="Colored result pages as jpeg, png or webp, or json (cell boxes and statuses only)")
+    parser.add_argument("--overlay-width", type=int, default=DEFAULT_OVERLAY_WIDTH, help="Downscale the colored result pages to this width (0 = full size)")
+    parser.add_argument("--debug-level", choices=sorted(DEBUG_LEVELS), default="off", help="Debug images to write per subject (off, sampled, full, disagreements)")
+    parser.add_argument("--debug", action="store_true", help="Same as --debug-level full")
+    parser.add_argument("--debug-format", choices=sorted(IMAGE_FORMATS), default="png", help="Encoding of debug images")
+    parser.add_argument("--png-compress-level", type=int, default=1, help="zlib level for PNG debug images (0-9)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mlx", help="Recognizer backend (mlx, cpu or stub)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Answer cells per model forward pass")
+    parser.add_argument("--blank-threshold", type=float, default=BLANK_INK_THRESHOLD, help="Ink ratio below which a cell is treated as EMPTY")
+    parser.add_argument("--score-all", action="store_true", help="Scan and score all 160 items, ignoring the ceiling (validation)")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every answer cell to the models, even blank ones")
+    parser.add_argument("--row-mode", action="store_true", help="Read each answer row in one model call (per-cell fallback)")
+    parser.add_argument("--cascade", action="store_true", help="Run the large model only on cells the small model is unsure about")
+    parser.add_argument("--escalate-score", type=float, default=ESCALATE_SCORE, help="Cascade: escalate answers below this mean token probability")
+    parser.add_argument("--digit-tier", action="store_true", help="Read confident cells with the CPU digit classifier, VLMs only for the rest")
+    parser.add_argument("--digit-model", type=str, default=DEFAULT_DIGIT_MODEL, help="Digit classifier model (see digit_classifier.py)")
+    parser.add_argument("--digit-conf", type=float, default=None, help="Calibrated confidence needed to accept a digit-tier answer (default: the threshold stored in the model)")
+    parser.add_argument("--cell-target", type=parse_cell_target, default=None, help="Normalize cells to HEIGHTxWIDTH pixels before the VLMs (e.g. 56x84 = 6 visual tokens)")
+    parser.add_argument("--cell-mode", choices=CELL_MODES, default="binary", help="Rendering of normalized cells")
+    parser.add_argument("--schedule", choices=SCHEDULES, default="auto", help="interleaved: all models resident; model-major: one model at a time across all subjects; auto: decide from --memory-budget-gb")
+    parser.add_argument("--memory-budget-gb", type=float, default=None, help="Peak model memory for --schedule auto (default: no limit, interleaved)")
+    parser.add_argument("--parallel", type=int, default=1, help="Ensemble members run at the same time, each on its own worker (1 = one after another)")
+    parser.add_argument("--trace", type=str, default=None, help="Record spans and write a Chrome-trace/Perfetto JSON here")
+    parser.add_argument("--metrics", type=str, default=None, help="Append JSONL metrics (model calls, tokens/sec, cache hits) here")
+    parser.add_argument("--cache-dir", type=str, default=DEFAULT_CACHE_DIR, help="Folder of the persistent OCR result cache")
+    parser.add_argument("--no-cache", action="store_true", help="Always run the models, bypassing the OCR cache")
+    parser.add_argument("--artifact-dir", type=str, default=DEFAULT_ARTIFACT_DIR, help="Folder of the decoded/straightened page and grid artifacts")
+    parser.add_argument("--no-artifacts", action="store_true", help="Always decode and straighten the pages, bypassing the artifact store")
+    parser.add_argument("--artifact-max-gb", type=float, default=DEFAULT_ARTIFACT_MAX_BYTES / 1024 ** 3, help="Size budget of the artifact store; least recently used artifacts are deleted beyond it")
+    parser.add_argument("--results-db", type=str, default=None, help=f"Add every subject's report to this SQLite results store, e.g. {DEFAULT_RESULTS_DB} (default: not recorded; see results_store.py)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"Not a folder: {args.root}")
+        sys.exit(1)
+    if args.digit_tier and not os.path.isfile(args.digit_model):
+        print(f"No digit model at {args.digit_model}; train one with digit_classifier.py")
+        sys.exit(1)
+
+    if args.trace or args.metrics:
+        instrumentation.enable(metrics_path=args.metrics, trace_path=args.trace)
+    cache = None if args.no_cache else OCRCache(args.cache_dir)
+    results_store = ResultsStore(args.results_db) if args.results_db else None
+    try:
+        run_batch(args.root, backend=args.backend, batch_size=args.batch_size, workers=args.workers,
+                  cache=cache, blank_threshold=None if args.no_prefilter else args.blank_threshold,
+                  cascade=args.cascade, escalate_score=args.escalate_score,
+                  summary_path=args.summary, visualize=not args.no_viz,
+                  debug=DebugWriter("full" if args.debug else args.debug_level, image_format=args.debug_format,
+                                    png_compress_level=args.png_compress_level),
+                  score_all=args.score_all, row_mode=args.row_mode, schedule=args.schedule,
+                  memory_budget_mb=None if args.memory_budget_gb is None else args.memory_budget_gb * 1024,
+                  digits=DigitClassifier(args.digit_model, args.digit_conf) if args.digit_tier else None,
+                  encoder=CellEncoder(*args.cell_target, mode=args.cell_mode) if args.cell_target else None,
+                  parallel=args.parallel,
+                  store=None if args.no_artifacts else ArtifactStore(args.artifact_dir, max_bytes=int(args.artifact_max_gb * 1024 ** 3)),
+                  overlay_format=args.overlay_format, overlay_width=args.overlay_width,
+                  results_store=results_store)
+    finally:
+        if cache is not None:
+            cache.close()
+        if results_store is not None:
+            results_store.close()
+    instrumentation.finish()
@@ -0,0 +1,328 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import contextlib
+import statistics
+import subprocess
+import instrumentation
+from backends import DEFAULT_MODEL_IDS, create_backend
+from config import WJ_MATH_ANSWER_KEY
+from debug_writer import DEBUG_LEVELS, IMAGE_FORMATS, DebugWriter
+from digit_classifier import DEFAULT_DIGIT_MODEL, DigitClassifier
+from ensemble import ParallelEnsemble, close_backends
+from image_utils import register_heif
+from prefilter import BLANK_INK_THRESHOLD
+from main_scanner import run_precision_assessment
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "user-DGB", "sub-test_1")
+SAMPLE_PAGES = ("IMG_6654.png", "IMG_6655.png")
+
+# Pipeline stages, in execution order
+STAGES = ("decode", "straighten", "crop", "debug_writes", "debug_flush", "inference", "scoring", "visualization")
+
+# The pipeline's spans (see instrumentation) that make up each stage
+STAGE_SPANS = {
+    "decode": "decode",
+    "straighten": "straighten",
+    "prepare_page": "crop",
+    "crop_cells": "crop",
+    "debug_save": "debug_writes",
+    "visualize_content_box": "debug_writes",
+    "row_checks": "debug_writes",
+    "debug_flush": "debug_flush",
+    "recognize": "inference",
+    "score_results": "scoring",
+    "colored_visualization": "visualization",
+}
+
+# Compare mode: a stage regresses when its median is this much slower than the baseline...
+DEFAULT_TOLERANCE = 0.15
+# ...and at least this many milliseconds slower (keeps sub-millisecond stages from flapping)
+DEFAULT_MIN_DELTA_MS = 5.0
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load_recorded_answers(path):
+    """
+    Answers for the stub to replay, as {question_num: answer}.
+
+    Accepts a results.json written by batch_scanner (its report's "detected"
+    column), a list of 160 answers, or a {"question": answer} mapping.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "report" in data:
+        return {e["question"]: e["detected"] for e in data["report"]}
+    if isinstance(data, list):
+        return {i + 1: a for i, a in enumerate(data)}
+    return {int(q): a for q, a in data.items()}
+
+
+def stage_times(events):
+    """
+    Milliseconds per stage from a drained trace, as exclusive span time.
+
+    Each span in STAGE_SPANS counts towards its stage minus the time of the
+    stage spans nested in it on the same thread, so a page decoded inside the
+    visualization counts as "decode", and debug images queued while cropping
+    as "debug_writes". Spans not in STAGE_SPANS are transparent. Stages running
+    on different threads (page 2 is decoded while page 1 is recognized) are
+    summed, so the total can exceed the wall time.
+    """
+    times = dict.fromkeys(STAGES, 0.0)
+    by_thread = {}
+    for e in events:
+        if e.get("ph") == "X":
+            by_thread.setdefault((e["pid"], e["tid"]), []).append(e)
+    for spans in by_thread.values():
+        # Parents first: earlier start, and the longer span on a tie
+        spans.sort(key=lambda e: (e["ts"], -e["dur"]))
+        open_spans = []
+        for e in spans:
+            while open_spans and open_spans[-1][0]["ts"] + open_spans[-1][0]["dur"] <= e["ts"]:
+                open_spans.pop()
+            stage = STAGE_SPANS.get(e["name"])
+            if stage is not None:
+                times[stage] += e["dur"] / 1000
+                parent = next((s for _, s in reversed(open_spans) if s is not None), None)
+                if parent is not None:
+                    times[parent] -= e["dur"] / 1000
+            open_spans.append((e, stage))
+    return times
+
+
+def run_once(page_paths, backends, work_dir, blank_threshold=BLANK_INK_THRESHOLD, target_dpi=None,
+             score_all=False, row_mode=False, debug_settings=None, digits=None):
+    """
+    One pass of run_precision_assessment over a protocol, timed through its spans.
+
+    Pages are decoded and straightened from the scans (never from *_clean_straight.png
+    left over from a debug run), and all output goes to work_dir. "debug_writes" is
+    the time the pipeline spends handing debug images to the DebugWriter during the
+    real crop pass, and "debug_flush" the time still needed afterwards for them to
+    reach disk. Turns tracing on for the run (see stage_times).
+
+    Returns:
+        tuple: ({stage: milliseconds}, wall milliseconds, raw score)
+    """
+    p1, p2 = page_paths
+    writer = DebugWriter(**(debug_settings or {"level": "sampled"}))
+    instrumentation.enable(keep_events=True)
+    try:
+        t = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            raw_score, _ = run_precision_assessment(
+                p1, p2, backends=backends, blank_threshold=blank_threshold, output_dir=work_dir, debug=writer,
+                target_dpi=target_dpi, score_all=score_all, row_mode=row_mode, schedule="interleaved",
+                digits=digits)
+            with instrumentation.span("debug_flush", cat="io"):
+                writer.close()
+        wall_ms = (time.perf_counter() - t) * 1000
+        events = instrumentation.drain()
+    finally:
+        instrumentation.disable()
+    return stage_times(events), wall_ms, raw_score
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(page_paths, repeat=3, answers=None, call_latency=0.0, image_latency=0.0,
+                  blank_threshold=BLANK_INK_THRESHOLD, target_dpi=None, score_all=False, row_mode=False,
+                  debug_settings=None, digits=None, parallel=1):
+    """
+    Run the pipeline `repeat` times on the given pages with the stub recognizer.
+
+    Args:
+        page_paths: (page 1, page 2) scans
+        answers: {question_num: answer} for the stub to replay (default: the answer key,
+                 so the ceiling never stops the scan early)
+        call_latency, image_latency: Simulated stub cost per forward pass / per image, in seconds
+        debug_settings: DebugWriter arguments for the debug stages (default: "sampled" PNG)
+        digits: Optional DigitClassifier tier in front of the stub models
+        parallel: Stub models run at the same time (with latency set, inference should
+                  approach one model's time instead of the sum)
+
+    Returns:
+        Result dict with per-stage median/min/runs in ms, wall time, peak RSS and run metadata
+    """
+    if answers is None:
+        answers = {i + 1: a for i, a in enumerate(WJ_MATH_ANSWER_KEY)}
+    backends = [create_backend("stub", m, answers=answers, call_latency=call_latency,
+                               image_latency=image_latency).load()
+                for m in DEFAULT_MODEL_IDS]
+    if parallel > 1:
+        backends = ParallelEnsemble(backends, parallelism=parallel)
+
+    runs, walls = [], []
+    raw_score = None
+    try:
+        for i in range(repeat):
+            work_dir = tempfile.mkdtemp(prefix="wj_bench_")
+            try:
+                times, wall_ms, raw_score = run_once(page_paths, backends, work_dir, blank_threshold=blank_threshold,
+                                                     target_dpi=target_dpi, score_all=score_all, row_mode=row_mode,
+                                                     debug_settings=debug_settings, digits=digits)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            runs.append(times)
+            walls.append(wall_ms)
+            print(f"Run {i + 1}/{repeat}: {wall_ms:.0f}ms")
+    finally:
+        close_backends(backends)
+
+    stages = {}
+    for stage in STAGES:
+        values = [r[stage] for r in runs]
+        stages[stage] = {
+            "median_ms": round(statistics.median(values), 2),
+            "min_ms": round(min(values), 2),
+            "runs_ms": [round(v, 2) for v in values],
+        }
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pages": [os.path.basename(p) for p in page_paths],
+            "repeat": repeat,
+            "target_dpi": target_dpi,
+            "score_all": score_all,
+            "row_mode": row_mode,
+            "debug": debug_settings or {"level": "sampled"},
+            "prefilter": blank_threshold is not None,
+            "digit_tier": digits is not None,
+            "parallel": parallel,
+        },
+        "stages": stages,
+        "total_median_ms": round(sum(s["median_ms"] for s in stages.values()), 2),
+        "wall_median_ms": round(statistics.median(walls), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "model_calls": sum(b.calls for b in backends),
+        "model_images": sum(b.images_seen for b in backends),
+        "prompt_templates": sum(b.templates_built for b in backends),
+        "raw_score": raw_score,
+    }
+
+
+def compare_results(current, baseline, tolerance=DEFAULT_TOLERANCE, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    """
+    Compare a benchmark result against a stored baseline.
+
+    Returns:
+        List of {"metric", "baseline", "current", "change", "regression"} rows
+    """
+    rows = []
+
+    def add(metric, base, cur, min_delta):
+        if base is None or cur is None:
+            return
+        change = (cur - base) / base if base else 0.0
+        rows.append({"metric": metric, "baseline": base, "current": cur, "change": round(change, 4),
+                     "regression": change > tolerance and (cur - base) > min_delta})
+
+    for stage in STAGES:
+        base = baseline["stages"].get(stage, {}).get("median_ms")
+        cur = current["stages"].get(stage, {}).get("median_ms")
+        add(f"{stage}_ms", base, cur, min_delta_ms)
+    add("total_ms", baseline.get("total_median_ms"), current.get("total_median_ms"), min_delta_ms)
+    add("wall_ms", baseline.get("wall_median_ms"), current.get("wall_median_ms"), min_delta_ms)
+    add("peak_rss_mb", baseline.get("peak_rss_mb"), current.get("peak_rss_mb"), 0.0)
+    return rows
+
+
+def print_results(result):
+    print("\n" + "=" * 40)
+    print(f"{'stage':<16}{'median ms':>12}{'min ms':>12}")
+    print("=" * 40)
+    for stage, s in result["stages"].items():
+        print(f"{stage:<16}{s['median_ms']:>12.1f}{s['min_ms']:>12.1f}")
+    print("-" * 40)
+    print(f"{'total':<16}{result['total_median_ms']:>12.1f}")
+    print(f"{'wall':<16}{result['wall_median_ms']:>12.1f}")
+    print(f"Peak RSS: {result['peak_rss_mb']:.1f} MiB")
+    print(f"Model calls: {result['model_calls']}, images: {result['model_images']}, raw score: {result['raw_score']}")
+    if "prompt_templates" in result:
+        print(f"Prompt templates built: {result['prompt_templates']}")
+
+
+def print_comparison(rows):
+    print("\n" + "=" * 66)
+    print(f"{'metric':<20}{'baseline':>12}{'current':>12}{'change':>10}")
+    print("=" * 66)
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(f"{r['metric']:<20}{r['baseline']:>12.1f}{r['current']:>12.1f}{r['change']:>+10.1%}{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark with a stub recognizer")
+    parser.add_argument("--pages", nargs=2, default=None, help="Page 1 and page 2 scans (default: bundled sample subject)")
+    parser.add_argument("--repeat", type=int, default=3, help="Pipeline runs; stage timings report the median")
+    parser.add_argument("--answers", type=str, default=None, help="Recorded answers for the stub to replay (results.json, list or mapping)")
+    parser.add_argument("--stub-call-latency", type=float, default=0.0, help="Simulated seconds per stub forward pass")
+    parser.add_argument("--stub-image-latency", type=float, default=0.0, help="Simulated seconds per stub image")
+    parser.add_argument("--blank-threshold", type=float, default=BLANK_INK_THRESHOLD, help="Ink ratio below which a cell is treated as EMPTY")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every answer cell to the stub, even blank ones")
+    parser.add_argument("--target-dpi", type=int, default=None, help="Straighten pages straight to this resolution (e.g. 200)")
+    parser.add_argument("--score-all", action="store_true", help="Scan all 160 items, ignoring the ceiling")
+    parser.add_argument("--row-mode", action="store_true", help="Read each answer row in one stub call")
+    parser.add_argument("--digit-tier", action="store_true", help="Read confident cells with the CPU digit classifier first")
+    parser.add_argument("--digit-model", type=str, default=DEFAULT_DIGIT_MODEL, help="Digit classifier model (see digit_classifier.py)")
+    parser.add_argument("--parallel", type=int, default=1, help="Stub models run at the same time, each on its own worker")
+    parser.add_argument("--debug-level", choices=sorted(DEBUG_LEVELS), default="sampled", help="Debug images written in the debug stages")
+    parser.add_argument("--debug-format", choices=sorted(IMAGE_FORMATS), default="png", help="Encoding of debug images")
+    parser.add_argument("--png-compress-level", type=int, default=1, help="zlib level for PNG debug images (0-9)")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Where to write the JSON result")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON to check for regressions (exit code 1 on regression)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    register_heif()
+    page_paths = args.pages or [os.path.join(SAMPLE_DIR, name) for name in SAMPLE_PAGES]
+    result = run_benchmark(page_paths, repeat=args.repeat,
+                           answers=load_recorded_answers(args.answers) if args.answers else None,
+                           call_latency=args.stub_call_latency, image_latency=args.stub_image_latency,
+                           blank_threshold=None if args.no_prefilter else args.blank_threshold,
+                           target_dpi=args.target_dpi, score_all=args.score_all, row_mode=args.row_mode,
+                           debug_settings={"level": args.debug_level, "image_format": args.debug_format,
+                                           "png_compress_level": args.png_compress_level},
+                           digits=DigitClassifier(args.digit_model) if args.digit_tier else None, parallel=args.parallel)
+    print_results(result)
+
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Benchmark saved to: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare_results(result, baseline, tolerance=args.tolerance, min_delta_ms=args.min_delta_ms)
+        print_comparison(rows)
+        regressions = [r["metric"] for r in rows if r["regression"]]
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
@@ -0,0 +1,130 @@
+import math
+import cv2
+import numpy as np
+from PIL import Image
+from prefilter import _to_gray, ink_mask, inner_bounds
+
+# Qwen2-VL: 14px vision patches, merged 2x2 into one visual token
+VISION_TOKEN_PIXELS = 28
+# Qwen2-VL image processor defaults
+MIN_PIXELS = 56 * 56
+
+CELL_MODES = ("binary", "gray", "color")
+
+# Default normalized cell: 56x84 pixels = 2 x 3 = 6 visual tokens
+DEFAULT_CELL_TARGET = (56, 84)
+
+
+def visual_tokens(height, width, max_pixels=512 * 512, min_pixels=MIN_PIXELS):
+    """
+    Visual tokens Qwen2-VL spends on an image of this size.
+
+    Mirrors the processor's smart_resize: both sides are rounded to multiples of
+    28 pixels, then scaled down to max_pixels or up to min_pixels.
+    """
+    f = VISION_TOKEN_PIXELS
+    h = max(f, round(height / f) * f)
+    w = max(f, round(width / f) * f)
+    if h * w > max_pixels:
+        beta = math.sqrt(height * width / max_pixels)
+        h = max(f, math.floor(height / beta / f) * f)
+        w = max(f, math.floor(width / beta / f) * f)
+    elif h * w < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h = math.ceil(height * beta / f) * f
+        w = math.ceil(width * beta / f) * f
+    return (h // f) * (w // f)
+
+
+def parse_cell_target(text):
+    """Parse a "HEIGHTxWIDTH" target such as "56x84" into (56, 84)."""
+    try:
+        height, width = (int(v) for v in text.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Cell target must look like 56x84, got '{text}'")
+    if height <= 0 or width <= 0:
+        raise ValueError(f"Cell target must be positive, got '{text}'")
+    return height, width
+
+
+class CellEncoder:
+    """
+    Normalizes answer cells before they are sent to a VLM, so each cell costs a fixed,
+    small number of visual tokens.
+
+    The context buffer and grid lines are dropped by cropping to the bounding box of
+    the handwriting (the prefilter's ink mask) plus a margin. The crop is then
+    rendered as black ink on white ("binary"), as contrast-stretched grayscale
+    ("gray") or left in color. It is fitted into a height x width canvas, keeping its
+    aspect ratio. Sides that are multiples of 28 pixels map exactly onto Qwen2-VL's
+    visual tokens.
+
+    Args:
+        height, width: Output size in pixels (56x84 = 6 visual tokens)
+        margin: Padding around the ink box, as a fraction of its larger side
+        mode: "binary", "gray" or "color"
+    """
+
+    def __init__(self, height=DEFAULT_CELL_TARGET[0], width=DEFAULT_CELL_TARGET[1], margin=0.15, mode="binary"):
+        if mode not in CELL_MODES:
+            raise ValueError(f"Unknown cell mode '{mode}', expected one of {CELL_MODES}")
+        self.height = height
+        self.width = width
+        self.margin = margin
+        self.mode = mode
+
+    @property
+    def tokens(self):
+        return visual_tokens(self.height, self.width)
+
+    def describe(self):
+        return f"{self.height}x{self.width} {self.mode}"
+
+    def encode(self, cell):
+        """Normalize one cell (PIL image or NumPy array); returns an RGB uint8 array."""
+        if isinstance(cell, Image.Image):
+            cell = np.asarray(cell.convert("RGB"))
+        gray = _to_gray(cell)
+        y0, y1, x0, x1 = inner_bounds(gray.shape)
+        mask = ink_mask(gray)
+        ys, xs = np.nonzero(mask)
+        if len(ys):
+            # Ink box in cell coordinates, grown by the margin (the buffer is there to absorb it)
+            top, bottom = y0 + ys.min(), y0 + ys.max() + 1
+            left, right = x0 + xs.min(), x0 + xs.max() + 1
+            pad = int(round(self.margin * max(bottom - top, right - left)))
+            top, left = max(0, top - pad), max(0, left - pad)
+            bottom, right = min(gray.shape[0], bottom + pad), min(gray.shape[1], right + pad)
+        else:
+            top, bottom, left, right = y0, y1, x0, x1
+
+        if self.mode == "binary":
+            box = np.full((bottom - top, right - left), 255, np.uint8)
+            ink = mask[max(top - y0, 0):bottom - y0, max(left - x0, 0):right - x0]
+            oy, ox = max(y0 - top, 0), max(x0 - left, 0)
+            box[oy:oy + ink.shape[0], ox:ox + ink.shape[1]][ink] = 0
+        elif self.mode == "gray":
+            box = gray[top:bottom, left:right]
+            lo, hi = np.percentile(box, (2, 98)) if box.size else (0, 255)
+            box = np.clip((box.astype(np.float32) - lo) * (255.0 / max(hi - lo, 1.0)), 0, 255).astype(np.uint8)
+        else:
+            box = np.asarray(cell)[top:bottom, left:right]
+        return self._fit(box)
+
+    def _fit(self, box):
+        h, w = box.shape[:2]
+        scale = min(self.height / max(h, 1), self.width / max(w, 1))
+        nh, nw = max(1, int(round(h * scale))), max(1, int(round(w * scale)))
+        interp = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        resized = cv2.resize(box, (nw, nh), interpolation=interp)
+        if resized.ndim == 2:
+            resized = cv2.cvtColor(resized, cv2.COLOR_GRAY2RGB)
+        canvas = np.full((self.height, self.width, 3), 255, np.uint8)
+        top, left = (self.height - nh) // 2, (self.width - nw) // 2
+        canvas[top:top + nh, left:left + nw] = resized
+        return canvas
+
+
+def encode_items(items, encoder):
+    """Answer items with their cell images replaced by the encoder's normalized cells."""
+    return [(q, p_idx, c_idx, encoder.encode(cell)) for q, p_idx, c_idx, cell in items]
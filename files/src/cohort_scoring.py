@@ -0,0 +1,254 @@
+import os
+import json
+import argparse
+import numpy as np
+from config import (CEILING_CONSECUTIVE_WRONG, NOT_REQUESTED, NOT_REQUESTED_TIER, NOT_SCANNED, NOT_SCANNED_TIER,
+                    WJ_MATH_ANSWER_KEY, normalize_answer)
+
+# Name of the built-in key in score_cohort's results
+DEFAULT_KEY_NAME = "wj_math"
+
+
+class CohortAnswers:
+    """
+    Normalized answers of N protocols as an N x items array, ready for score_cohort.
+
+    Attributes:
+        answers: (N, items) unicode array of normalize_answer output ("" = nothing read)
+        scanned: (N, items) bool, False for items the scanner skipped (tier beyond_ceiling or not_requested)
+        present: (N, items) bool, False for padding behind a protocol shorter than the rest
+        conf, tier: (N, items) object arrays copied from result dicts (True / None for strings)
+    """
+
+    def __init__(self, answers, scanned, present, conf, tier):
+        self.answers = answers
+        self.scanned = scanned
+        self.present = present
+        self.conf = conf
+        self.tier = tier
+
+    def __len__(self):
+        return len(self.answers)
+
+    @classmethod
+    def from_results(cls, protocols):
+        """
+        Build from per-protocol OCR results, each in score_results' input format (a list
+        of {"ans", "conf", "tier"} dicts or of raw strings).
+
+        Every distinct raw answer is normalized once and spread back with a lookup, so a
+        cohort costs one normalize_answer call per distinct string (a few hundred), not
+        one per item.
+        """
+        n = len(protocols)
+        items = max((len(p) for p in protocols), default=0)
+        raw = np.full((n, items), "", dtype=object)
+        present = np.zeros((n, items), dtype=bool)
+        conf = np.full((n, items), True, dtype=object)
+        tier = np.full((n, items), None, dtype=object)
+        for r, results in enumerate(protocols):
+            present[r, :len(results)] = True
+            for i, res in enumerate(results):
+                if isinstance(res, dict):
+                    raw[r, i] = str(res["ans"])
+                    conf[r, i] = res["conf"]
+                    tier[r, i] = res.get("tier")
+                else:
+                    raw[r, i] = str(res).strip().upper()
+        scanned = present & (tier != NOT_SCANNED_TIER) & (tier != NOT_REQUESTED_TIER)
+        return cls(normalize_answers(raw), scanned, present, conf, tier)
+
+    @classmethod
+    def from_reports(cls, reports):
+        """Build from score_results reports (e.g. the "report" of batch_scanner's results.json)."""
+        return cls.from_results([[{"ans": e["detected"], "conf": e["conf"], "tier": e["tier"]} for e in report]
+                                 for report in reports])
+
+
+def normalize_answers(raw):
+    """
+    normalize_answer over an array of raw OCR strings, by lookup over the distinct values.
+
+    Returns:
+        Unicode array of the same shape
+    """
+    raw = np.asarray(raw, dtype=object)
+    if raw.size == 0:
+        return np.zeros(raw.shape, dtype="<U1")
+    uniques, inverse = np.unique(raw.astype(str), return_inverse=True)
+    table = np.array([normalize_answer(u) for u in uniques.tolist()])
+    return table[inverse].reshape(raw.shape)
+
+
+def key_array(key, items):
+    """
+    An answer key as a unicode array of `items` entries, stripped like score_results does.
+
+    Items past the end of the key are set to a value no normalized answer can equal
+    (normalized answers are digits only).
+    """
+    out = np.full(items, "-", dtype=object)
+    n = min(len(key), items)
+    out[:n] = [str(a).strip() for a in key[:n]]
+    return out.astype(str)
+
+
+def score_cohort(cohort, keys=None, apply_ceiling=False, ceiling_run=CEILING_CONSECUTIVE_WRONG):
+    """
+    Score every protocol of a cohort against one or more answer keys at once.
+
+    Same rules as score_results, as array operations over the (N, items) answers:
+    an item scores when it equals the key, and with apply_ceiling nothing scores
+    after the item that completes `ceiling_run` consecutive wrong answers. Skipped
+    items (NOT SCANNED, NOT REQUESTED) neither score nor break or extend a run, and items past
+    the end of a key are not scored against it.
+
+    The run length of consecutive wrong answers at every item is the count of
+    wrong items so far minus that count at the last correct item, which a running
+    maximum carries forward.
+
+    Args:
+        cohort: CohortAnswers
+        keys: {name: answer list} (default: {"wj_math": WJ_MATH_ANSWER_KEY})
+        apply_ceiling: Enforce the ceiling rule (False scores every item)
+
+    Returns:
+        {name: {"match", "scored", "raw_scores", "ceiling_items", "p_values"}}:
+        match (N, items) bool item equals the key; scored (N, items) bool item counts
+        toward the raw score; raw_scores (N,); ceiling_items (N,) question number that
+        completed the ceiling run, 0 for none; p_values (items,) share of protocols
+        that got the item right among those it was administered to (scanned and not
+        past the ceiling), NaN where nobody was
+    """
+    keys = keys or {DEFAULT_KEY_NAME: WJ_MATH_ANSWER_KEY}
+    n, items = cohort.answers.shape
+    cols = np.arange(items)
+    out = {}
+    for name, key in keys.items():
+        in_key = cols < len(key)
+        counted = cohort.scanned & in_key
+        match = (cohort.answers == key_array(key, items)) & counted
+        wrong = counted & ~match
+
+        if apply_ceiling and items:
+            wrong_so_far = np.cumsum(wrong, axis=1)
+            at_last_correct = np.maximum.accumulate(np.where(match, wrong_so_far, 0), axis=1)
+            hit = (wrong_so_far - at_last_correct) >= ceiling_run
+            has_ceiling = hit.any(axis=1)
+            ceiling_idx = np.where(has_ceiling, hit.argmax(axis=1), items)
+        else:
+            has_ceiling = np.zeros(n, dtype=bool)
+            ceiling_idx = np.full(n, items)
+        before_ceiling = cols[None, :] <= ceiling_idx[:, None]
+        scored = match & before_ceiling
+        administered = counted & before_ceiling
+
+        given = administered.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            p_values = np.where(given > 0, scored.sum(axis=0) / given, np.nan)
+        out[name] = {
+            "match": match,
+            "scored": scored,
+            "raw_scores": scored.sum(axis=1),
+            "ceiling_items": np.where(has_ceiling, ceiling_idx + 1, 0),
+            "p_values": p_values,
+        }
+    return out
+
+
+def protocol_report(cohort, scores, row, key=None):
+    """
+    score_results' (raw_score, detailed_report) for one protocol of a scored cohort.
+
+    Args:
+        cohort: CohortAnswers that was scored
+        scores: One key's entry of score_cohort's result
+        row: Protocol index
+        key: That key's answer list (default: WJ_MATH_ANSWER_KEY)
+    """
+    key = WJ_MATH_ANSWER_KEY if key is None else key
+    items = min(int(cohort.present[row].sum()), len(key))
+    expected = key_array(key, items).tolist()
+    ceiling_item = int(scores["ceiling_items"][row])
+    report = []
+    for i in range(items):
+        entry = {"question": i + 1}
+        if not cohort.scanned[row, i] and cohort.tier[row, i] == NOT_REQUESTED_TIER:
+            entry.update(detected=NOT_REQUESTED, expected=expected[i], status="⏭", ceiling=False)
+        elif not cohort.scanned[row, i]:
+            entry.update(detected=NOT_SCANNED, expected=expected[i], status="⏭", ceiling=True)
+        else:
+            is_match = bool(scores["match"][row, i])
+            entry.update(detected=cohort.answers[row, i] or "EMPTY", expected=expected[i],
+                         status="✅" if is_match else "❌", ceiling=bool(ceiling_item) and i + 1 > ceiling_item)
+        entry.update(conf=cohort.conf[row, i], tier=cohort.tier[row, i])
+        report.append(entry)
+    return int(scores["raw_scores"][row]), report
+
+
+def load_key(path):
+    """An answer key from a JSON list of answers, or a {"question": answer} mapping."""
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data[q] for q in sorted(data, key=int)]
+    return data
+
+
+def find_results(root, filename="results.json"):
+    """Every batch_scanner results file below root, in path order."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if filename in filenames:
+            paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rescore cached OCR results of many protocols against one or more answer keys")
+    parser.add_argument("--root", type=str, required=True, help="Folder searched for results.json files (see batch_scanner.py)")
+    parser.add_argument("--key", action="append", default=[], metavar="NAME=PATH",
+                        help="Extra answer key (JSON list or {question: answer}); repeat for several forms")
+    parser.add_argument("--score-all", action="store_true", help="Score all items, ignoring the ceiling")
+    parser.add_argument("--output", type=str, default=None, help="Also write scores and p-values as JSON here")
+    args = parser.parse_args()
+
+    keys = {DEFAULT_KEY_NAME: WJ_MATH_ANSWER_KEY}
+    for spec in args.key:
+        name, _, path = spec.partition("=")
+        if not path:
+            parser.error(f"--key expects NAME=PATH, got '{spec}'")
+        keys[name] = load_key(path)
+
+    paths = find_results(args.root)
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            reports.append(json.load(f)["report"])
+    print(f"Found {len(paths)} results files under {args.root}")
+    cohort = CohortAnswers.from_reports(reports)
+    scores = score_cohort(cohort, keys, apply_ceiling=not args.score_all)
+
+    names = list(keys)
+    print("\n" + f"{'protocol':<48}" + "".join(f"{n:>12}" for n in names))
+    for i, path in enumerate(paths):
+        label = os.path.relpath(os.path.dirname(path), args.root)
+        print(f"{label:<48}" + "".join(f"{int(scores[n]['raw_scores'][i]):>12}" for n in names))
+    for name in names:
+        p = scores[name]["p_values"]
+        hardest = [int(q) + 1 for q in np.argsort(np.nan_to_num(p, nan=np.inf))[:10] if not np.isnan(p[q])]
+        print(f"\n{name}: mean raw score {scores[name]['raw_scores'].mean():.1f}, hardest items {hardest}")
+
+    if args.output:
+        result = {"protocols": [os.path.dirname(p) for p in paths], "keys": {}}
+        for name in names:
+            s = scores[name]
+            result["keys"][name] = {
+                "raw_scores": s["raw_scores"].tolist(),
+                "ceiling_items": s["ceiling_items"].tolist(),
+                "p_values": [None if np.isnan(v) else round(float(v), 4) for v in s["p_values"]],
+            }
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Scores saved to: {args.output}")
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import argparse
+from backends import BACKENDS, DEFAULT_MODEL_IDS, create_backend
+from batch_scanner import discover_subjects
+from config import WJ_MATH_ANSWER_KEY, load_truth, normalize_answer, score_results
+from image_utils import load_page
+from prefilter import BLANK_INK_THRESHOLD
+from main_scanner import load_backends, prepare_pages, prepare_row_images, scan_answer_items
+
+MODES = ("cell", "row")
+
+
+class CallCounter:
+    """Counts recognize() calls, images and forward passes of a wrapped backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.reset()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def reset(self):
+        self.calls = 0
+        self.images = 0
+        self.batches = 0
+
+    def recognize(self, images, **kwargs):
+        self.calls += 1
+        self.images += len(images)
+        self.batches += -(-len(images) // self.backend.batch_size)
+        return self.backend.recognize(images, **kwargs)
+
+
+def compare_subject(subject, backends, blank_threshold=BLANK_INK_THRESHOLD, target_dpi=None):
+    """
+    Scan one subject in per-cell and in row mode with the same loaded backends.
+
+    Both modes score all 160 items so their outputs line up item for item.
+
+    Returns:
+        Dict with one {"seconds", "model_images", "forward_passes", "raw_score", ...} entry per mode
+    """
+    p1, p2 = subject["pages"]
+    pages = [load_page(p, target_dpi=target_dpi) for p in (p1, p2)]
+    answer_items = prepare_pages(p1, p2, subject["dir"], debug=False, pages=pages)
+    row_images = prepare_row_images(p1, p2, pages=pages)
+    truth = load_truth(subject["dir"])
+
+    out = {"user": subject["user"], "subject": subject["subject"]}
+    detected = {}
+    for mode in MODES:
+        for b in backends:
+            b.reset()
+        start = time.perf_counter()
+        scanned = scan_answer_items(answer_items, backends, blank_threshold=blank_threshold,
+                                    row_images=row_images if mode == "row" else None)
+        seconds = time.perf_counter() - start
+        raw_score, report = score_results(scanned)
+        detected[mode] = [normalize_answer(e["detected"]) for e in report]
+        tiers = {}
+        for res in scanned:
+            tiers[res["tier"]] = tiers.get(res["tier"], 0) + 1
+        entry = {
+            "seconds": round(seconds, 3),
+            "model_images": sum(b.images for b in backends),
+            "forward_passes": sum(b.batches for b in backends),
+            "raw_score": raw_score,
+            "tiers": tiers,
+        }
+        if truth is not None:
+            hits = sum(1 for e in report if normalize_answer(e["detected"]) == normalize_answer(truth.get(e["question"], "")))
+            entry["accuracy"] = round(hits / len(report), 4)
+        out[mode] = entry
+    out["agreement"] = round(sum(a == b for a, b in zip(detected["cell"], detected["row"])) / len(answer_items), 4)
+    return out
+
+
+def print_comparison(results):
+    print("\n" + "=" * 78)
+    print(f"{'subject':<28}{'mode':<6}{'seconds':>9}{'images':>8}{'passes':>8}{'raw':>6}{'accuracy':>10}")
+    print("=" * 78)
+    for r in results:
+        name = f"{r['user']}/{r['subject']}"
+        for mode in MODES:
+            e = r[mode]
+            acc = f"{e['accuracy']:.1%}" if "accuracy" in e else "n/a"
+            print(f"{name:<28}{mode:<6}{e['seconds']:>9.2f}{e['model_images']:>8}{e['forward_passes']:>8}"
+                  f"{e['raw_score']:>6}{acc:>10}")
+            name = ""
+        print(f"{'':<28}cell/row agreement: {r['agreement']:.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-cell and row-mode inference on sample protocols")
+    parser.add_argument("--root", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data"),
+                        help="Folder containing user-*/sub-*/ subject folders (default: bundled sample data)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mlx", help="Recognizer backend (mlx, cpu or stub)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per model forward pass")
+    parser.add_argument("--blank-threshold", type=float, default=BLANK_INK_THRESHOLD, help="Ink ratio below which a cell is treated as EMPTY")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every answer cell to the models, even blank ones")
+    parser.add_argument("--target-dpi", type=int, default=None, help="Straighten pages straight to this resolution (e.g. 200)")
+    parser.add_argument("--stub-call-latency", type=float, default=0.05, help="Stub backend: simulated seconds per forward pass")
+    parser.add_argument("--stub-image-latency", type=float, default=0.01, help="Stub backend: simulated seconds per image")
+    parser.add_argument("--output", type=str, default=None, help="Also write the comparison as JSON to this path")
+    args = parser.parse_args()
+
+    if args.backend == "stub":
+        # The stub replays the answer key, so row and cell mode only differ in cost
+        answers = {i + 1: a for i, a in enumerate(WJ_MATH_ANSWER_KEY)}
+        backends = [create_backend("stub", m, answers=answers, batch_size=args.batch_size,
+                                   call_latency=args.stub_call_latency, image_latency=args.stub_image_latency)
+                    for m in DEFAULT_MODEL_IDS]
+    else:
+        backends = load_backends(args.backend, batch_size=args.batch_size)
+    backends = [CallCounter(b) for b in backends]
+
+    results = [compare_subject(s, backends, blank_threshold=None if args.no_prefilter else args.blank_threshold,
+                               target_dpi=args.target_dpi)
+               for s in discover_subjects(args.root)]
+    print_comparison(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Comparison saved to: {args.output}")
@@ -1,4 +1,6 @@
+import os
 import re
+import json
 
 WJ_MATH_ANSWER_KEY = [
     0, 3, 4, 2, 3, 0, 0, 3, 1, 6,
@@ -19,7 +21,126 @@ WJ_MATH_ANSWER_KEY = [
     14, 11, 64, 4, 16, 18, 0, 1, 36, 10
 ]
 
-def score_results(ocr_results):
+# Optional hand transcription of a subject's answers: a list of 160 answers or {"question": answer}
+TRUTH_FILENAME = "truth.json"
+
+def load_truth(subject_dir):
+    """Hand-transcribed answers for a subject as {question_num: answer}, or None if there is no truth.json."""
+    path = os.path.join(subject_dir, TRUTH_FILENAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return {i + 1: str(a) for i, a in enumerate(data)}
+    return {int(q): str(a) for q, a in data.items()}
+
+# Shortest and longest answers in the key, used to sanity-check OCR output
+ANSWER_DIGIT_RANGE = (min(len(str(a)) for a in WJ_MATH_ANSWER_KEY),
+                      max(len(str(a)) for a in WJ_MATH_ANSWER_KEY))
+
+def is_plausible_answer(raw_text):
+    """
+    Check whether an OCR answer looks like something a student could have written.
+
+    The answer must be purely numeric (after stripping whitespace) and have a digit
+    count inside ANSWER_DIGIT_RANGE. "EMPTY" is not considered plausible here because
+    cells that reach the models already passed the blank-cell prefilter.
+    """
+    text = str(raw_text).strip().upper().replace(" ", "")
+    if not text.isdigit():
+        return False
+    return ANSWER_DIGIT_RANGE[0] <= len(text) <= ANSWER_DIGIT_RANGE[1]
+
+# WJ discontinue rules, in consecutive items (administration order)
+CEILING_CONSECUTIVE_WRONG = 6
+BASAL_CONSECUTIVE_CORRECT = 6
+
+# Marker for items the scanner never sent to OCR because the ceiling came first
+NOT_SCANNED = "NOT SCANNED"
+NOT_SCANNED_TIER = "beyond_ceiling"
+
+# Marker for items left out on request (--limit): not scanned, but not past any ceiling either
+NOT_REQUESTED = "NOT REQUESTED"
+NOT_REQUESTED_TIER = "not_requested"
+
+def normalize_answer(raw_text):
+    """
+    Reduce raw OCR text to the digits that are compared against the key.
+
+    Returns:
+        The digit string ("" when nothing usable was read)
+    """
+    # Handle common OCR confusions
+    raw_text = str(raw_text).strip().upper()
+    
+    # USE REGEX TO EXTRACT ONLY THE DIGITS
+    # This prevents "The answer is 5" from being marked wrong
+    digits_only = re.sub(r"\D", "", raw_text)
+    
+    # Common OCR fixes
+    if not digits_only:
+        # Check for letters that look like numbers if no digits found
+        if "O" in raw_text: digits_only = "0"
+        elif "I" in raw_text or "L" in raw_text: digits_only = "1"
+    return digits_only
+
+class IncrementalScorer:
+    """
+    Tracks the WJ basal and ceiling rules one item at a time, in administration order.
+
+    The scanner feeds it each answer as soon as it is recognized and stops sending
+    cells to the models once `ceiling_reached` is set.
+
+    Args:
+        ceiling_run: Consecutive wrong answers that establish the ceiling
+        basal_run: Consecutive correct answers that establish the basal
+    """
+
+    def __init__(self, ceiling_run=CEILING_CONSECUTIVE_WRONG, basal_run=BASAL_CONSECUTIVE_CORRECT):
+        self.ceiling_run = ceiling_run
+        self.basal_run = basal_run
+        self.items_scored = 0
+        self.raw_score = 0
+        self.consecutive_wrong = 0
+        self.consecutive_correct = 0
+        self.ceiling_item = None  # question number that completed the ceiling run
+        self.basal_item = None    # question number that completed the basal run
+
+    @property
+    def ceiling_reached(self):
+        return self.ceiling_item is not None
+
+    @property
+    def basal_reached(self):
+        return self.basal_item is not None
+
+    def add(self, raw_text):
+        """
+        Score the next item.
+
+        Returns:
+            True if the answer matched the key
+        """
+        i = self.items_scored
+        self.items_scored += 1
+        if i >= len(WJ_MATH_ANSWER_KEY) or self.ceiling_reached:
+            return False
+        is_match = normalize_answer(raw_text) == str(WJ_MATH_ANSWER_KEY[i]).strip()
+        if is_match:
+            self.raw_score += 1
+            self.consecutive_wrong = 0
+            self.consecutive_correct += 1
+            if not self.basal_reached and self.consecutive_correct >= self.basal_run:
+                self.basal_item = i + 1
+        else:
+            self.consecutive_correct = 0
+            self.consecutive_wrong += 1
+            if self.consecutive_wrong >= self.ceiling_run:
+                self.ceiling_item = i + 1
+        return is_match
+
+def score_results(ocr_results, apply_ceiling=False):
     """
     Score OCR results against the WJ Math answer key.
     
@@ -28,8 +149,12 @@ def score_results(ocr_results):
     - Scoring stops at the "ceiling" (6 consecutive wrong answers)
     - No points are awarded after the ceiling is reached
     
+    Items the scanner skipped because the ceiling was reached (tier
+    "beyond_ceiling") are reported as NOT SCANNED and never score.
+    
     Args:
         ocr_results: List of strings from OCR detection
+        apply_ceiling: Enforce the ceiling rule (False scores every item, for validation)
         
     Returns:
         tuple: (raw_score, detailed_report)
@@ -37,9 +162,8 @@ def score_results(ocr_results):
     raw_score = 0
     consecutive_wrong = 0
     detailed_report = []
-    ceiling_reached = False  # Disabled for testing all items
+    ceiling_reached = False
     
-    # For testing: Score all items, ignore ceiling rule
     for i, user_ans in enumerate(ocr_results):
         if i >= len(WJ_MATH_ANSWER_KEY): 
             break
@@ -47,44 +171,61 @@ def score_results(ocr_results):
         if isinstance(user_ans, dict):
             raw_text = user_ans["ans"]
             conf = user_ans["conf"]
+            tier = user_ans.get("tier")
         else:
             raw_text = str(user_ans).strip().upper()
             conf = True
+            tier = None
         
         # Normalize both answer key and OCR result to strings
         correct_ans = str(WJ_MATH_ANSWER_KEY[i]).strip()
-        # Handle common OCR confusions
-        raw_text = str(raw_text).strip().upper()
-        
-        # USE REGEX TO EXTRACT ONLY THE DIGITS
-        # This prevents "The answer is 5" from being marked wrong
-        digits_only = re.sub(r"\D", "", raw_text)
         
-        # Common OCR fixes
-        if not digits_only:
-            # Check for letters that look like numbers if no digits found
-            if "O" in raw_text: digits_only = "0"
-            elif "I" in raw_text or "L" in raw_text: digits_only = "1"
+        if tier == NOT_SCANNED_TIER:
+            detailed_report.append({
+                "question": i + 1,
+                "detected": NOT_SCANNED,
+                "expected": correct_ans,
+                "status": "⏭",
+                "ceiling": True,
+                "conf": conf,
+                "tier": tier
+            })
+            continue
+        if tier == NOT_REQUESTED_TIER:
+            detailed_report.append({
+                "question": i + 1,
+                "detected": NOT_REQUESTED,
+                "expected": correct_ans,
+                "status": "⏭",
+                "ceiling": False,
+                "conf": conf,
+                "tier": tier
+            })
+            continue
         
-        clean_ans = digits_only
+        clean_ans = normalize_answer(raw_text)
         is_match = (clean_ans == correct_ans)
         
-        # For testing: Always award points for matches, score all items
-        if is_match:
+        # After ceiling is reached, no more points are awarded
+        # (raw_score remains unchanged)
+        if is_match and not ceiling_reached:
             raw_score += 1
+        if is_match:
             consecutive_wrong = 0
         else:
             consecutive_wrong += 1
-        # After ceiling is reached, no more points are awarded
-        # (raw_score remains unchanged)
+        in_ceiling = ceiling_reached
+        if apply_ceiling and consecutive_wrong >= CEILING_CONSECUTIVE_WRONG:
+            ceiling_reached = True
         
         detailed_report.append({
             "question": i + 1,
             "detected": clean_ans if clean_ans else "EMPTY",
             "expected": correct_ans,
             "status": "✅" if is_match else "❌",
-            "ceiling": False,  # Disabled for testing
-            "conf": conf
+            "ceiling": in_ceiling,
+            "conf": conf,
+            "tier": tier  # Which stage produced the answer (prefilter, small, large, ensemble)
         })
 
     return raw_score, detailed_report
@@ -0,0 +1,157 @@
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+import instrumentation
+
+# What each debug level writes:
+#   intermediates  *_clean.png / *_clean_straight.png next to the scan
+#   grid           page_N_viz.png content-box overlay
+#   row_checks     debug_crops/R*_C1_check.png, first cell of every row
+#   samples        Q1-Q10 answer cells of each page and the DEBUG_QUESTIONS crops
+#   all_cells      every answer cell
+#   disagreements  answer cells the ensemble disagreed on (low confidence)
+DEBUG_LEVELS = {
+    "off": frozenset(),
+    "disagreements": frozenset({"disagreements"}),
+    "sampled": frozenset({"grid", "row_checks", "samples"}),
+    "full": frozenset({"intermediates", "grid", "row_checks", "samples", "all_cells", "disagreements"}),
+}
+
+IMAGE_FORMATS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+
+class DebugWriter:
+    """
+    Leveled debug-artifact writer that encodes and saves images on background threads.
+
+    Callers ask wants(kind) before preparing an artifact and hand images to save(),
+    which returns immediately. At most `max_queue` images wait for a writer thread;
+    save() blocks beyond that so a slow disk cannot pile up page-sized buffers.
+    Cell crops are views into a page that is never modified, so they are queued
+    without copying.
+
+    Args:
+        level: "off", "sampled", "full" or "disagreements" (True = "sampled", False/None = "off")
+        image_format: "png", "jpeg" or "webp"; replaces the extension of every saved path
+        png_compress_level: zlib level for PNG (0-9; low is fast, files are larger)
+        quality: JPEG/WebP quality
+        workers: Encoder threads
+        max_queue: Images allowed to wait for an encoder thread
+    """
+
+    def __init__(self, level="sampled", image_format="png", png_compress_level=1, quality=85,
+                 workers=2, max_queue=128):
+        if level is True:
+            level = "sampled"
+        elif not level:
+            level = "off"
+        if level not in DEBUG_LEVELS:
+            raise ValueError(f"Unknown debug level '{level}', expected one of {sorted(DEBUG_LEVELS)}")
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format '{image_format}', expected one of {sorted(IMAGE_FORMATS)}")
+        self.level = level
+        self.kinds = DEBUG_LEVELS[level]
+        self.image_format = image_format
+        self.png_compress_level = png_compress_level
+        self.quality = quality
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.pool = None
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.written = 0
+        self.errors = []
+
+    def settings(self):
+        """Constructor arguments that recreate this writer's level and encoding (e.g. in a worker process)."""
+        return {"level": self.level, "image_format": self.image_format,
+                "png_compress_level": self.png_compress_level, "quality": self.quality}
+
+    @property
+    def enabled(self):
+        return bool(self.kinds)
+
+    def wants(self, kind):
+        return kind in self.kinds
+
+    def path_for(self, path, image_format=None):
+        """path with its extension replaced by the configured format's."""
+        return os.path.splitext(path)[0] + IMAGE_FORMATS[image_format or self.image_format]
+
+    def save(self, image, path, lossless=False):
+        """
+        Queue a PIL image or RGB NumPy array for writing; returns the final path.
+
+        lossless keeps PNG whatever the configured format (for intermediates that are read back).
+        """
+        image_format = "png" if lossless else self.image_format
+        path = self.path_for(path, image_format)
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="debug-writer")
+        # Covers the wait for a free slot, i.e. the time the caller loses to debug output
+        with instrumentation.span("debug_save", cat="io", file=os.path.basename(path)):
+            self.slots.acquire()
+            try:
+                fut = self.pool.submit(self._write, image, path, image_format)
+            except Exception:
+                self.slots.release()
+                raise
+        with self.lock:
+            self.pending.add(fut)
+        fut.add_done_callback(self._done)
+        return path
+
+    def _write(self, image, path, image_format):
+        with instrumentation.span("debug_write", cat="io", file=os.path.basename(path)):
+            if not isinstance(image, Image.Image):
+                image = Image.fromarray(np.ascontiguousarray(image))
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if image_format == "png":
+                image.save(path, compress_level=self.png_compress_level)
+            else:
+                image.save(path, quality=self.quality)
+
+    def _done(self, fut):
+        self.slots.release()
+        with self.lock:
+            self.pending.discard(fut)
+            if fut.exception() is not None:
+                self.errors.append(str(fut.exception()))
+            else:
+                self.written += 1
+
+    def flush(self):
+        """Block until every queued image is on disk."""
+        with self.lock:
+            pending = list(self.pending)
+        for fut in pending:
+            fut.exception()
+        if self.errors:
+            print(f"Debug writer: {len(self.errors)} images failed to save (first: {self.errors[0]})")
+            self.errors = []
+
+    def close(self):
+        self.flush()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+@contextmanager
+def writer_for(debug):
+    """
+    Use an existing DebugWriter as-is, or build one for a level/bool and close it on exit.
+    """
+    if isinstance(debug, DebugWriter):
+        yield debug
+        return
+    writer = DebugWriter(debug)
+    try:
+        yield writer
+    finally:
+        writer.close()
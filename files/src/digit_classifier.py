@@ -0,0 +1,349 @@
+import os
+import re
+import glob
+import time
+import argparse
+import cv2
+import numpy as np
+from PIL import Image
+from config import ANSWER_DIGIT_RANGE, WJ_MATH_ANSWER_KEY, load_truth
+from prefilter import ink_mask
+
+# Where train_digit_model writes the model by default. No model is bundled: the
+# sample data has one writer and no truth.json, so nothing could be held out.
+DEFAULT_DIGIT_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "digit_model.npz")
+
+# Accuracy the accepted answers must reach on held-out subjects; training picks the
+# acceptance threshold that meets it and stores it in the model
+DIGIT_TARGET_ACCURACY = 0.99
+
+# Glyphs are normalized to a GLYPH_SIZE x GLYPH_SIZE bitmap before matching
+GLYPH_SIZE = 16
+
+# Components smaller than this fraction of the answer region are noise
+MIN_COMPONENT_AREA = 0.002
+# Components shorter than this fraction of the answer region are stray marks (leftovers of the printed problem)
+MIN_GLYPH_HEIGHT = 0.15
+# Wider glyphs are most likely touching digits, which the classifier cannot split
+MAX_GLYPH_ASPECT = 1.2
+
+
+def segment_digits(cell):
+    """
+    Split the handwriting of an answer cell into digit glyphs, left to right.
+
+    The ink mask comes from the blank-cell prefilter (grid lines removed). Connected
+    components that overlap horizontally are merged, so the detached bar of a "5"
+    or a broken stroke stays one glyph.
+
+    Returns:
+        List of boolean NumPy arrays, one tight crop per glyph
+    """
+    mask = ink_mask(cell).astype(np.uint8)
+    if mask.size == 0:
+        return []
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    boxes = sorted([x, y, x + w, y + h] for x, y, w, h, area in stats[1:]
+                   if area >= MIN_COMPONENT_AREA * mask.size)
+    groups = []
+    for box in boxes:
+        if groups:
+            g = groups[-1]
+            overlap = min(g[2], box[2]) - max(g[0], box[0])
+            if overlap >= 0.5 * min(g[2] - g[0], box[2] - box[0]):
+                g[:] = [min(g[0], box[0]), min(g[1], box[1]), max(g[2], box[2]), max(g[3], box[3])]
+                continue
+        groups.append(list(box))
+    min_height = MIN_GLYPH_HEIGHT * mask.shape[0]
+    return [mask[y0:y1, x0:x1].astype(bool) for x0, y0, x1, y1 in groups if y1 - y0 >= min_height]
+
+
+def glyph_features(glyph):
+    """Center a glyph in a square (keeping its aspect ratio) and scale it to GLYPH_SIZE x GLYPH_SIZE."""
+    h, w = glyph.shape
+    side = max(h, w)
+    square = np.zeros((side, side), np.float32)
+    top, left = (side - h) // 2, (side - w) // 2
+    square[top:top + h, left:left + w] = glyph
+    inner = GLYPH_SIZE - 2
+    small = cv2.resize(square, (inner, inner), interpolation=cv2.INTER_AREA)
+    return np.pad(small, 1).ravel()
+
+
+def _normalize(features):
+    features = np.asarray(features, np.float32).reshape(len(features), -1)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return features / np.maximum(norms, 1e-6)
+
+
+class DigitClassifier:
+    """
+    Nearest-neighbour digit reader for answer cells, cheap enough to run on every cell.
+
+    Each glyph is matched against labeled prototype glyphs. Its raw score is the
+    margin between the nearest prototype of the predicted digit and the nearest
+    prototype of any other digit. The cell's raw score (its weakest glyph) is mapped
+    to a probability of the whole answer being right by an isotonic calibration
+    fitted at training time on subjects held out from the prototypes.
+
+    Args:
+        model_path: .npz written by train_digit_model
+        accept_conf: Calibrated confidence needed to accept an answer (None = the
+                     threshold chosen at training, see DIGIT_TARGET_ACCURACY)
+    """
+
+    def __init__(self, model_path=DEFAULT_DIGIT_MODEL, accept_conf=None):
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"No digit model at {model_path}; train one with digit_classifier.py")
+        data = np.load(model_path)
+        self.model_path = model_path
+        self.accept_conf = float(data["accept_conf"]) if accept_conf is None else accept_conf
+        self.prototypes = _normalize(data["features"].astype(np.float32) / 255.0)
+        self.labels = data["labels"].astype(np.int64)
+        self.calib_scores = data["calib_scores"]
+        self.calib_values = data["calib_values"]
+
+    def classify_glyphs(self, glyphs, exclude=None):
+        """
+        Per-glyph digit and margin; exclude masks out prototypes (used for leave-one-out calibration).
+
+        Returns:
+            tuple: (digits, margins) as NumPy arrays parallel to glyphs
+        """
+        feats = _normalize([glyph_features(g) for g in glyphs])
+        dist = 1.0 - feats @ self.prototypes.T
+        if exclude is not None:
+            dist[:, exclude] = np.inf
+        # Nearest prototype of every digit class
+        per_class = np.full((len(glyphs), 10), np.inf, np.float32)
+        for d in range(10):
+            cols = self.labels == d
+            if cols.any():
+                per_class[:, d] = dist[:, cols].min(axis=1)
+        order = np.argsort(per_class, axis=1)
+        best = per_class[np.arange(len(glyphs)), order[:, 0]]
+        second = per_class[np.arange(len(glyphs)), order[:, 1]]
+        margins = np.where(np.isfinite(second), (second - best) / np.maximum(second, 1e-6), 0.0)
+        return order[:, 0], margins
+
+    def raw_read(self, cell, exclude=None):
+        """
+        Answer text and uncalibrated score of a cell.
+
+        Cells that do not split into a plausible number of separate digits score 0.
+        """
+        glyphs = segment_digits(cell)
+        if not glyphs:
+            return "EMPTY", 0.0
+        digits, margins = self.classify_glyphs(glyphs, exclude=exclude)
+        text = "".join(str(d) for d in digits)
+        plausible = ANSWER_DIGIT_RANGE[0] <= len(glyphs) <= ANSWER_DIGIT_RANGE[1]
+        if not plausible or any(g.shape[1] > MAX_GLYPH_ASPECT * g.shape[0] for g in glyphs):
+            return text, 0.0
+        return text, float(margins.min())
+
+    def calibrate(self, raw_score):
+        """Probability that an answer with this raw score is right (0 for cells raw_read could not read)."""
+        if raw_score <= 0:
+            return 0.0
+        i = np.searchsorted(self.calib_scores, raw_score, side="right") - 1
+        return float(self.calib_values[i]) if i >= 0 else 0.0
+
+    def read(self, cell):
+        """
+        Read one answer cell.
+
+        Returns:
+            {"ans": str, "score": calibrated confidence in [0, 1]}
+        """
+        text, raw = self.raw_read(cell)
+        return {"ans": text, "score": self.calibrate(raw)}
+
+    def accepts(self, result):
+        return result["score"] >= self.accept_conf
+
+
+def isotonic_fit(scores, correct):
+    """
+    Pool-adjacent-violators fit of P(correct) as a non-decreasing step function of the raw score.
+
+    Returns:
+        tuple: (lower score bound of each step, probability of each step)
+    """
+    order = np.argsort(scores)
+    scores = np.asarray(scores, np.float64)[order]
+    blocks = []  # [start score, sum correct, count]
+    for s, c in zip(scores, np.asarray(correct, np.float64)[order]):
+        blocks.append([s, c, 1.0])
+        while len(blocks) > 1 and blocks[-2][1] / blocks[-2][2] >= blocks[-1][1] / blocks[-1][2]:
+            s2, c2, n2 = blocks.pop()
+            blocks[-1][1] += c2
+            blocks[-1][2] += n2
+    starts = np.array([b[0] for b in blocks], np.float32)
+    values = np.array([b[1] / b[2] for b in blocks], np.float32)
+    starts[0] = 0.0
+    return starts, values
+
+
+def crop_question(path):
+    """Question number of a debug crop (Q37_page1_cell55.png or page_2_answer_Q3.png), or None."""
+    name = os.path.basename(path)
+    m = re.match(r"Q(\d+)_page\d+_cell\d+\.", name)
+    if m:
+        return int(m.group(1))
+    m = re.match(r"page_(\d)_answer_Q(\d+)\.", name)
+    if m:
+        return (int(m.group(1)) - 1) * 80 + int(m.group(2))
+    return None
+
+
+def load_labeled_crops(debug_dirs):
+    """
+    Answer crops of debug_cells/ folders with their labels.
+
+    Crops are labeled from the truth.json of their subject folder (the parent of
+    debug_cells/). Folders without one are skipped: the answer key is not a label,
+    since a student's wrong answer is exactly what the tier must read.
+
+    Returns:
+        List of (path, cell array, answer string, subject folder)
+    """
+    crops = {}
+    for debug_dir in debug_dirs:
+        subject = os.path.dirname(os.path.abspath(debug_dir))
+        truth = load_truth(subject)
+        if truth is None:
+            print(f"Skipping {debug_dir}: no truth.json in {subject}")
+            continue
+        for path in sorted(glob.glob(os.path.join(debug_dir, "*"))):
+            q = crop_question(path)
+            if q is None or not 1 <= q <= len(WJ_MATH_ANSWER_KEY):
+                continue
+            label = truth.get(q)
+            if label is None or not str(label).isdigit():
+                continue
+            # Several file names can hold the same cell; keep one crop per question and folder
+            crops.setdefault((debug_dir, q), (path, np.asarray(Image.open(path).convert("RGB")), str(label), subject))
+    return list(crops.values())
+
+
+def accept_threshold(conf, correct, target_accuracy=DIGIT_TARGET_ACCURACY):
+    """
+    Lowest confidence whose accepted cells (conf >= it) are at least target_accuracy correct.
+
+    Returns inf (accept nothing) when no threshold reaches the target.
+    """
+    order = np.argsort(-np.asarray(conf), kind="stable")
+    conf = np.asarray(conf, np.float64)[order]
+    hits = np.cumsum(np.asarray(correct, np.float64)[order])
+    threshold = np.inf
+    for i in range(len(conf)):
+        # Only cut between distinct confidences: equal scores are accepted together
+        if (i + 1 == len(conf) or conf[i + 1] < conf[i]) and hits[i] / (i + 1) >= target_accuracy:
+            threshold = conf[i]
+    return float(threshold)
+
+
+def train_digit_model(crops, output_path=DEFAULT_DIGIT_MODEL, target_accuracy=DIGIT_TARGET_ACCURACY):
+    """
+    Build prototypes from labeled cell crops and calibrate the confidence on held-out subjects.
+
+    Glyphs only become prototypes when the cell splits into exactly as many glyphs
+    as its label has digits. Calibration reads every subject's cells with that
+    subject's prototypes left out (leave-one-subject-out), so the confidences and
+    the acceptance threshold reflect writers the model has not seen.
+
+    Args:
+        crops: List of (path, cell array, answer string, subject), see load_labeled_crops
+        target_accuracy: Held-out accuracy the accepted answers must reach
+
+    Returns:
+        Stats dict: prototypes, cells, accept_conf, held-out accuracy and coverage overall
+        and per subject
+    """
+    subjects = sorted({c[3] for c in crops})
+    if len(subjects) < 2:
+        raise ValueError("Calibration needs labeled crops of at least two subjects (one is held out at a time)")
+    features, labels, owners = [], [], []
+    for _, cell, label, subject in crops:
+        glyphs = segment_digits(cell)
+        if len(glyphs) != len(label):
+            continue
+        for glyph, digit in zip(glyphs, label):
+            features.append(np.round(glyph_features(glyph) * 255).astype(np.uint8))
+            labels.append(int(digit))
+            owners.append(subjects.index(subject))
+    if not features:
+        raise ValueError("No crop segmented into its labeled number of digits")
+    features = np.stack(features)
+    labels = np.array(labels, np.int8)
+    owners = np.array(owners)
+
+    # Save uncalibrated first so the classifier can be loaded for the held-out reads
+    np.savez_compressed(output_path, features=features, labels=labels, calib_scores=np.zeros(1, np.float32),
+                        calib_values=np.zeros(1, np.float32), accept_conf=np.float32(np.inf))
+    clf = DigitClassifier(output_path)
+    raw, correct = [], []
+    for _, cell, label, subject in crops:
+        text, score = clf.raw_read(cell, exclude=owners == subjects.index(subject))
+        raw.append(score)
+        correct.append(text == label)
+    calib_scores, calib_values = isotonic_fit(raw, correct)
+    np.savez_compressed(output_path, features=features, labels=labels, calib_scores=calib_scores,
+                        calib_values=calib_values, accept_conf=np.float32(np.inf))
+
+    clf = DigitClassifier(output_path)
+    conf = np.array([clf.calibrate(s) for s in raw])
+    correct = np.array(correct)
+    accept_conf = accept_threshold(conf, correct, target_accuracy)
+    np.savez_compressed(output_path, features=features, labels=labels, calib_scores=calib_scores,
+                        calib_values=calib_values, accept_conf=np.float32(accept_conf))
+
+    def summary(rows):
+        accepted = conf[rows] >= accept_conf
+        return {"cells": int(rows.sum()), "accuracy": float(correct[rows].mean()),
+                "coverage": float(accepted.mean()),
+                "accepted_accuracy": float(correct[rows][accepted].mean()) if accepted.any() else None}
+
+    owner_of_crop = np.array([subjects.index(c[3]) for c in crops])
+    return dict(summary(np.ones(len(crops), bool)), prototypes=len(labels), accept_conf=accept_conf,
+                subjects={subject: summary(owner_of_crop == i) for i, subject in enumerate(subjects)})
+
+
+def print_stats(stats, target_accuracy=DIGIT_TARGET_ACCURACY):
+    def line(s):
+        accepted = "n/a" if s["accepted_accuracy"] is None else f"{s['accepted_accuracy']:.1%}"
+        return f"{s['cells']} cells, {s['accuracy']:.1%} read right, {s['coverage']:.1%} accepted, {accepted} of them right"
+
+    print(f"Prototypes: {stats['prototypes']} glyphs")
+    if np.isfinite(stats["accept_conf"]):
+        print(f"Acceptance threshold: {stats['accept_conf']:.3f} (held-out accuracy >= {target_accuracy:.0%})")
+    else:
+        print(f"No threshold reaches {target_accuracy:.0%} held-out accuracy; the model accepts nothing")
+    print(f"Held out, all subjects: {line(stats)}")
+    for subject, s in stats["subjects"].items():
+        print(f"  {os.path.basename(subject)}: {line(s)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and calibrate the CPU digit classifier tier")
+    parser.add_argument("--debug-dir", type=str, nargs="+", required=True,
+                        help="debug_cells folders with answer crops (write them with --debug-level full); "
+                             "their subject folders need a truth.json")
+    parser.add_argument("--target-accuracy", type=float, default=DIGIT_TARGET_ACCURACY,
+                        help="Held-out accuracy the accepted answers must reach")
+    parser.add_argument("--output", type=str, default=DEFAULT_DIGIT_MODEL, help="Model file to write")
+    args = parser.parse_args()
+
+    crops = load_labeled_crops(args.debug_dir)
+    print(f"Labeled crops: {len(crops)}")
+    stats = train_digit_model(crops, args.output, target_accuracy=args.target_accuracy)
+    print_stats(stats, args.target_accuracy)
+
+    clf = DigitClassifier(args.output)
+    start = time.perf_counter()
+    for crop in crops:
+        clf.read(crop[1])
+    print(f"Mean read time: {(time.perf_counter() - start) / len(crops) * 1000:.3f} ms per cell")
+    print(f"Model saved to: {args.output}")
@@ -0,0 +1,274 @@
+import queue
+import threading
+import multiprocessing
+import instrumentation
+from backends import BACKENDS, OCR_PROMPT, create_backend
+
+
+class _Job:
+    """One forward pass for one member; the worker answers on the request's reply queue."""
+    __slots__ = ("member", "start", "images", "keys", "kwargs", "replies")
+
+    def __init__(self, member, start, images, keys, kwargs, replies):
+        self.member = member
+        self.start = start
+        self.images = images
+        self.keys = keys
+        self.kwargs = kwargs
+        self.replies = replies
+
+
+def _serve_backend(conn, backend_name, model_id, kwargs, trace):
+    # Runs in a member process: owns the model and answers ProcessBackend's requests
+    if trace:
+        instrumentation.enable(keep_events=True)
+    rec = create_backend(backend_name, model_id, **kwargs)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            rec.unload()
+            return
+        op, args = request
+        try:
+            out = getattr(rec, op)(*args)
+            conn.send((None if op != "recognize" else out, None, instrumentation.drain()))
+        except Exception as e:
+            try:
+                conn.send((None, e, instrumentation.drain()))
+            except Exception:
+                conn.send((None, RuntimeError(f"{type(e).__name__}: {e}"), []))
+
+
+class ProcessBackend:
+    """
+    A recognizer backend whose model lives in its own worker process.
+
+    Used for ensemble members whose backend is not thread_safe (MLX: two models
+    generating at once on one Metal device from the same process are not known to
+    be safe), so that a ParallelEnsemble can still run them at the same time. The
+    process is spawned on the first load or recognize call and owns the model;
+    cells and answers travel over a pipe, and spans recorded there are merged
+    into this process's trace. Attributes (model_id, batch_size, memory_mb, ...)
+    come from an unloaded instance of the backend kept here.
+
+    Args:
+        backend_name: Backend to create in the worker ("mlx", "cpu" or "stub")
+        model_id: Model of this member
+        backend_kwargs: Forwarded to create_backend
+    """
+
+    def __init__(self, backend_name, model_id, **backend_kwargs):
+        self.backend = create_backend(backend_name, model_id, **backend_kwargs)
+        self.backend_name = backend_name
+        self.backend_kwargs = backend_kwargs
+        self.loaded = False
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _call(self, op, *args):
+        with self.lock:
+            if self.process is None:
+                ctx = multiprocessing.get_context("spawn")
+                self.conn, child = ctx.Pipe()
+                self.process = ctx.Process(target=_serve_backend, daemon=True,
+                                           args=(child, self.backend_name, self.backend.model_id,
+                                                 self.backend_kwargs, instrumentation.enabled()),
+                                           name=f"member-{self.backend.model_id.split('/')[-1]}")
+                self.process.start()
+                child.close()
+            self.conn.send((op, args))
+            try:
+                out, error, events = self.conn.recv()
+            except EOFError:
+                raise RuntimeError(f"Worker process of {self.backend.model_id} exited") from None
+        instrumentation.merge(events)
+        if error is not None:
+            raise error
+        return out
+
+    def load(self):
+        self._call("load")
+        self.loaded = True
+        return self
+
+    def unload(self):
+        if self.process is not None:
+            self._call("unload")
+        self.loaded = False
+
+    def recognize(self, images, prompt=OCR_PROMPT, keys=None, max_tokens=None):
+        out = self._call("recognize", list(images), prompt, keys, max_tokens)
+        self.loaded = True
+        return out
+
+    def close(self):
+        """Stop the worker process (the model is unloaded with it)."""
+        with self.lock:
+            if self.process is None:
+                return
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(timeout=30)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.conn.close()
+            self.process = self.conn = None
+        self.loaded = False
+
+
+def member_backend(backend_name, model_id, parallel=False, **kwargs):
+    """
+    A backend for one ensemble member: in-process, or in its own process when it
+    runs in parallel with the others and its backend is not thread_safe.
+    """
+    if parallel and not BACKENDS[backend_name].thread_safe:
+        return ProcessBackend(backend_name, model_id, **kwargs)
+    return create_backend(backend_name, model_id, **kwargs)
+
+
+class ParallelEnsemble(list):
+    """
+    Ensemble members that run concurrently: one worker thread and input queue per model.
+
+    Behaves like the plain list of backends it wraps, so it can be passed anywhere a
+    backend list is expected; recognize_members() detects it and fans the cells out
+    to the workers instead of calling the models one after another. Thread-safe
+    backends (cpu, stub) run right in the worker threads: torch releases the GIL
+    while it computes and the stub sleeps. Other backends (MLX) are wrapped in a
+    ProcessBackend by member_backend, so each worker thread only waits on its
+    member's process.
+
+    Use it as a context manager, or call close(), to stop the workers and any
+    member processes.
+
+    Args:
+        backends: Loaded (or lazily loading) backends, smallest first
+        parallelism: Members allowed to run a forward pass at the same time
+                     (default: all of them; 1 = one at a time, like the plain list)
+    """
+
+    def __init__(self, backends, parallelism=None):
+        super().__init__(backends)
+        self.parallelism = max(1, min(parallelism or len(backends), len(backends)))
+        self.slots = threading.BoundedSemaphore(self.parallelism)
+        self.queues = [queue.Queue() for _ in backends]
+        self.threads = []
+        for i, rec in enumerate(backends):
+            t = threading.Thread(target=self._work, args=(rec, self.queues[i]), daemon=True,
+                                 name=f"ensemble-{i}-{rec.model_id.split('/')[-1]}")
+            t.start()
+            self.threads.append(t)
+
+    def _work(self, rec, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            try:
+                with self.slots:
+                    out = rec.recognize(job.images, keys=job.keys, **job.kwargs)
+                job.replies.put((job, out, None))
+            except Exception as e:
+                job.replies.put((job, None, e))
+
+    def recognize_all(self, images, keys=None, on_complete=None, **kwargs):
+        """
+        Recognize the images with every member concurrently.
+
+        Each member's queue receives the cells one forward pass (batch_size) at a
+        time, and answers are joined per cell as they arrive: on_complete(i, answers)
+        fires as soon as every member has answered cell i.
+
+        Returns:
+            List with one result list per member, parallel to images
+        """
+        if keys is None:
+            keys = [None] * len(images)
+        replies = queue.Queue()
+        outstanding = 0
+        for m, rec in enumerate(self):
+            for start in range(0, len(images), rec.batch_size):
+                end = start + rec.batch_size
+                self.queues[m].put(_Job(m, start, images[start:end], keys[start:end], kwargs, replies))
+                outstanding += 1
+
+        responses = [[None] * len(images) for _ in self]
+        answered = [0] * len(images)
+        error = None
+        while outstanding:
+            job, out, exc = replies.get()
+            outstanding -= 1
+            if exc is not None:
+                error = error or exc
+                continue
+            for offset, res in enumerate(out):
+                i = job.start + offset
+                responses[job.member][i] = res
+                answered[i] += 1
+                if answered[i] == len(self) and on_complete is not None and error is None:
+                    on_complete(i, [r[i] for r in responses])
+        if error is not None:
+            raise error
+        return responses
+
+    def close(self):
+        """Stop the worker threads and close members that hold resources (ProcessBackend)."""
+        if not self.threads:
+            return
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        for rec in self:
+            close = getattr(rec, "close", None)
+            if close is not None:
+                close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def close_backends(backends):
+    """Release a backend list from load_backends (a ParallelEnsemble's workers; plain lists hold none)."""
+    if isinstance(backends, ParallelEnsemble):
+        backends.close()
+
+
+def recognize_members(backends, images, keys=None, on_complete=None, verbose=True, what="answer cells", **kwargs):
+    """
+    Every ensemble member's answers for the same images.
+
+    A ParallelEnsemble runs the members concurrently; a plain list runs them one
+    after another. on_complete(i, answers) is called once all members answered image i.
+
+    Returns:
+        List with one result list per member, parallel to images
+    """
+    if verbose:
+        names = ", ".join(rec.model_id for rec in backends)
+        how = "in parallel" if isinstance(backends, ParallelEnsemble) and backends.parallelism > 1 else "in turn"
+        print(f"Scanning {len(images)} {what} with {names} ({how})...")
+    with instrumentation.span("ensemble", cat="inference", images=len(images), members=len(backends)):
+        if isinstance(backends, ParallelEnsemble):
+            return backends.recognize_all(images, keys=keys, on_complete=on_complete, **kwargs)
+        responses = []
+        for rec in backends:
+            with instrumentation.span("ensemble_member", cat="inference", model=rec.model_id, cells=len(images)):
+                responses.append(rec.recognize(images, keys=keys, **kwargs))
+        if on_complete is not None:
+            for i in range(len(images)):
+                on_complete(i, [r[i] for r in responses])
+        return responses
@@ -0,0 +1,205 @@
+import cv2
+import numpy as np
+import instrumentation
+
+# Q/A pairs per page (each pair is a question row above an answer row)
+PAIRS = 8
+
+# Fixed-geometry split of a pair: the question takes 60% of its height
+QUESTION_FRACTION = 0.6
+
+# Width of the downscaled copy the grid lines are detected on
+DETECT_GRID_WIDTH = 800
+
+# Fraction of a column band a printed separator must cover to count as found
+SEPARATOR_COVERAGE = 0.5
+
+# Fraction of a column band an answer underline must cover to count as found
+UNDERLINE_COVERAGE = 0.2
+
+# Detection is rejected (fixed geometry used instead) below this share of found separators
+MIN_SEPARATORS_FOUND = 0.75
+
+
+class GridLayout:
+    """
+    Question and answer cell boxes of one page, computed once and shared by every
+    crop and overlay.
+
+    The grid is described by per-column edges, so a page that is slightly tilted or
+    bowed after straightening still gets cells that follow the printed lines:
+
+        col_edges: (cols + 1,) x positions of the column boundaries
+        pair_edges: (PAIRS + 1, cols) y of the separators above/below each pair, per column
+        answer_tops: (PAIRS, cols) y where the answer row starts (below the underline)
+
+    Build one with from_margins (the fixed-fraction geometry of PAGE_CONFIGS) or
+    detect (printed grid lines, falling back to from_margins).
+    """
+
+    def __init__(self, width, height, col_edges, pair_edges, answer_tops, detected=False):
+        self.width = width
+        self.height = height
+        self.col_edges = np.asarray(col_edges, dtype=np.int64)
+        self.pair_edges = np.asarray(pair_edges, dtype=np.int64)
+        self.answer_tops = np.asarray(answer_tops, dtype=np.int64)
+        self.detected = detected
+        # The fixed geometry runs high on real scans, so its crops are shifted down by 5%
+        # of the cell height (the handwriting sits low); detected boxes need no shift
+        self.shift = 0.0 if detected else 0.05
+        lefts = np.broadcast_to(self.col_edges[:-1], self.answer_tops.shape)
+        rights = np.broadcast_to(self.col_edges[1:], self.answer_tops.shape)
+        # (PAIRS, cols, 4) arrays of (left, top, right, bottom)
+        self.answer_boxes = np.stack([lefts, self.answer_tops, rights, self.pair_edges[1:]], axis=-1)
+        self.question_boxes = np.stack([lefts, self.pair_edges[:-1], rights, self.answer_tops], axis=-1)
+
+    @property
+    def cols(self):
+        return len(self.col_edges) - 1
+
+    @classmethod
+    def from_margins(cls, width, height, cols=10, top_margin=0.1, bottom_margin=0.9,
+                     left_margin=0.05, right_margin=0.95):
+        """The Content-Box geometry: equal pairs and columns, 60:40 question/answer split."""
+        content_top = int(height * top_margin)
+        content_bottom = int(height * bottom_margin)
+        content_left = int(width * left_margin)
+        content_right = int(width * right_margin)
+        # Integer division keeps every cell position exact (no cumulative drift)
+        pair_h = (content_bottom - content_top) // PAIRS
+        cell_w = (content_right - content_left) // cols
+        col_edges = content_left + cell_w * np.arange(cols + 1)
+        pair_tops = content_top + pair_h * np.arange(PAIRS + 1)
+        pair_edges = np.repeat(pair_tops[:, None], cols, axis=1)
+        answer_tops = pair_edges[:-1] + int(pair_h * QUESTION_FRACTION)
+        return cls(width, height, col_edges, pair_edges, answer_tops)
+
+    @classmethod
+    def detect(cls, image, cols=10, top_margin=0.1, bottom_margin=0.9, left_margin=0.05, right_margin=0.95,
+               detect_width=DETECT_GRID_WIDTH):
+        """
+        Find the printed grid of a straightened page.
+
+        Works on a downscaled, adaptively binarized copy. Long horizontal lines (the
+        pair separators) and short ones (the answer underlines) are pulled out with
+        morphological openings, and their ink is summed per column band, giving one
+        projection profile per column. Each separator is then the profile peak
+        nearest to where the margins put it, and each answer row starts below the
+        strongest underline in the middle of its pair. Separators a column misses
+        are taken from the other columns; when too many are missing, or no
+        underline is found, the fixed geometry of the margins is used instead.
+
+        Args:
+            image: HxWx3 RGB or HxW gray array of the straightened page
+            cols: Number of columns in the grid
+            top_margin, bottom_margin, left_margin, right_margin: PAGE_CONFIGS margins,
+                used as the starting estimate and as the fallback
+
+        Returns:
+            GridLayout (detected=False when the fallback was used)
+        """
+        h, w = image.shape[:2]
+        fixed = cls.from_margins(w, h, cols, top_margin, bottom_margin, left_margin, right_margin)
+        with instrumentation.span("detect_grid", cat="image", width=w, height=h) as sp:
+            try:
+                layout = cls._detect(image, fixed, detect_width)
+            except ValueError:
+                layout = None
+            sp.set(detected=layout is not None)
+        return layout or fixed
+
+    @classmethod
+    def _detect(cls, image, fixed, detect_width):
+        h, w = image.shape[:2]
+        cols = fixed.cols
+        # An exact integer reduction takes OpenCV's fast INTER_AREA path (the few
+        # leftover pixels at the right and bottom edge are dropped)
+        factor = max(1, w // detect_width)
+        scale = 1.0 / factor
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        gray = cv2.resize(gray[:h - h % factor, :w - w % factor], (w // factor, h // factor),
+                          interpolation=cv2.INTER_AREA)
+        sh, sw = gray.shape
+        ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+
+        # Column bands in detection pixels, from the fixed geometry
+        band_edges = np.clip(np.round(fixed.col_edges * scale).astype(np.int64), 0, sw)
+        band_w = np.maximum(np.diff(band_edges), 1)
+        if band_w.min() < 8:
+            raise ValueError("page too small for grid detection")
+
+        def band_profiles(lines):
+            # (rows, cols) fraction of each column band covered by line pixels
+            sums = np.add.reduceat(lines[:, band_edges[0]:band_edges[-1]] > 0, band_edges[:-1] - band_edges[0], axis=1)
+            return sums / band_w
+
+        # Separators span whole columns; a kernel of about one column width drops the
+        # underlines (about half a column) and digits but tolerates a slight tilt
+        sep_len = max(3, int(band_w.min() * 0.8))
+        separators = cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (sep_len, 1)))
+        sep_profile = band_profiles(separators)
+        und_len = max(3, int(band_w.min() * 0.25))
+        underlines = cv2.morphologyEx(ink, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (und_len, 1)))
+        und_profile = band_profiles(cv2.subtract(underlines, separators))
+
+        pair_h = (fixed.pair_edges[1, 0] - fixed.pair_edges[0, 0]) * scale
+        window = max(2, int(pair_h * 0.25))
+
+        def peaks(profile, expected, radius, threshold):
+            # Strongest row in [expected - radius, expected + radius] per column, NaN where too weak
+            offsets = np.arange(-radius, radius + 1)
+            rows = np.clip(np.round(expected)[..., None].astype(np.int64) + offsets, 0, sh - 1)
+            col_idx = np.arange(cols).reshape((1,) * (rows.ndim - 2) + (cols, 1))
+            values = profile[rows, col_idx]
+            best = values.argmax(axis=-1)
+            found = np.take_along_axis(rows, best[..., None], axis=-1)[..., 0].astype(np.float64)
+            found[np.take_along_axis(values, best[..., None], axis=-1)[..., 0] < threshold] = np.nan
+            return found
+
+        expected = fixed.pair_edges * scale
+        edges = peaks(sep_profile, expected, window, SEPARATOR_COVERAGE)
+        inner = edges[1:-1]
+        if np.isnan(inner).mean() > 1 - MIN_SEPARATORS_FOUND or np.isnan(inner).all(axis=1).any():
+            raise ValueError("too few grid separators found")
+        # A separator a column missed is where the other columns put it (a tilted line
+        # shifts smoothly, so the median of its row is close enough)
+        row_median = np.nanmedian(np.where(np.isnan(edges).all(axis=1, keepdims=True), expected, edges), axis=1)
+        edges = np.where(np.isnan(edges), row_median[:, None], edges)
+
+        # Answer underlines sit between 35% and 80% of the pair height
+        spans = edges[1:] - edges[:-1]
+        mid = edges[:-1] + spans * 0.575
+        tops = peaks(und_profile, mid, max(2, int(pair_h * 0.225)), UNDERLINE_COVERAGE)
+        if np.isnan(tops).all():
+            raise ValueError("no answer underlines found")
+        # Columns without an underline (e.g. a crossed-out problem) keep the 60:40 split
+        tops = np.where(np.isnan(tops), edges[:-1] + spans * QUESTION_FRACTION, tops + 1)
+
+        inv = 1.0 / scale
+        pair_edges = np.clip(np.round(edges * inv), 0, h).astype(np.int64)
+        answer_tops = np.clip(np.round(tops * inv), 0, h).astype(np.int64)
+        return cls(w, h, fixed.col_edges, pair_edges, answer_tops, detected=True)
+
+    def answer_crop(self, pair, col, buffer_pixels=30):
+        """
+        (left, top, right, bottom) crop of one answer cell: its box, shifted down for
+        the fixed geometry, grown by the context buffer.
+        """
+        left, top, right, bottom = (int(v) for v in self.answer_boxes[pair, col])
+        return self._grow(left, top, right, bottom, buffer_pixels)
+
+    def question_crop(self, pair, col, buffer_pixels=30):
+        """Crop of one question cell, with the same shift and buffer as answer_crop."""
+        left, top, right, bottom = (int(v) for v in self.question_boxes[pair, col])
+        return self._grow(left, top, right, bottom, buffer_pixels)
+
+    def row_crop(self, pair, buffer_pixels=30):
+        """Crop spanning every answer cell of a pair (same shift and buffer as answer_crop)."""
+        boxes = self.answer_boxes[pair]
+        return self._grow(int(boxes[:, 0].min()), int(boxes[:, 1].min()), int(boxes[:, 2].max()),
+                          int(boxes[:, 3].max()), buffer_pixels)
+
+    def _grow(self, left, top, right, bottom, buffer_pixels):
+        shift = int((bottom - top) * self.shift)
+        return (max(0, left - buffer_pixels), max(0, top + shift - buffer_pixels),
+                min(self.width, right + buffer_pixels), min(self.height, bottom + shift + buffer_pixels))
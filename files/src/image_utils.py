@@ -1,191 +1,372 @@
 import os
-import subprocess
+import time
 from PIL import Image, ImageOps, ImageDraw, ImageFont
 import cv2
 import numpy as np
+import instrumentation
+from grid_layout import GridLayout
 
-def force_clean(image_path):
+class PageContext:
+    """
+    A scanned page decoded once and kept in memory for every image stage.
+
+    Holds the cleaned, straightened page as a single RGB uint8 NumPy array.
+    Cell crops taken with crop() are views into that array, so cropping
+    160 cells copies no pixels.
+
+    Attributes:
+        image: HxWx3 uint8 RGB array of the straightened page
+        source_path: Path of the scan the page was decoded from
+        straightened: False when no page outline was found and the scan is used as-is
+        straighten_info: Detected corners and timings from straighten_array
+        layouts: GridLayouts already computed for this page (see page_layout)
+        store: ArtifactStore the page came from (None = nothing is persisted)
+        artifact_key: Key of the page's straighten stage in that store
+    """
+
+    def __init__(self, image, source_path=None, straightened=True, straighten_info=None, store=None,
+                 artifact_key=None):
+        self.image = image
+        self.source_path = source_path
+        self.straightened = straightened
+        self.straighten_info = straighten_info
+        self.layouts = {}
+        self.store = store
+        self.artifact_key = artifact_key
+
+    @property
+    def size(self):
+        """(width, height), like PIL's Image.size."""
+        return self.image.shape[1], self.image.shape[0]
+
+    def crop(self, box):
+        """Zero-copy view of a (left, top, right, bottom) box, like PIL's crop()."""
+        left, top, right, bottom = box
+        return self.image[top:bottom, left:right]
+
+    def to_pil(self):
+        return Image.fromarray(self.image)
+
+
+def register_heif():
+    """Let Pillow open HEIC/HEIF scans (iPhone photos) when pillow_heif is installed."""
+    try:
+        import pillow_heif
+    except ImportError:
+        return False
+    pillow_heif.register_heif_opener()
+    return True
+
+
+def decode_image(image_path):
+    """
+    Decode a scan into an RGB array with EXIF orientation applied, in-process.
+
+    Pillow reads the common formats; HEIC/HEIF needs the optional pillow_heif
+    plugin, which is registered the first time Pillow does not recognize a file.
+    OpenCV is tried last (it applies EXIF orientation itself).
+    """
+    try:
+        raw_img = Image.open(image_path)
+    except Exception:
+        raw_img = None
+        if register_heif():
+            try:
+                raw_img = Image.open(image_path)
+            except Exception:
+                pass
+    if raw_img is not None:
+        img = ImageOps.exif_transpose(raw_img).convert("RGB")
+        return np.asarray(img)
+    img = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if img is None:
+        ext = os.path.splitext(image_path)[1].lower()
+        hint = " (install pillow-heif to read HEIC/HEIF scans)" if ext in (".heic", ".heif") else ""
+        raise ValueError(f"Cannot decode {image_path}{hint}")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def load_page(image_path, write_intermediates=False, pyramid=True, target_dpi=None, writer=None, store=None):
+    """
+    Decode and straighten a page once, returning a PageContext.
+
+    With an ArtifactStore the decoded scan (normalize stage) and the straightened
+    page (straighten stage) are looked up by the scan's content hash and the
+    straightening parameters, so a re-run skips both, a new target_dpi only
+    re-straightens, and an edited scan is always processed again. The
+    *_clean.png and *_clean_straight.png debug intermediates are only written
+    when write_intermediates is set, and are never read back.
+
+    Args:
+        image_path: Path to the scanned page
+        write_intermediates: Save the cleaned and straightened PNGs next to the scan
+        pyramid: Find the page outline on a downscaled copy (see straighten_array)
+        target_dpi: Warp straight to this resolution instead of the photo's native size
+        writer: DebugWriter that saves the intermediates in the background (default: synchronous)
+        store: ArtifactStore for stage outputs (None = compute everything)
+
+    Returns:
+        PageContext
+    """
     directory = os.path.dirname(image_path)
-    filename = os.path.basename(image_path)
-    name, _ = os.path.splitext(filename)
+    name, _ = os.path.splitext(os.path.basename(image_path))
     clean_path = os.path.join(directory, f"{name}_clean.png")
     straight_path = os.path.join(directory, f"{name}_clean_straight.png")
 
-    if not os.path.exists(straight_path):
-        if not os.path.exists(clean_path):
-            print(f"Force-cleaning {filename} with sips...")
-            subprocess.run(["sips", "-s", "format", "png", image_path, "--out", clean_path], check=True, capture_output=True)
-        # Straighten the cleaned image
-        straight_path = straighten_page(clean_path)
-    return straight_path
-
-def get_individual_cells(image_path, dirname, rows=16, cols=10, buffer_pixels=3, 
-                         top_margin=0.1, bottom_margin=0.9, 
-                         left_margin=0.05, right_margin=0.95):
+    norm_key = straight_key = None
+    if store is not None:
+        norm_key = store.key("normalize", store.source_key(image_path))
+        straight_key = store.key("straighten", norm_key, pyramid=pyramid, target_dpi=target_dpi)
+        meta = store.get_json("straighten", straight_key)
+        img = None
+        if meta is not None:
+            with instrumentation.span("reuse_straightened", cat="image", page=name):
+                stage, key = ("straighten", straight_key) if meta["straightened"] else ("normalize", norm_key)
+                img = store.get_image(stage, key, count=False)
+        store.count("straighten", img is not None)
+        if img is not None:
+            return PageContext(img, image_path, straightened=meta["straightened"], straighten_info=meta["info"],
+                               store=store, artifact_key=straight_key)
+
+    img = None
+    if store is not None:
+        with instrumentation.span("reuse_normalized", cat="image", page=name):
+            img = store.get_image("normalize", norm_key)
+    if img is None:
+        with instrumentation.span("decode", cat="image", page=name):
+            img = decode_image(image_path)
+        if store is not None:
+            store.put_image("normalize", norm_key, img)
+    save = (lambda image, path: writer.save(image, path, lossless=True)) if writer is not None else save_image
+    if write_intermediates:
+        save(img, clean_path)
+    with instrumentation.span("straighten", cat="image", page=name) as sp:
+        warped, info = straighten_array(img, pyramid=pyramid, target_dpi=target_dpi)
+        sp.set(detect_ms=info.get("detect_ms"), refine_ms=info.get("refine_ms"), warp_ms=info.get("warp_ms"))
+    if warped is None:
+        print(f"No page outline found in {os.path.basename(image_path)}, using it unstraightened")
+        if store is not None:
+            store.put_json("straighten", straight_key, {"straightened": False, "info": info})
+        return PageContext(img, image_path, straightened=False, straighten_info=info, store=store,
+                           artifact_key=straight_key)
+    print(f"Straightened {os.path.basename(image_path)} in {info['total_ms']}ms "
+          f"(detect {info['detect_ms']}, refine {info['refine_ms']}, warp {info['warp_ms']}), corners {info['corners']}")
+    if store is not None:
+        # The metadata goes last: its presence means the image is complete
+        store.put_image("straighten", straight_key, warped)
+        store.put_json("straighten", straight_key, {"straightened": True, "info": info})
+    if write_intermediates:
+        save(warped, straight_path)
+        print(f"Straightened image saved to: {straight_path}")
+    return PageContext(warped, image_path, straighten_info=info, store=store, artifact_key=straight_key)
+
+
+def save_image(image, path):
+    """Save a PIL image or RGB NumPy array (e.g. a cell view) to disk."""
+    with instrumentation.span("save_image", cat="io", file=os.path.basename(path)):
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(np.ascontiguousarray(image))
+        image.save(path)
+
+
+def _open_page(image):
+    """PageContext or path -> (PIL-compatible crop source, width, height)."""
+    if isinstance(image, PageContext):
+        w, h = image.size
+        return image, w, h
+    raw_img = Image.open(image)
+    img = ImageOps.exif_transpose(raw_img)
+    w, h = img.size
+    return img, w, h
+
+
+def page_layout(image, cols=10, top_margin=0.1, bottom_margin=0.9, left_margin=0.05, right_margin=0.95,
+                detect=True):
+    """
+    GridLayout of a page: the printed grid when it can be detected, otherwise the
+    fixed Content-Box geometry of the margins.
+
+    Computed once per PageContext and cached on it, so cropping, row strips and the
+    overlays all use the same boxes. A page loaded from an ArtifactStore also keeps
+    its detected grid there (cells stage), keyed on the straightened page and the
+    margins.
+
+    Args:
+        image: PageContext, PIL image (already oriented) or path
+        detect: Look for the printed grid lines (False = fixed geometry only)
+    """
+    key = (cols, top_margin, bottom_margin, left_margin, right_margin, detect)
+    if isinstance(image, PageContext) and key in image.layouts:
+        return image.layouts[key]
+    img, w, h = (image, *image.size) if isinstance(image, Image.Image) else _open_page(image)
+    margins = dict(top_margin=top_margin, bottom_margin=bottom_margin, left_margin=left_margin, right_margin=right_margin)
+    store = image.store if isinstance(image, PageContext) and image.artifact_key is not None else None
+    if detect and store is not None:
+        cells_key = store.key("cells", image.artifact_key, cols=cols, detect=detect, **margins)
+        arrays = store.get_arrays("cells", cells_key)
+        if arrays is not None:
+            layout = GridLayout(w, h, arrays["col_edges"], arrays["pair_edges"], arrays["answer_tops"],
+                                detected=bool(arrays["detected"]))
+            image.layouts[key] = layout
+            return layout
+    if detect:
+        arr = img.image if isinstance(img, PageContext) else np.asarray(img.convert("RGB"))
+        layout = GridLayout.detect(arr, cols, **margins)
+        if store is not None:
+            store.put_arrays("cells", cells_key, col_edges=layout.col_edges, pair_edges=layout.pair_edges,
+                             answer_tops=layout.answer_tops, detected=np.array(layout.detected))
+    else:
+        layout = GridLayout.from_margins(w, h, cols, **margins)
+    if isinstance(image, PageContext):
+        image.layouts[key] = layout
+    return layout
+
+
+def get_individual_cells(image_path, dirname, rows=16, cols=10, buffer_pixels=30,
+                         top_margin=0.1, bottom_margin=0.9,
+                         left_margin=0.05, right_margin=0.95, debug=True, layout=None):
     """
     Extract individual cells from a WJ Math test page.
-    
-    Uses a Content-Box strategy: defines content_top and content_bottom
-    (ignoring headers/footers) and divides that specific height by rows.
-    This prevents vertical drift by calculating each cell position from
-    the content boundaries using integer arithmetic.
-    
+
+    Cell boxes come from the page's GridLayout (see page_layout): the printed
+    grid lines when they are found, otherwise the Content-Box strategy, which
+    divides the content box between the margins into 8 Q/A pairs with integer
+    arithmetic so that positions don't drift.
+
     Args:
-        image_path: Path to the image file
-        rows: Number of rows in the grid (default: 8)
+        image_path: Path to the image file, or a PageContext
+        rows: Number of rows in the grid (default: 16, question and answer rows alternating)
         cols: Number of columns in the grid (default: 10)
-        buffer_pixels: Outward buffer to prevent clipping (default: 3)
-        top_margin: Top margin as fraction of height (default: 0.11)
-        bottom_margin: Bottom margin as fraction of height (default: 0.95)
-        left_margin: Left margin as fraction of width (default: 0.04)
-        right_margin: Right margin as fraction of width (default: 0.96)
-    
+        buffer_pixels: Outward context buffer around each cell (default: 30)
+        top_margin: Top margin as fraction of height (default: 0.1)
+        bottom_margin: Bottom margin as fraction of height (default: 0.9)
+        left_margin: Left margin as fraction of width (default: 0.05)
+        right_margin: Right margin as fraction of width (default: 0.95)
+        debug: Write the first cell of every row to debug_crops/; a DebugWriter
+               does so in the background when its level includes "row_checks"
+        layout: GridLayout to use instead of the page's cached one
+
     Returns:
-        List of PIL Image objects, one per cell
+        List of PIL Image objects, one per cell (NumPy views when given a PageContext)
     """
-    # Apply EXIF orientation fix immediately
-    raw_img = Image.open(image_path)
-    img = ImageOps.exif_transpose(raw_img)
-    w, h = img.size
-
-    # Content-Box Strategy: Define the exact box where problems live
-    # This ignores headers, footers, and margins
-    content_top = int(h * top_margin)      # Start below the title
-    content_bottom = int(h * bottom_margin) # End above the page number
-    content_left = int(w * left_margin)     # Skip the left margin
-    content_right = int(w * right_margin)   # Skip the right margin
+    # Apply EXIF orientation fix immediately (a PageContext is already oriented)
+    img, w, h = _open_page(image_path)
+    if layout is None:
+        layout = page_layout(img, cols, top_margin, bottom_margin, left_margin, right_margin)
 
-    # Calculate grid dimensions
-    grid_h = content_bottom - content_top
-    grid_w = content_right - content_left
-    
-    # Use integer division to prevent cumulative drift
-    # Calculate cell dimensions as integers
-    pair_h = grid_h // 8  # Height per Q/A pair
-    cell_w = grid_w // cols  # 10 columns
-    
     cells = []
-    os.makedirs(os.path.join(dirname, "debug_crops"), exist_ok=True)
+    if hasattr(debug, "wants"):
+        save = debug.save if debug.wants("row_checks") else None
+    else:
+        save = save_image if debug else None
+    if save is not None:
+        os.makedirs(os.path.join(dirname, "debug_crops"), exist_ok=True)
 
     for r in range(rows):
-        pair_i = r // 2
-        pair_top = content_top + pair_i * pair_h
-        
-        if r % 2 == 0:  # Question row
-            question_h = int(pair_h * 0.6)
-            top = pair_top
-            bottom = pair_top + question_h
-        else:  # Answer row
-            question_h = int(pair_h * 0.6)
-            top = pair_top + question_h
-            bottom = pair_top + pair_h
-        
+        # Even rows are questions, odd rows the answers below them
+        crop = layout.answer_crop if r % 2 else layout.question_crop
         for c in range(cols):
-            # Calculate cell boundaries using integer arithmetic
-            # Each cell position is calculated from content boundaries to prevent drift
-            left = content_left + (c * cell_w)
-            right = left + cell_w
-
-            # Shift the crop down by 5% of the cell height to ensure 
-            # the handwriting (at the bottom) is definitely included.
-            shift = int((bottom - top) * 0.05)  # Small shift to focus on answers
-            buffer_pixels = 30         # Buffer for context
-            crop_top = max(0, int(top + shift - buffer_pixels))
-            crop_bottom = min(h, int(bottom + shift + buffer_pixels))
-            crop_left = max(0, int(left - buffer_pixels))
-            crop_right = min(w, int(right + buffer_pixels))
-            
-            cell = img.crop((crop_left, crop_top, crop_right, crop_bottom))
+            cell = img.crop(crop(r // 2, c, buffer_pixels))
             cells.append(cell)
-            
+
             # Export EVERY row's first cell to check for vertical drift
-            if c == 0:
-                cell.save(os.path.join(dirname, f"debug_crops/R{r+1}_C1_check.png"))
-                
+            if save is not None and c == 0:
+                save(cell, os.path.join(dirname, f"debug_crops/R{r+1}_C1_check.png"))
+
     return cells
 
 
+def iter_answer_cells(image_path, cols=10, buffer_pixels=30, top_margin=0.1, bottom_margin=0.9,
+                      left_margin=0.05, right_margin=0.95, layout=None):
+    """
+    Lazily crop only the answer cells of a page, in reading order.
+
+    Same boxes as get_individual_cells (answer row of every Q/A pair, 5% downward
+    shift, outward buffer), but question rows are skipped and each crop is only
+    taken when the consumer asks for it.
+
+    Args:
+        image_path: Path to the image file, or a PageContext
+        cols: Number of columns in the grid (default: 10)
+        buffer_pixels: Outward buffer to prevent clipping (default: 30)
+        layout: GridLayout to use instead of the page's cached one
+
+    Yields:
+        (pair index, column, cell) with cell index pair * 2 * cols + cols + column
+        in get_individual_cells numbering; cells are NumPy views for a PageContext
+    """
+    img, w, h = _open_page(image_path)
+    if layout is None:
+        layout = page_layout(img, cols, top_margin, bottom_margin, left_margin, right_margin)
+
+    for pair_i in range(len(layout.answer_boxes)):
+        for c in range(cols):
+            yield pair_i, c, img.crop(layout.answer_crop(pair_i, c, buffer_pixels))
+
+
 def visualize_content_box(image_path, rows=16, cols=10, output_path="debug_cells/content_box_visualization.png",
-                          top_margin=0.1, bottom_margin=0.9, left_margin=0.05, right_margin=0.95):
+                          top_margin=0.1, bottom_margin=0.9, left_margin=0.05, right_margin=0.95, writer=None,
+                          layout=None):
     """
     Visualize the content box and grid boundaries on the original image.
-    This helps verify that the content box percentages are correct.
-    
+    This helps verify that the cell boxes follow the printed grid.
+
+    The content box of the margins is drawn in red and the page's GridLayout
+    boxes in blue (green labels on the first cells).
+
     Args:
-        image_path: Path to the image file
+        image_path: Path to the image file, or a PageContext
         rows: Number of rows in the grid
         cols: Number of columns in the grid
         output_path: Path where the visualization will be saved
-        top_margin: Top margin as fraction of height (default: 0.11)
-        bottom_margin: Bottom margin as fraction of height (default: 0.95)
-        left_margin: Left margin as fraction of width (default: 0.04)
-        right_margin: Right margin as fraction of width (default: 0.96)
+        top_margin: Top margin as fraction of height (default: 0.1)
+        bottom_margin: Bottom margin as fraction of height (default: 0.9)
+        left_margin: Left margin as fraction of width (default: 0.05)
+        right_margin: Right margin as fraction of width (default: 0.95)
+        writer: DebugWriter that encodes and saves the overlay in the background
+        layout: GridLayout to draw instead of the page's cached one
     """
-    # Apply EXIF orientation fix
-    raw_img = Image.open(image_path)
-    img = ImageOps.exif_transpose(raw_img)
-    w, h = img.size
-    
+    # Apply EXIF orientation fix (a PageContext is already oriented)
+    img, w, h = _open_page(image_path)
+    if layout is None:
+        layout = page_layout(img, cols, top_margin, bottom_margin, left_margin, right_margin)
+
     # Create a copy for drawing
-    vis_img = img.copy()
+    vis_img = img.to_pil() if isinstance(img, PageContext) else img.copy()
     draw = ImageDraw.Draw(vis_img)
-    
-    # Calculate content box (same logic as get_individual_cells)
-    content_top = int(h * top_margin)
-    content_bottom = int(h * bottom_margin)
-    content_left = int(w * left_margin)
-    content_right = int(w * right_margin)
-    
-    grid_h = content_bottom - content_top
-    grid_w = content_right - content_left
-    pair_h = grid_h // 8
-    cell_w = grid_w // cols
-    
+
     # Draw content box outline
     draw.rectangle(
-        [(content_left, content_top), (content_right, content_bottom)],
+        [(int(w * left_margin), int(h * top_margin)), (int(w * right_margin), int(h * bottom_margin))],
         outline="red",
         width=3
     )
-    
-    # Draw grid lines
-    for pair_i in range(8):
-        pair_top = content_top + pair_i * pair_h
-        question_h = int(pair_h * 0.6)
-        # Horizontal lines
-        draw.line([(content_left, pair_top), (content_right, pair_top)], fill="blue", width=1)
-        draw.line([(content_left, pair_top + question_h), (content_right, pair_top + question_h)], fill="blue", width=1)
-        draw.line([(content_left, pair_top + pair_h), (content_right, pair_top + pair_h)], fill="blue", width=1)
-    
-    for c in range(cols + 1):
-        x = content_left + (c * cell_w)
-        draw.line([(x, content_top), (x, content_bottom)], fill="blue", width=1)
-    
+
+    # Draw the question and answer boxes of the grid
+    for boxes in (layout.question_boxes, layout.answer_boxes):
+        for left, top, right, bottom in boxes.reshape(-1, 4).tolist():
+            draw.rectangle([(left, top), (right, bottom)], outline="blue", width=1)
+
     # Label first few cells with question numbers
     try:
         # Try to use a default font, fallback to basic if not available
         font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 20)
     except:
         font = ImageFont.load_default()
-    
+
     for r in range(min(rows, 3)):  # Label first 3 rows
-        pair_i = r // 2
-        pair_top = content_top + pair_i * pair_h
-        if r % 2 == 0:
-            question_h = int(pair_h * 0.6)
-            top = pair_top
-        else:
-            question_h = int(pair_h * 0.6)
-            top = pair_top + question_h
+        boxes = layout.answer_boxes if r % 2 else layout.question_boxes
         for c in range(min(cols, 5)):  # Label first 5 columns
             q_num = (r * cols) + c + 1
-            x = content_left + (c * cell_w) + 5
-            y = top + 5
-            draw.text((x, y), f"Q{q_num}", fill="green", font=font)
-    
+            left, top = boxes[r // 2, c, :2].tolist()
+            draw.text((left + 5, top + 5), f"Q{q_num}", fill="green", font=font)
+
     # Save visualization
     os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else ".", exist_ok=True)
-    vis_img.save(output_path)
+    if writer is not None:
+        output_path = writer.save(vis_img, output_path)
+    else:
+        vis_img.save(output_path)
     print(f"Content box visualization saved to: {output_path}")
     return vis_img
 
@@ -229,32 +410,33 @@ def create_debug_contact_sheet(cells, rows=8, cols=10, output_path="debug_cells/
     return contact_sheet
 
 
-def straighten_page(image_path):
+# Width of the downscaled copy used to find the page outline in pyramid mode.
+# Much below ~2000px the thin gap between the grid border and a dark background
+# closes up on 12MP phone photos and the outline merges with the background.
+DETECT_WIDTH = 2000
+
+# Physical page width used to convert a target DPI into output pixels (US Letter)
+PAGE_WIDTH_INCHES = 8.5
+
+
+def find_page_corners(gray, blur_size=5):
     """
-    Detect the largest rectangular contour in the image and warp it to a straight rectangle.
-    This helps correct for perspective distortion or paper curling.
-    
+    Find the four corners of the largest rectangular contour in a grayscale image.
+
     Args:
-        image_path: Path to the image file
-        
+        gray: Grayscale image
+        blur_size: Gaussian kernel size applied before thresholding
+
     Returns:
-        Path to the straightened image
+        4x2 float32 array ordered top-left, top-right, bottom-right, bottom-left,
+        or None when no four-cornered outline is found
     """
-    straightened_path = image_path.replace('.png', '_straight.png')
-    if os.path.exists(straightened_path):
-        return straightened_path
-    
-    img = cv2.imread(image_path)
-    if img is None:
-        return image_path
-    
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    blur = cv2.GaussianBlur(gray, (blur_size, blur_size), 0)
     thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
     
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     if not contours:
-        return image_path
+        return None
     
     # Find largest contour
     largest = max(contours, key=cv2.contourArea)
@@ -262,7 +444,7 @@ def straighten_page(image_path):
     approx = cv2.approxPolyDP(largest, 0.02 * peri, True)
     
     if len(approx) != 4:
-        return image_path
+        return None
     
     # Order points: top-left, top-right, bottom-right, bottom-left
     pts = approx.reshape(4, 2).astype(np.float32)
@@ -275,6 +457,80 @@ def straighten_page(image_path):
     diff = np.diff(pts, axis=1)
     rect[1] = pts[np.argmin(diff)]  # top-right
     rect[3] = pts[np.argmax(diff)]  # bottom-left
+    return rect
+
+
+def refine_corners(gray, rect, half_window):
+    """
+    Refine coarse corner estimates at full resolution.
+
+    Each corner is moved to the sub-pixel gradient corner inside a small window
+    around its upscaled position, so only a few hundred pixels per corner are
+    touched instead of the whole image.
+    """
+    h, w = gray.shape[:2]
+    half_window = max(3, int(half_window))
+    pts = rect.reshape(-1, 1, 2).astype(np.float32).copy()
+    # Keep the search window fully inside the image
+    pts[:, 0, 0] = np.clip(pts[:, 0, 0], half_window + 1, w - half_window - 2)
+    pts[:, 0, 1] = np.clip(pts[:, 0, 1], half_window + 1, h - half_window - 2)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.05)
+    refined = cv2.cornerSubPix(gray, pts, (half_window, half_window), (-1, -1), criteria)
+    refined = refined.reshape(4, 2)
+    # Reject refinements that wandered off (e.g. onto a nearby printed line)
+    moved = np.linalg.norm(refined - rect, axis=1)
+    return np.where((moved <= half_window)[:, None], refined, rect).astype(np.float32)
+
+
+def straighten_array(img, rgb=True, pyramid=True, detect_width=DETECT_WIDTH, target_dpi=None,
+                     page_width_in=PAGE_WIDTH_INCHES):
+    """
+    Detect the largest rectangular contour in an image array and warp it to a straight rectangle.
+    This helps correct for perspective distortion or paper curling.
+
+    In pyramid mode the outline is found on a copy downscaled to `detect_width`,
+    the corners are refined locally at full resolution and a single full-resolution
+    warpPerspective produces the output. With `target_dpi` the warp writes straight
+    to the resolution the grid needs instead of the photo's native size.
+    
+    Args:
+        img: HxWx3 uint8 array
+        rgb: Channel order of img (True for RGB, False for OpenCV's BGR)
+        pyramid: Detect on a downscaled copy (False = detect at full resolution)
+        detect_width: Width of the downscaled detection copy
+        target_dpi: Output resolution in dots per inch of page width (None = native)
+        page_width_in: Physical page width used with target_dpi
+        
+    Returns:
+        tuple: (warped array or None when no page outline is found,
+                info dict with "corners", "scale" and per-step timings in ms)
+    """
+    t0 = time.perf_counter()
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY if rgb else cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape[:2]
+    scale = w / float(detect_width) if pyramid and w > detect_width else 1.0
+    info = {"corners": None, "scale": scale}
+
+    rect = None
+    if scale > 1.0:
+        small = cv2.resize(gray, (int(round(w / scale)), int(round(h / scale))), interpolation=cv2.INTER_LINEAR)
+        # A lighter blur keeps the downscaled border line from bleeding into the background
+        rect = find_page_corners(small, blur_size=3)
+        if rect is None:
+            # Fall back to full-resolution detection rather than leave the page crooked
+            scale = info["scale"] = 1.0
+    if rect is None:
+        rect = find_page_corners(gray)
+    t1 = time.perf_counter()
+    info["detect_ms"] = round((t1 - t0) * 1000, 1)
+    if rect is None:
+        return None, info
+
+    if scale > 1.0:
+        rect = refine_corners(gray, rect * scale, half_window=2 * scale)
+    t2 = time.perf_counter()
+    info["refine_ms"] = round((t2 - t1) * 1000, 1)
+    info["corners"] = [[round(float(x), 1), round(float(y), 1)] for x, y in rect]
     
     # Calculate dimensions
     (tl, tr, br, bl) = rect
@@ -285,6 +541,12 @@ def straighten_page(image_path):
     heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
     heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
     maxHeight = max(int(heightA), int(heightB))
+
+    if target_dpi:
+        # Fold the resize into the perspective transform: still a single warp
+        out_scale = (target_dpi * page_width_in) / float(maxWidth)
+        maxWidth = int(round(maxWidth * out_scale))
+        maxHeight = int(round(maxHeight * out_scale))
     
     # Destination points
     dst = np.array([
@@ -296,11 +558,34 @@ def straighten_page(image_path):
     
     # Warp
     M = cv2.getPerspectiveTransform(rect, dst)
-    warped = cv2.warpPerspective(img, M, (maxWidth, maxHeight))
-    
-    cv2.imwrite(straightened_path, warped)
-    print(f"Straightened image saved to: {straightened_path}")
-    return straightened_path
+    warped = cv2.warpPerspective(img, M, (maxWidth, maxHeight), flags=cv2.INTER_AREA if target_dpi else cv2.INTER_LINEAR)
+    info["warp_ms"] = round((time.perf_counter() - t2) * 1000, 1)
+    info["total_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    info["output_size"] = [maxWidth, maxHeight]
+    return warped, info
+
+
+def straighten_page(image_path, output_path=None, store=None, **kwargs):
+    """
+    Straighten a page image on disk (see load_page and straighten_array).
+
+    Args:
+        image_path: Path to the image file
+        output_path: Where to save it (default: *_straight.png next to the scan)
+        store: ArtifactStore to reuse the straightened page from
+        **kwargs: pyramid / target_dpi, as for load_page
+
+    Returns:
+        Path to the straightened image, or image_path when no page outline was found
+    """
+    page = load_page(image_path, store=store, **kwargs)
+    if not page.straightened:
+        return image_path
+    if output_path is None:
+        output_path = os.path.splitext(image_path)[0] + "_straight.png"
+    save_image(page.image, output_path)
+    print(f"Straightened image saved to: {output_path}")
+    return output_path
 
 
 def get_row_crops(image_path, rows=8, top_margin=0.11, bottom_margin=0.95, 
@@ -309,7 +594,7 @@ def get_row_crops(image_path, rows=8, top_margin=0.11, bottom_margin=0.95,
     Crop the image into individual rows, each containing 10 math problems.
     
     Args:
-        image_path: Path to the image file
+        image_path: Path to the image file, or a PageContext
         rows: Number of rows in the grid (default: 8)
         top_margin: Top margin as fraction of height (default: 0.11)
         bottom_margin: Bottom margin as fraction of height (default: 0.95)
@@ -319,10 +604,8 @@ def get_row_crops(image_path, rows=8, top_margin=0.11, bottom_margin=0.95,
     Returns:
         List of PIL Image objects, one per row
     """
-    # Apply EXIF orientation fix immediately
-    raw_img = Image.open(image_path)
-    img = ImageOps.exif_transpose(raw_img)
-    w, h = img.size
+    # Apply EXIF orientation fix immediately (a PageContext is already oriented)
+    img, w, h = _open_page(image_path)
 
     # Content-Box Strategy
     content_top = int(h * top_margin)
@@ -342,3 +625,32 @@ def get_row_crops(image_path, rows=8, top_margin=0.11, bottom_margin=0.95,
         rows_crops.append(row_crop)
     
     return rows_crops
+
+
+def get_answer_row_crops(image_path, cols=10, buffer_pixels=30,
+                         top_margin=0.1, bottom_margin=0.9,
+                         left_margin=0.05, right_margin=0.95, layout=None):
+    """
+    Crop the 8 answer rows of a page as whole strips, one per Q/A pair.
+
+    Uses the same GridLayout as get_individual_cells, so strip i spans exactly
+    the answer cells of pair i (same shift and buffer vertically, the first
+    cell's left edge to the last cell's right edge horizontally).
+
+    Args:
+        image_path: Path to the image file, or a PageContext
+        cols: Number of columns in the grid (default: 10)
+        buffer_pixels: Outward buffer to prevent clipping (default: 30)
+        top_margin: Top margin as fraction of height
+        bottom_margin: Bottom margin as fraction of height
+        left_margin: Left margin as fraction of width
+        right_margin: Right margin as fraction of width
+        layout: GridLayout to use instead of the page's cached one
+
+    Returns:
+        List of 8 row strips (PIL Images, or NumPy views when given a PageContext)
+    """
+    img, w, h = _open_page(image_path)
+    if layout is None:
+        layout = page_layout(img, cols, top_margin, bottom_margin, left_margin, right_margin)
+    return [img.crop(layout.row_crop(pair_i, buffer_pixels)) for pair_i in range(len(layout.answer_boxes))]
@@ -0,0 +1,288 @@
+import os
+import json
+import math
+import time
+import threading
+
+# Opt-in tracing for the scanner's hot paths.
+#
+# Nothing is recorded until enable() is called; until then span() hands out a
+# shared no-op context manager, so the instrumentation can stay in place on
+# every call site. Spans are streamed to a Chrome-trace JSON array (chrome://tracing
+# or ui.perfetto.dev), metrics as one JSON object per line.
+
+_tracer = None
+
+
+class Span:
+    """A timed region; use as a context manager and attach fields with set()."""
+    __slots__ = ("tracer", "name", "cat", "args", "start", "duration_ms")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0
+        self.duration_ms = 0.0
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        self.duration_ms = (end - self.start) / 1e6
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add_span(self, end)
+        return False
+
+
+class _NullSpan:
+    """What span() returns while tracing is off."""
+    duration_ms = 0.0
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+# Trace events buffered before they are appended to the trace file
+FLUSH_EVENTS = 4096
+
+# Histogram bucket bounds grow by this factor, so quantiles are within half of it (2.5%)
+HISTOGRAM_GROWTH = 1.05
+
+
+class Histogram:
+    """
+    Log-bucketed histogram: memory grows with the range of the values, not their number.
+
+    Quantiles are the geometric midpoint of the bucket holding the rank, clamped
+    to the observed min/max.
+    """
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        index = math.floor(math.log(value, HISTOGRAM_GROWTH)) if value > 0 else None
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        rank = min(self.count - 1, int(self.count * q))
+        seen = 0
+        # The bucket of values <= 0 (index None) sorts first
+        for index in sorted(self.buckets, key=lambda i: -math.inf if i is None else i):
+            seen += self.buckets[index]
+            if seen > rank:
+                if index is None:
+                    return max(self.min, min(0.0, self.max))
+                return min(self.max, max(self.min, HISTOGRAM_GROWTH ** (index + 0.5)))
+        return self.max
+
+
+class Tracer:
+    """
+    Collects spans, metric events and latency histograms for one process.
+
+    Timestamps come from perf_counter (a system-wide monotonic clock), so spans
+    drained from worker processes line up with the main process when merged.
+
+    Trace events are appended to trace_path every FLUSH_EVENTS events, so a long
+    batch or daemon run holds at most that many in memory. Worker processes pass
+    keep_events instead and ship their events to the parent with drain(). With
+    neither, spans are still timed (for the histograms) but not kept.
+
+    Args:
+        metrics_path: Optional JSONL file that metric events are appended to
+        trace_path: Optional Chrome-trace JSON file the trace events are streamed to
+        keep_events: Hold the trace events until drain() is called
+    """
+
+    def __init__(self, metrics_path=None, trace_path=None, keep_events=False):
+        self.pid = os.getpid()
+        self.events = []
+        self.event_count = 0
+        self.thread_names = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.metrics_file = open(metrics_path, "a", buffering=1 << 16) if metrics_path else None
+        self.trace_path = trace_path
+        self.trace_file = None
+        self.trace_lock = threading.Lock()
+        if trace_path:
+            # JSON array format: written incrementally, closed by save_trace
+            self.trace_file = open(trace_path, "w", buffering=1 << 16)
+            self.trace_file.write("[")
+        self.keep_events = keep_events or self.trace_file is not None
+
+    def _add_events(self, events):
+        if not self.keep_events:
+            return
+        with self.lock:
+            self.events.extend(events)
+            if self.trace_file is None or len(self.events) < FLUSH_EVENTS:
+                return
+            batch, self.events = self.events, []
+        self._write_events(batch)
+
+    def _write_events(self, events):
+        if not events:
+            return
+        with self.trace_lock:
+            for event in events:
+                self.trace_file.write(("," if self.event_count else "") + "\n" + json.dumps(event))
+                self.event_count += 1
+
+    def add_span(self, span, end_ns):
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            with self.lock:
+                self.thread_names[tid] = threading.current_thread().name
+        self._add_events([{"name": span.name, "cat": span.cat, "ph": "X",
+                           "ts": span.start / 1000, "dur": (end_ns - span.start) / 1000,
+                           "pid": self.pid, "tid": tid, "args": span.args}])
+
+    def record(self, event, **fields):
+        """Append a metric event to the JSONL stream and as a counter track in the trace."""
+        counters = {k: v for k, v in fields.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+        if counters:
+            self._add_events([{"name": event, "ph": "C", "ts": time.perf_counter_ns() / 1000,
+                               "pid": self.pid, "args": counters}])
+        if self.metrics_file is not None:
+            line = json.dumps(dict({"ts": round(time.time(), 6), "event": event}, **fields))
+            with self.lock:
+                self.metrics_file.write(line + "\n")
+
+    def observe(self, name, value, **labels):
+        """Add a sample to the histogram identified by name and labels."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.add(value)
+
+    def histogram_summary(self):
+        summary = []
+        with self.lock:
+            items = [(key, {"count": h.count, "mean": h.total / h.count, "p50": h.quantile(0.5),
+                            "p90": h.quantile(0.9), "p99": h.quantile(0.99), "max": h.max})
+                     for key, h in self.histograms.items()]
+        for (name, labels), stats in items:
+            summary.append(dict({"name": name, "count": stats.pop("count")},
+                                **{k: round(v, 3) for k, v in stats.items()}, **dict(labels)))
+        return summary
+
+    def _thread_name_events(self):
+        with self.lock:
+            names = list(self.thread_names.items())
+        return [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                for tid, name in names]
+
+    def drain(self):
+        """Hand over and forget the recorded trace events (used to ship spans out of worker processes)."""
+        with self.lock:
+            events, self.events = self.events, []
+        return events + self._thread_name_events()
+
+    def merge(self, events):
+        self._add_events(events)
+
+    def save_trace(self, path=None):
+        """Write the remaining events to the trace file and close it (or write them all to path)."""
+        if self.trace_file is None:
+            if not path:
+                return
+            self.trace_file = open(path, "w", buffering=1 << 16)
+            self.trace_file.write("[")
+            self.trace_path = path
+        self._write_events(self.drain())
+        with self.trace_lock:
+            self.trace_file.write("\n]\n")
+            self.trace_file.close()
+            self.trace_file = None
+        print(f"Trace saved to: {self.trace_path} ({self.event_count} events)")
+
+    def close(self):
+        """Write the histogram summaries to the metrics stream and close it."""
+        if self.metrics_file is None:
+            return
+        for entry in self.histogram_summary():
+            self.record("histogram", **entry)
+        self.metrics_file.close()
+        self.metrics_file = None
+
+
+def enable(metrics_path=None, trace_path=None, keep_events=False):
+    """Turn tracing on for this process (see Tracer for the arguments); returns the Tracer."""
+    global _tracer
+    _tracer = Tracer(metrics_path, trace_path, keep_events)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, cat="pipeline", **args):
+    """Context manager timing a region (a no-op unless tracing is enabled)."""
+    if _tracer is None:
+        return NULL_SPAN
+    return Span(_tracer, name, cat, args)
+
+
+def record(event, **fields):
+    if _tracer is not None:
+        _tracer.record(event, **fields)
+
+
+def observe(name, value, **labels):
+    if _tracer is not None:
+        _tracer.observe(name, value, **labels)
+
+
+def drain():
+    return _tracer.drain() if _tracer is not None else []
+
+
+def merge(events):
+    """Add trace events drained from another process."""
+    if _tracer is not None and events:
+        _tracer.merge(events)
+
+
+def finish():
+    """Complete the trace file, flush the metrics stream and turn tracing off."""
+    if _tracer is None:
+        return
+    _tracer.save_trace()
+    _tracer.close()
+    disable()
@@ -1,9 +1,24 @@
 import os
+import re
 import argparse
 import sys
-from mlx_vlm import load, generate
-from image_utils import force_clean, get_individual_cells, visualize_content_box
-from config import score_results
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import instrumentation
+from backends import BACKENDS, DEFAULT_MODEL_IDS, ROW_MAX_TOKENS, ROW_PROMPT
+from image_utils import (get_answer_row_crops, get_individual_cells, iter_answer_cells, load_page, page_layout,
+                         visualize_content_box)
+from debug_writer import DEBUG_LEVELS, IMAGE_FORMATS, DebugWriter, writer_for
+from config import NOT_REQUESTED, NOT_REQUESTED_TIER, NOT_SCANNED, NOT_SCANNED_TIER, WJ_MATH_ANSWER_KEY, IncrementalScorer, is_plausible_answer, score_results
+from ocr_cache import DEFAULT_CACHE_DIR, CachedBackend, OCRCache
+from artifact_store import DEFAULT_ARTIFACT_DIR, DEFAULT_ARTIFACT_MAX_BYTES, ArtifactStore, print_artifact_stats
+from results_store import DEFAULT_RESULTS_DB, ResultsStore, protocol_names
+from prefilter import BLANK_INK_THRESHOLD, classify_blank
+from digit_classifier import DEFAULT_DIGIT_MODEL, DigitClassifier
+from cell_encoding import CELL_MODES, CellEncoder, encode_items, parse_cell_target
+from ensemble import ParallelEnsemble, close_backends, member_backend, recognize_members
+from result_overlay import DEFAULT_OVERLAY_FORMAT, DEFAULT_OVERLAY_WIDTH, OVERLAY_FORMATS, write_overlays
 
 # Define fixed margins for straightened pages
 PAGE_CONFIGS = {
@@ -11,100 +26,765 @@ PAGE_CONFIGS = {
     1: {"top": 0.00, "bottom": 1, "left": 0.00, "right": 1}  # Page 2
 }
 
-def run_precision_assessment(p1_path, p2_path):
-    # 1. Load Models
-    model_ids = [
-        "mlx-community/Qwen2-VL-2B-Instruct-4bit",
-        "mlx-community/Qwen2-VL-7B-Instruct-4bit"
-    ]
-    models = []
-    processors = []
+# Execution schedules for the ensemble (see choose_schedule)
+SCHEDULES = ("auto", "interleaved", "model-major")
+
+# Mean token probability below which the cascade escalates a small-model answer
+ESCALATE_SCORE = 0.85
+
+# Questions whose answer crops are written to debug_cells/ at the "sampled" debug level
+DEBUG_QUESTIONS = [1, 2, 3, 11, 12, 13, 21, 22, 24, 28, 31, 33, 34, 46, 50, 60, 61, 62, 64, 68, 76, 78, 91, 92, 100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 121, 134]
+
+def combine_answers(*answers):
+    """
+    Merge the answers of the ensemble members (one or more).
+
+    The first answer wins unless it is EMPTY and another member read something.
+
+    Returns:
+        tuple: (answer, confidence) where confidence is True when all members agree
+    """
+    confidence = all(a == answers[0] for a in answers)
+    text_ans = next((a for a in answers if a != "EMPTY"), answers[0])
+    return text_ans, confidence
+
+def load_backends(backend="mlx", model_ids=None, batch_size=8, cache=None, load=True, parallel=1):
+    """
+    Create one recognizer backend per ensemble member, optionally behind an OCR cache.
+
+    With load=False the models are left for the schedule to load (model-major
+    loads them one at a time, see scan_model_major). With parallel > 1 up to that
+    many members run at the same time, each on its own worker (see ParallelEnsemble);
+    members of backends that are not thread_safe (MLX) then get a process each.
+    Release the result with close_backends when done.
+    """
+    model_ids = model_ids or DEFAULT_MODEL_IDS
+    in_parallel = parallel > 1 and len(model_ids) > 1
+    backends = []
     for model_id in model_ids:
-        print(f"Loading Model: {model_id}...")
-        model, processor = load(model_id)
-        processor.image_processor.max_pixels = 512 * 512
-        models.append(model)
-        processors.append(processor) 
-
-    all_scanned_answers = []
-    pages = [p1_path, p2_path]
-
-
-    for p_idx, p_path in enumerate(pages):
-        cfg = PAGE_CONFIGS[p_idx]
-        clean_path = force_clean(p_path)
-        
-        visualize_content_box(clean_path, output_path=os.path.join(dirname, f"debug_cells/page_{p_idx+1}_viz.png"),
-                              top_margin=cfg['top'], bottom_margin=cfg['bottom'],
-                              left_margin=cfg['left'], right_margin=cfg['right'])
-        
-        # Get individual cells (16 rows x 10 cols, but only process even rows for answers)
-        cells = get_individual_cells(clean_path, dirname,
-                                    rows=16, cols=10,
-                                    top_margin=cfg['top'], 
-                                    bottom_margin=cfg['bottom'],
-                                    left_margin=cfg['left'],
-                                    right_margin=cfg['right'])
-        
-        # Save sample answer cells for debugging (first 10 answers)
-        os.makedirs(os.path.join(dirname, "debug_cells"), exist_ok=True)
-        answer_cells = [cells[i] for i in range(10, 20)]  # cells 10-19 are Q1-Q10
-        for idx, cell in enumerate(answer_cells):
-            cell.save(os.path.join(dirname, f"debug_cells/page_{p_idx+1}_answer_Q{idx+1}.png"))
-        
-        print(f"Scanning {len(cells)} cells for Page {p_idx + 1}...")
-        for c_idx, cell_img in enumerate(cells):
-            row = c_idx // 10
-            col = c_idx % 10
-            # Only process odd rows (0-based, which are 2,4,6,... 1-based for answers)
-            if row % 2 == 0:
+        rec = member_backend(backend, model_id, parallel=in_parallel, batch_size=batch_size)
+        if cache is not None:
+            rec = CachedBackend(rec, cache)
+        backends.append(rec)
+    if load:
+        load_models(backends)
+    if in_parallel:
+        backends = ParallelEnsemble(backends, parallelism=parallel)
+    return backends
+
+def load_models(backends):
+    """Load every ensemble member up front (the interleaved schedule keeps them all resident)."""
+    for rec in backends:
+        with instrumentation.span("load_model", cat="model", model=rec.model_id):
+            rec.load()
+    return backends
+
+def choose_schedule(backends, schedule="auto", memory_budget_mb=None):
+    """
+    Pick the execution schedule for an ensemble.
+
+    "interleaved" keeps every model resident and sends each chunk of cells through
+    all of them; "model-major" holds one model at a time (see scan_model_major).
+    "auto" picks interleaved when the summed model estimates fit memory_budget_mb,
+    or when there is no budget.
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Unknown schedule '{schedule}', expected one of {SCHEDULES}")
+    if schedule != "auto":
+        return schedule
+    if memory_budget_mb is None:
+        return "interleaved"
+    total = sum(rec.memory_mb for rec in backends)
+    largest = max(rec.memory_mb for rec in backends)
+    if total <= memory_budget_mb:
+        return "interleaved"
+    if largest > memory_budget_mb:
+        print(f"Warning: the largest model needs ~{largest} MB, more than the {memory_budget_mb:.0f} MB budget")
+    return "model-major"
+
+def needs_escalation(result, escalate_score=ESCALATE_SCORE):
+    """True when a small-model answer is non-numeric, implausible or low probability."""
+    return (not is_plausible_answer(result["ans"])) or result["score"] < escalate_score
+
+def run_cascade(items, backends, escalate_score=ESCALATE_SCORE, verbose=True):
+    """
+    Cascaded ensemble: the first (small) backend reads every cell and only the
+    uncertain ones are sent to the last (large) backend.
+
+    Args:
+        items: List of (question_num, page index, cell index, cell image)
+        backends: Loaded backends, smallest first
+        escalate_score: Minimum mean token probability to accept a small-model answer
+
+    Returns:
+        Dict of question_num -> {"ans", "conf", "scores", "tier"}
+    """
+    small, large = backends[0], backends[-1]
+    images = [item[3] for item in items]
+    keys = [item[0] for item in items]
+    if verbose:
+        print(f"Scanning {len(images)} answer cells with {small.model_id}...")
+    first = small.recognize(images, keys=keys)
+
+    results = {}
+    escalate = []
+    for item, res in zip(items, first):
+        if needs_escalation(res, escalate_score):
+            escalate.append((item, res))
+        else:
+            results[item[0]] = {"ans": res["ans"], "conf": True, "scores": [res["score"]], "tier": "small"}
+
+    if verbose:
+        print(f"Escalating {len(escalate)} of {len(items)} cells to {large.model_id}...")
+    if escalate:
+        second = large.recognize([item[3] for item, _ in escalate], keys=[item[0] for item, _ in escalate])
+        for (item, res), res2 in zip(escalate, second):
+            # The large model is authoritative; agreement with the small model still sets the confidence
+            text_ans, confidence = combine_answers(res2["ans"], res["ans"])
+            results[item[0]] = {"ans": text_ans, "conf": confidence,
+                                "scores": [res["score"], res2["score"]], "tier": "large"}
+    return results
+
+def parse_row_response(text, cols=10):
+    """
+    Split a row-mode response into its per-box answers.
+
+    Accepts comma, semicolon, pipe or newline separated values (whitespace when no
+    other separator is present), with optional brackets or "1." style numbering.
+
+    Returns:
+        List of `cols` answers (upper-cased, blanks as "EMPTY"), or None when the
+        response does not hold exactly `cols` values
+    """
+    text = text.strip().strip("[]()").strip()
+    if not text:
+        return None
+    parts = re.split(r"[,;|\n]", text) if re.search(r"[,;|\n]", text) else text.split()
+    answers = []
+    for part in parts:
+        token = re.sub(r"^\s*\d+\s*[.):]\s+", "", part).strip().strip("\"'.").upper()
+        if not token:
+            continue
+        answers.append("EMPTY" if token in ("EMPTY", "BLANK", "NONE", "-") else token)
+    return answers if len(answers) == cols else None
+
+def recognize_rows(items, backends, row_images, cascade=False, escalate_score=ESCALATE_SCORE, verbose=True):
+    """
+    Row mode: read every answer row that still has pending cells in one model call.
+
+    Rows whose response does not parse into one answer per box fall back to
+    per-cell inference, as do cascade answers that need escalation.
+
+    Args:
+        items: Pending (question_num, page index, cell index, cell image) items
+        backends: Loaded backends, smallest first (only the first one reads rows in cascade mode)
+        row_images: Dict of question_num tuple -> answer-row strip (see prepare_row_images)
+
+    Returns:
+        tuple: (dict of question_num -> {"ans", "conf", "scores", "tier"},
+                list of items left for per-cell inference)
+    """
+    row_of = {q: key for key in row_images for q in key}
+    by_row = {}
+    for item in items:
+        by_row.setdefault(row_of.get(item[0]), []).append(item)
+    leftover = by_row.pop(None, [])
+    keys = list(by_row)
+    if not keys:
+        return {}, leftover
+
+    strips = [row_images[key] for key in keys]
+    responses = recognize_members(backends[:1] if cascade else backends, strips, keys=keys, verbose=verbose,
+                                  what="answer rows", prompt=ROW_PROMPT, max_tokens=ROW_MAX_TOKENS)
+
+    results = {}
+    failed = 0
+    for i, key in enumerate(keys):
+        parsed = [parse_row_response(r[i]["ans"], len(key)) for r in responses]
+        if any(p is None for p in parsed):
+            failed += 1
+            leftover.extend(by_row[key])
+            continue
+        scores = [r[i]["score"] for r in responses]
+        for item in by_row[key]:
+            answers = [p[key.index(item[0])] for p in parsed]
+            if cascade:
+                if needs_escalation({"ans": answers[0], "score": scores[0]}, escalate_score):
+                    leftover.append(item)
+                    continue
+                results[item[0]] = {"ans": answers[0], "conf": True, "scores": scores, "tier": "small_row"}
+            else:
+                text_ans, confidence = combine_answers(*answers)
+                results[item[0]] = {"ans": text_ans, "conf": confidence, "scores": scores, "tier": "row"}
+    if verbose and failed:
+        print(f"Row mode: {failed} of {len(keys)} rows did not parse, falling back to per-cell inference")
+    return results, leftover
+
+def page_margins(p_idx):
+    """PAGE_CONFIGS margins of a page as keyword arguments for the image_utils croppers."""
+    cfg = PAGE_CONFIGS[p_idx]
+    return dict(top_margin=cfg['top'], bottom_margin=cfg['bottom'], left_margin=cfg['left'], right_margin=cfg['right'])
+
+def iter_answer_items(p_path, p_idx, output_dir, debug=True, page=None, target_dpi=None, store=None):
+    """
+    Lazily crop the answer cells of one page, in question order.
+
+    Only the 80 answer cells are cropped (question rows are skipped), one at a
+    time as the consumer pulls them; each crop is a NumPy view into the page.
+
+    Args:
+        p_path: Path to the scanned page
+        p_idx: Page index (0 for items 1-80, 1 for items 81-160)
+        output_dir: Folder receiving debug_cells/ and debug_crops/
+        debug: DebugWriter, debug level name or bool (True = "sampled"); selects which
+               intermediates, grid overlays and crops are written in the background
+        page: Already decoded PageContext for p_path (decoded here if omitted)
+        target_dpi: Straighten straight to this resolution when decoding here
+        store: ArtifactStore the page is decoded through (see load_page)
+
+    Yields:
+        (question_num, page index, cell index, cell image); the cell index is the
+        position in get_individual_cells' 160-cell list
+    """
+    margins = page_margins(p_idx)
+    with writer_for(debug) as writer:
+        if page is None:
+            with instrumentation.span("load_page", cat="image", page=p_idx + 1):
+                page = load_page(p_path, write_intermediates=writer.wants("intermediates"),
+                                 target_dpi=target_dpi, writer=writer, store=store)
+
+        if writer.wants("grid"):
+            with instrumentation.span("visualize_content_box", cat="io", page=p_idx + 1):
+                visualize_content_box(page, output_path=os.path.join(output_dir, f"debug_cells/page_{p_idx+1}_viz.png"),
+                                      writer=writer, **margins)
+
+        # The vertical-drift checks need the first cell of every row, question rows included
+        if writer.wants("row_checks"):
+            with instrumentation.span("row_checks", cat="io", page=p_idx + 1):
+                get_individual_cells(page, output_dir, rows=16, cols=10, debug=writer, **margins)
+
+        for pair_i, col, cell_img in iter_answer_cells(page, cols=10, **margins):
+            question_num = (p_idx * 80) + (pair_i * 10) + col + 1
+            c_idx = pair_i * 20 + 10 + col
+
+            # Save sample answer cells for debugging (first 10 answers)
+            if writer.wants("samples") and pair_i == 0:
+                writer.save(cell_img, os.path.join(output_dir, f"debug_cells/page_{p_idx+1}_answer_Q{col+1}.png"))
+
+            # Debug: Save problematic cells (or every cell at the "full" level)
+            if writer.wants("all_cells") or (writer.wants("samples") and question_num in DEBUG_QUESTIONS):
+                debug_path = os.path.join(output_dir, f"debug_cells/Q{question_num}_page{p_idx+1}_cell{c_idx+1}.png")
+                writer.save(cell_img, debug_path)
+            yield (question_num, p_idx, c_idx, cell_img)
+
+def prepare_page(p_path, p_idx, output_dir, debug=True, page=None, target_dpi=None, store=None):
+    """
+    CPU-bound preprocessing of one page: clean, straighten and crop (see iter_answer_items).
+
+    Returns:
+        List of (question_num, page index, cell index, cell image) for the answer cells;
+        cell images are NumPy views into the page array
+    """
+    with instrumentation.span("crop_cells", cat="image", page=p_idx + 1):
+        return list(iter_answer_items(p_path, p_idx, output_dir, debug=debug, page=page, target_dpi=target_dpi,
+                                      store=store))
+
+def prepare_pages(p1_path, p2_path, output_dir, debug=True, pages=None, target_dpi=None, store=None):
+    """Preprocess both pages of a protocol; returns the 160 answer items in question order."""
+    answer_items = []
+    with writer_for(debug) as writer:
+        for p_idx, p_path in enumerate([p1_path, p2_path]):
+            page = pages[p_idx] if pages is not None else None
+            with instrumentation.span("prepare_page", page=p_idx + 1, path=os.path.basename(p_path)):
+                answer_items.extend(prepare_page(p_path, p_idx, output_dir, debug=writer, page=page,
+                                                 target_dpi=target_dpi, store=store))
+    return answer_items
+
+def write_disagreements(answer_items, scanned, output_dir, writer):
+    """
+    Save the crops of answer cells whose ensemble members disagreed (conf False).
+
+    File names carry the chosen answer, e.g. debug_cells/disagree_Q37_12.png.
+    """
+    if not writer.wants("disagreements"):
+        return 0
+    count = 0
+    for item, res in zip(answer_items, scanned):
+        if res["conf"] is False:
+            ans = re.sub(r"[^0-9A-Z]+", "_", str(res["ans"])).strip("_") or "none"
+            writer.save(item[3], os.path.join(output_dir, f"debug_cells/disagree_Q{item[0]}_{ans}.png"))
+            count += 1
+    if count:
+        print(f"Saved {count} disagreement crops to {os.path.join(output_dir, 'debug_cells')}")
+    return count
+
+def page_row_images(page, p_idx):
+    """Answer-row strips of one page, keyed by the tuple of question numbers in the row."""
+    strips = get_answer_row_crops(page, cols=10, **page_margins(p_idx))
+    row_images = {}
+    for pair_i, strip in enumerate(strips):
+        first = (p_idx * 80) + pair_i * 10 + 1
+        row_images[tuple(range(first, first + 10))] = strip
+    return row_images
+
+def prepare_row_images(p1_path, p2_path, pages=None, target_dpi=None, store=None):
+    """
+    Answer-row strips of both pages for row mode.
+
+    Returns:
+        Dict of (question_num, ...) tuple -> strip, one entry per answer row (16 in total)
+    """
+    row_images = {}
+    for p_idx, p_path in enumerate([p1_path, p2_path]):
+        page = pages[p_idx] if pages is not None else load_page(p_path, target_dpi=target_dpi, store=store)
+        row_images.update(page_row_images(page, p_idx))
+    return row_images
+
+def stream_pages(page_paths, output_dir, debug=True, target_dpi=None, row_mode=False, prefetch=1,
+                 pages_out=None, store=None):
+    """
+    Producer side of the streaming pipeline: yields each page's answer cells while the
+    next page is decoded and straightened on a background thread.
+
+    At most `prefetch` pages are decoded ahead of the one being recognized, which
+    bounds peak memory to prefetch + 1 decoded pages however many pages are streamed.
+    Decoding (OpenCV/NumPy) releases the GIL, so it genuinely overlaps with inference.
+    Closing the generator early (e.g. once the ceiling is reached) cancels the pages
+    that have not started decoding.
+
+    Args:
+        page_paths: Scanned pages in administration order (page index = position)
+        debug: DebugWriter, debug level name or bool, as for iter_answer_items
+        row_mode: Also yield the page's answer-row strips (see prepare_row_images)
+        prefetch: Pages decoded ahead of the consumer (0 = strictly sequential)
+        pages_out: Optional list receiving each decoded PageContext at its page index
+        store: ArtifactStore the pages are decoded through (see load_page)
+
+    Yields:
+        (answer_items, row_images or None) for one page
+    """
+    with writer_for(debug) as writer:
+        def decode(p_idx, p_path):
+            with instrumentation.span("load_page", cat="image", page=p_idx + 1):
+                return load_page(p_path, write_intermediates=writer.wants("intermediates"),
+                                 target_dpi=target_dpi, writer=writer, store=store)
+
+        pending = deque()
+        todo = iter(enumerate(page_paths))
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-loader")
+        try:
+            for p_idx, p_path in islice(todo, prefetch):
+                pending.append((p_idx, pool.submit(decode, p_idx, p_path)))
+            while True:
+                for p_idx, p_path in islice(todo, 1):
+                    pending.append((p_idx, pool.submit(decode, p_idx, p_path)))
+                if not pending:
+                    break
+                p_idx, fut = pending.popleft()
+                with instrumentation.span("wait_page", cat="image", page=p_idx + 1):
+                    page = fut.result()
+                if pages_out is not None:
+                    pages_out[p_idx] = page
+                with instrumentation.span("prepare_page", page=p_idx + 1, path=os.path.basename(page_paths[p_idx])):
+                    answer_items = prepare_page(page_paths[p_idx], p_idx, output_dir, debug=writer, page=page)
+                    row_images = page_row_images(page, p_idx) if row_mode else None
+                yield answer_items, row_images
+        finally:
+            # A page already being decoded is finished (and kept for the caller's
+            # visualization); pages that never started are dropped
+            pool.shutdown(wait=True, cancel_futures=True)
+            for p_idx, fut in pending:
+                if pages_out is not None and not fut.cancelled() and fut.exception() is None:
+                    pages_out[p_idx] = fut.result()
+
+def limit_chunks(chunks, limit):
+    """
+    Pass on only the first `limit` answer cells (in question order) of a page stream.
+
+    Stops pulling pages once the limit is reached, so with limit <= 80 page 2 is
+    never decoded. Closing this generator closes the underlying stream.
+    """
+    left = limit
+    try:
+        for answer_items, row_images in chunks:
+            kept = sorted(answer_items, key=lambda item: item[0])[:left]
+            left -= len(kept)
+            yield kept, row_images
+            if left <= 0:
+                break
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+def mark_not_requested(results, question_nums, limit):
+    """
+    Report the questions a --limit run left out as NOT REQUESTED instead of beyond the ceiling.
+
+    Only when the scan got through all `limit` requested questions: if the ceiling
+    stopped it earlier, everything after it is beyond the ceiling as usual.
+    """
+    requested, rest = question_nums[:limit], question_nums[limit:]
+    if any(results[q]["tier"] == NOT_SCANNED_TIER for q in requested):
+        return
+    for q in rest:
+        if results[q]["tier"] == NOT_SCANNED_TIER:
+            results[q] = {"ans": NOT_REQUESTED, "conf": None, "scores": [], "tier": NOT_REQUESTED_TIER}
+
+def positive_int(text):
+    """argparse type for counts that must be at least 1."""
+    value = int(text)
+    if value <= 0:
+        raise ValueError(f"Expected a positive integer, got {value}")
+    return value
+
+def prefilter_items(items, blank_threshold=BLANK_INK_THRESHOLD, verbose=True):
+    """
+    Blank-cell prefilter: empty answers never reach the models.
+
+    Returns:
+        tuple: (dict of question_num -> result for the blank cells, items left for the models)
+    """
+    results = {}
+    pending = []
+    for item in items:
+        if blank_threshold is not None:
+            with instrumentation.span("prefilter_cell", cat="prefilter", question=item[0]) as sp:
+                is_blank, blank_conf, ratio = classify_blank(item[3], threshold=blank_threshold)
+                sp.set(ink_ratio=round(ratio, 5), blank=is_blank)
+            if is_blank:
+                results[item[0]] = {"ans": "EMPTY", "conf": True, "scores": [blank_conf], "tier": "prefilter"}
                 continue
-            
-            # Calculate question number (1-indexed, only for answer rows)
-            question_num = (p_idx * 80) + ((row // 2) * 10) + col + 1
-            
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image"},
-                        {"type": "text", "text": "Extract the handwritten number from this image. Output only the number or EMPTY."}
-                    ]
-                }
-            ]
-            
-            # Get responses from both models
-            responses = []
-            for model, processor in zip(models, processors):
-                prompt = processor.apply_chat_template(messages, add_generation_prompt=True)
-                response = generate(model, processor, prompt, [cell_img], max_tokens=20, temp=0.0)
-                responses.append(response.text.strip().upper())
-            
-            # Combine responses
-            ans1, ans2 = responses
-            confidence = (ans1 == ans2)
-            if ans1 == ans2:
-                text_ans = ans1
-            elif ans1 == "EMPTY":
-                text_ans = ans2
-            elif ans2 == "EMPTY":
-                text_ans = ans1
+        pending.append(item)
+    if verbose and blank_threshold is not None:
+        print(f"Prefilter: {len(items) - len(pending)} of {len(items)} answer cells judged blank")
+    return results, pending
+
+def read_digits(items, digits, verbose=True):
+    """
+    CPU digit tier: answers the classifier is confident about never reach the VLMs.
+
+    Returns:
+        tuple: (dict of question_num -> result for the accepted cells, items left for the models)
+    """
+    results = {}
+    pending = []
+    for item in items:
+        with instrumentation.span("digit_cell", cat="digits", question=item[0]) as sp:
+            res = digits.read(item[3])
+            sp.set(ans=res["ans"], score=round(res["score"], 4))
+        if digits.accepts(res):
+            results[item[0]] = {"ans": res["ans"], "conf": True, "scores": [res["score"]], "tier": "digit"}
+        else:
+            pending.append(item)
+    if verbose:
+        print(f"Digit tier: {len(results)} of {len(items)} answer cells read on the CPU")
+    return results, pending
+
+def recognize_items(items, backends, blank_threshold=BLANK_INK_THRESHOLD, cascade=False,
+                    escalate_score=ESCALATE_SCORE, verbose=True, row_images=None, digits=None, encoder=None):
+    """
+    Prefilter and recognize a group of answer items.
+
+    With a DigitClassifier (digits) the cells it reads confidently skip the VLMs.
+    With a CellEncoder the cells that do reach the VLMs are normalized first.
+
+    With row_images, rows are read whole first (see recognize_rows) and only the
+    cells of rows that could not be parsed go through per-cell inference.
+
+    Returns:
+        Dict of question_num -> {"ans", "conf", "scores", "tier"}
+    """
+    results, pending = prefilter_items(items, blank_threshold, verbose=verbose)
+    if digits is not None and pending:
+        digit_results, pending = read_digits(pending, digits, verbose=verbose)
+        results.update(digit_results)
+    if not pending:
+        return results
+    if encoder is not None:
+        with instrumentation.span("encode_cells", cat="image", cells=len(pending)):
+            pending = encode_items(pending, encoder)
+
+    if row_images:
+        with instrumentation.span("row_inference", cat="inference", cells=len(pending)):
+            row_results, pending = recognize_rows(pending, backends, row_images, cascade=cascade,
+                                                  escalate_score=escalate_score, verbose=verbose)
+        results.update(row_results)
+        if not pending:
+            return results
+
+    # Batched inference: every model sees all remaining cells in as few calls as possible
+    if cascade:
+        with instrumentation.span("cascade", cat="inference", cells=len(pending)):
+            results.update(run_cascade(pending, backends, escalate_score, verbose=verbose))
+    else:
+        images = [item[3] for item in pending]
+        keys = [item[0] for item in pending]
+
+        def join(i, answers):
+            # Called per cell as soon as every member has answered it
+            text_ans, confidence = combine_answers(*(a["ans"] for a in answers))
+            results[keys[i]] = {"ans": text_ans, "conf": confidence,
+                                "scores": [a["score"] for a in answers], "tier": "ensemble"}
+
+        recognize_members(backends, images, keys=keys, on_complete=join, verbose=verbose)
+    return results
+
+def scan_stream(chunks, backends, blank_threshold=BLANK_INK_THRESHOLD, cascade=False,
+                escalate_score=ESCALATE_SCORE, cache=None, stop_at_ceiling=False, chunk_size=10,
+                question_nums=None, digits=None, encoder=None):
+    """
+    Recognize answer cells as they arrive from a producer (see stream_pages).
+
+    Each chunk is recognized as soon as it is taken from the iterator, so a
+    generator that prepares the next page on a worker thread overlaps that work
+    with inference on the current one.
+
+    With stop_at_ceiling the cells are recognized in administration order, chunk_size
+    at a time, and an IncrementalScorer is consulted after each item. Once the ceiling
+    is reached no further chunk is pulled (the producer is closed) and every remaining
+    question comes back as NOT SCANNED with tier "beyond_ceiling".
+
+    Args:
+        chunks: Iterable of (answer_items, row_images or None), in administration order;
+                row_images switches on row mode for that chunk (see prepare_row_images)
+        question_nums: Questions that must be in the result even if never produced
+                       (e.g. range(1, 161)); they come back as NOT SCANNED
+        digits: Optional DigitClassifier tier run between the prefilter and the VLMs
+        encoder: Optional CellEncoder applied to the cells sent to the VLMs
+
+    Returns:
+        tuple: (answer items recognized or skipped, in arrival order,
+                dict of question_num -> {"ans", "conf", "scores", "tier"})
+    """
+    options = dict(blank_threshold=blank_threshold, cascade=cascade, escalate_score=escalate_score, digits=digits,
+                   encoder=encoder)
+    scorer = IncrementalScorer() if stop_at_ceiling else None
+    seen = []
+    results = {}
+    for answer_items, row_images in chunks:
+        seen.extend(answer_items)
+        if scorer is None:
+            with instrumentation.span("recognize", cat="inference", cells=len(answer_items)):
+                results.update(recognize_items(answer_items, backends, row_images=row_images, **options))
+            continue
+        ordered = sorted(answer_items, key=lambda item: item[0])
+        for start in range(0, len(ordered), chunk_size):
+            chunk = ordered[start:start + chunk_size]
+            with instrumentation.span("recognize", cat="inference", cells=len(chunk), first=chunk[0][0]):
+                results.update(recognize_items(chunk, backends, verbose=False, row_images=row_images, **options))
+            for item in chunk:
+                scorer.add(results[item[0]]["ans"])
+                if scorer.ceiling_reached:
+                    break
+            if scorer.ceiling_reached:
+                break
+        if scorer.ceiling_reached:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            break
+
+    expected = set(item[0] for item in seen) | set(question_nums or ())
+    finish_scan(results, expected, scorer)
+    print_cache_stats(cache)
+    return seen, results
+
+def finish_scan(results, expected, scorer=None):
+    """Report questions that were never recognized (beyond the ceiling) as NOT SCANNED."""
+    skipped = expected - set(results)
+    for q in skipped:
+        results[q] = {"ans": NOT_SCANNED, "conf": None, "scores": [], "tier": NOT_SCANNED_TIER}
+    if scorer is not None:
+        if scorer.ceiling_reached:
+            print(f"Ceiling reached at Q{scorer.ceiling_item}: {len(skipped)} cells not scanned")
+        print(f"Scanned {len(expected) - len(skipped)} of {len(expected)} answer cells in administration order")
+    if instrumentation.enabled():
+        tiers = {}
+        for res in results.values():
+            tiers[res["tier"]] = tiers.get(res["tier"], 0) + 1
+        instrumentation.record("scan", cells=len(expected), **{f"tier_{t}": n for t, n in tiers.items()})
+
+def print_cache_stats(cache):
+    if cache is not None:
+        stats = cache.stats()
+        print(f"OCR cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+
+def scan_answer_items(answer_items, backends, blank_threshold=BLANK_INK_THRESHOLD, cascade=False,
+                      escalate_score=ESCALATE_SCORE, cache=None, stop_at_ceiling=False, chunk_size=10,
+                      row_images=None, digits=None, encoder=None):
+    """
+    Recognize prepared answer cells with the loaded backends (see scan_stream).
+
+    row_images (see prepare_row_images) switches on row mode: one model call per
+    answer row instead of one per cell.
+
+    Returns:
+        List of {"ans", "conf", "scores", "tier"} dicts, parallel to answer_items
+    """
+    _, results = scan_stream([(answer_items, row_images)], backends, blank_threshold=blank_threshold,
+                             cascade=cascade, escalate_score=escalate_score, cache=cache,
+                             stop_at_ceiling=stop_at_ceiling, chunk_size=chunk_size, digits=digits,
+                             encoder=encoder)
+    return [results[item[0]] for item in answer_items]
+
+def read_cells(rec, work, row_images=None):
+    """
+    One ensemble member's answers for a set of cells, in as few calls as possible.
+
+    With row_images the answer rows holding the cells are read whole first; the
+    cells of rows whose response does not parse are then read one by one.
+
+    Args:
+        rec: Loaded backend
+        work: List of (job index, answer item) pairs
+        row_images: Optional list of row-strip dicts (see prepare_row_images), one per job
+
+    Returns:
+        Dict of (job index, question_num) -> {"ans", "score", "row"}
+    """
+    answers = {}
+    leftover = work
+    if row_images:
+        row_of = [{q: key for key in rows for q in key} if rows else {} for rows in row_images]
+        by_row = {}
+        leftover = []
+        for job, item in work:
+            key = row_of[job].get(item[0])
+            if key is None:
+                leftover.append((job, item))
             else:
-                # Both different numbers, prefer the first or check if one matches expected, but since we don't know, use ans1
-                text_ans = ans1
-            
-            # Debug: Save problematic cells
-            if question_num in [1, 2, 3, 11, 12, 13, 21, 22, 24, 28, 31, 33, 34, 46, 50, 60, 61, 62, 64, 68, 76, 78, 91, 92, 100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 121, 134]:
-                debug_path = os.path.join(dirname, f"debug_cells/Q{question_num}_page{p_idx+1}_cell{c_idx+1}.png")
-                cell_img.save(debug_path)
-            
-            all_scanned_answers.append({"ans": text_ans, "conf": confidence})
-
-    # 3. Final Scoring
-    print("\n\nCalculating Final Score...")
-    raw_score, report = score_results(all_scanned_answers)
-
-    # 4. Display Report
+                by_row.setdefault((job, key), []).append(item)
+        if by_row:
+            rows = list(by_row)
+            responses = rec.recognize([row_images[job][key] for job, key in rows], prompt=ROW_PROMPT,
+                                      keys=[key for _, key in rows], max_tokens=ROW_MAX_TOKENS)
+            for (job, key), res in zip(rows, responses):
+                parsed = parse_row_response(res["ans"], len(key))
+                for item in by_row[(job, key)]:
+                    if parsed is None:
+                        leftover.append((job, item))
+                    else:
+                        answers[(job, item[0])] = {"ans": parsed[key.index(item[0])], "score": res["score"], "row": True}
+    if leftover:
+        responses = rec.recognize([item[3] for _, item in leftover], keys=[item[0] for _, item in leftover])
+        for (job, item), res in zip(leftover, responses):
+            answers[(job, item[0])] = {"ans": res["ans"], "score": res["score"], "row": False}
+    return answers
+
+def combine_member_answers(members, cascade=False):
+    """
+    Merge the per-model answers of one cell with the interleaved schedule's rules.
+
+    In cascade mode members holds the small model's answer, plus the large model's
+    when the cell was escalated.
+    """
+    scores = [m["score"] for m in members]
+    if cascade:
+        small = members[0]
+        if len(members) == 1:
+            return {"ans": small["ans"], "conf": True, "scores": scores,
+                    "tier": "small_row" if small["row"] else "small"}
+        text_ans, confidence = combine_answers(members[-1]["ans"], small["ans"])
+        return {"ans": text_ans, "conf": confidence, "scores": scores, "tier": "large"}
+    text_ans, confidence = combine_answers(*(m["ans"] for m in members))
+    tier = "row" if all(m["row"] for m in members) else "ensemble"
+    return {"ans": text_ans, "conf": confidence, "scores": scores, "tier": tier}
+
+def scan_model_major(jobs, backends, blank_threshold=BLANK_INK_THRESHOLD, cascade=False,
+                     escalate_score=ESCALATE_SCORE, cache=None, stop_at_ceiling=False, chunk_size=10,
+                     question_nums=None, verbose=True, digits=None, encoder=None):
+    """
+    Low-memory schedule: only one model is resident at a time.
+
+    Every ensemble member but the last is loaded, reads all pending cells of all
+    jobs (both pages, and every subject in batch mode) and is unloaded before the
+    next model is loaded. Its answers are kept for the combination step and, with an
+    OCR cache, persisted, so an interrupted run does not read them again. The last
+    (large) model then reads the cells in administration order, one chunk of every
+    job per round, and the answers are merged with the interleaved schedule's
+    agreement rules. With stop_at_ceiling a job stops once its ceiling is reached:
+    the ceiling saves large-model calls, but the small model reads every cell.
+
+    Args:
+        jobs: List of (answer_items, row_images or None), one per protocol
+        backends: Ensemble members, smallest first; loaded and unloaded here
+        question_nums: Questions that must be in every job's result (see scan_stream)
+        digits: Optional DigitClassifier tier, run before any model is loaded
+        encoder: Optional CellEncoder applied to the cells sent to the VLMs
+
+    Returns:
+        List of dicts of question_num -> {"ans", "conf", "scores", "tier"}, one per job
+    """
+    results = []
+    pending = []
+    for job, (items, _) in enumerate(jobs):
+        blank, todo = prefilter_items(items, blank_threshold, verbose=verbose)
+        if digits is not None and todo:
+            digit_results, todo = read_digits(todo, digits, verbose=verbose)
+            blank.update(digit_results)
+        if encoder is not None:
+            with instrumentation.span("encode_cells", cat="image", cells=len(todo)):
+                todo = encode_items(todo, encoder)
+        results.append(blank)
+        pending.extend((job, item) for item in todo)
+    row_images = [rows for _, rows in jobs] if any(rows for _, rows in jobs) else None
+    early, last = (backends[:1] if cascade else backends[:-1]), backends[-1]
+
+    answers = []
+    for rec in early:
+        with instrumentation.span("model_pass", cat="inference", model=rec.model_id, cells=len(pending)):
+            if verbose:
+                print(f"Scanning {len(pending)} answer cells of {len(jobs)} protocol(s) with {rec.model_id}...")
+            try:
+                rec.load()
+                answers.append(read_cells(rec, pending, row_images))
+            finally:
+                rec.unload()
+
+    # The last model goes through the jobs in lockstep, chunk by chunk in administration order
+    ordered = [sorted(items, key=lambda item: item[0]) for items, _ in jobs]
+    step = chunk_size if stop_at_ceiling else max([len(o) for o in ordered] + [1])
+    scorers = [IncrementalScorer() if stop_at_ceiling else None for _ in jobs]
+    is_pending = set((job, item[0]) for job, item in pending)
+    active = [job for job in range(len(jobs)) if ordered[job]]
+    read = 0
+    with instrumentation.span("model_pass", cat="inference", model=last.model_id) as sp:
+        try:
+            last.load()
+            start = 0
+            while active:
+                chunks = {job: ordered[job][start:start + step] for job in active}
+                work = [(job, item) for job, chunk in chunks.items() for item in chunk
+                        if (job, item[0]) in is_pending
+                        and not (cascade and not needs_escalation(answers[0][(job, item[0])], escalate_score))]
+                late = read_cells(last, work, None if cascade else row_images) if work else {}
+                read += len(work)
+                for job, chunk in chunks.items():
+                    for item in chunk:
+                        key = (job, item[0])
+                        if key in is_pending:
+                            members = [a[key] for a in answers] + ([late[key]] if key in late else [])
+                            results[job][item[0]] = combine_member_answers(members, cascade)
+                    scorer = scorers[job]
+                    if scorer is not None:
+                        for item in chunk:
+                            scorer.add(results[job][item[0]]["ans"])
+                            if scorer.ceiling_reached:
+                                break
+                start += step
+                active = [job for job in active if start < len(ordered[job])
+                          and not (scorers[job] is not None and scorers[job].ceiling_reached)]
+        finally:
+            last.unload()
+        sp.set(cells=read)
+    if verbose:
+        print(f"Scanned {read} answer cells with {last.model_id}")
+
+    for job, (items, _) in enumerate(jobs):
+        finish_scan(results[job], set(item[0] for item in items) | set(question_nums or ()), scorers[job])
+    print_cache_stats(cache)
+    return results
+
+def print_report(raw_score, report):
     print("\n" + "="*50)
     print(f"PRECISION SCORING REPORT (160 ITEMS)")
     print(f"Final Raw Score: {raw_score}")
@@ -114,98 +794,249 @@ def run_precision_assessment(p1_path, p2_path):
         ceiling = " [CEILING REACHED]" if entry['ceiling'] else ""
         print(f"Q{entry['question']}: OCR: {entry['detected']} | Expected: {entry['expected']} {entry['status']}{ceiling}")
 
-    # 5. Create colored visualization
-    create_colored_visualization(report, p1_path, p2_path)
+def run_precision_assessment(p1_path, p2_path, backend="mlx", batch_size=8, backends=None,
+                             blank_threshold=BLANK_INK_THRESHOLD, cascade=False,
+                             escalate_score=ESCALATE_SCORE, cache=None, output_dir=None, debug=True,
+                             target_dpi=None, score_all=False, row_mode=False, schedule="auto",
+                             memory_budget_mb=None, digits=None, encoder=None, parallel=1, store=None,
+                             limit=None, visualize=True, overlay_format=DEFAULT_OVERLAY_FORMAT,
+                             overlay_width=DEFAULT_OVERLAY_WIDTH,
+                             results_store=None):
+    """
+    Scan and score one protocol (two pages).
 
-def create_colored_visualization(report, p1_path, p2_path):
-    from PIL import Image, ImageDraw
-    from image_utils import force_clean
-    
-    pages = [p1_path, p2_path]
-    for p_idx, p_path in enumerate(pages):
-        clean_path = force_clean(p_path)
-        img = Image.open(clean_path)
-        vis_img = img.copy()
-        draw = ImageDraw.Draw(vis_img, "RGBA")
-        
-        w, h = img.size
-        content_top = int(h * 0.0)
-        content_bottom = int(h * 1.0)
-        content_left = int(w * 0.0)
-        content_right = int(w * 1.0)
-        
-        grid_h = content_bottom - content_top
-        grid_w = content_right - content_left
-        pair_h = grid_h // 8
-        cell_w = grid_w // 10
-        
-        for r in range(16):
-            if r % 2 == 0:
-                continue  # only answer rows
-            pair_i = r // 2
-            pair_top = content_top + pair_i * pair_h
-            question_h = int(pair_h * 0.6)
-            top = pair_top + question_h
-            bottom = pair_top + pair_h
-            
-            for c in range(10):
-                left = content_left + c * cell_w
-                right = left + cell_w
-                
-                question_num = (p_idx * 80) + ((r // 2) * 10) + c + 1
-                entry = report[question_num - 1]
-                
-                if entry["status"] == "✅":
-                    color = (0, 255, 0, 128)  # green with alpha
-                elif entry["detected"] == "EMPTY":
-                    color = (255, 255, 0, 128)  # yellow
-                elif entry["conf"]:
-                    color = (255, 0, 0, 128)  # red
-                else:
-                    color = (255, 165, 0, 128)  # orange
-                
-                draw.rectangle([(left, top), (right, bottom)], fill=color)
-        
-        output_path = os.path.join(dirname, f"debug_cells/colored_page_{p_idx+1}.png")
-        vis_img.save(output_path)
-        print(f"Colored visualization saved to: {output_path}")
+    Each page is decoded and straightened once into a PageContext that the
+    cropping and visualization stages share; pages are streamed (see stream_pages)
+    so that decoding page 2 overlaps with recognizing page 1.
 
-if __name__ == "__main__":
-    # 1. Setup Argparse
+    Models are loaded by the first cell that needs them, so a run whose cells are
+    all blank, read by the digit tier or answered from the OCR cache never imports
+    the ML framework.
+
+    Args:
+        output_dir: Folder for debug output and the colored pages; defaults to the folder of page 1
+        debug: DebugWriter, debug level name ("off", "sampled", "full", "disagreements")
+               or bool (True = "sampled")
+        target_dpi: Straighten pages straight to this resolution (None = native photo size)
+        score_all: Scan and score all 160 items, ignoring the ceiling (validation mode)
+        row_mode: Read each answer row in one model call, per-cell only as a fallback
+        schedule: "interleaved", "model-major" or "auto" (see choose_schedule)
+        memory_budget_mb: Peak model memory the auto schedule must stay within
+        digits: Optional DigitClassifier; confidently read cells skip the VLMs
+        encoder: Optional CellEncoder; cells are normalized to a fixed visual-token budget
+        parallel: Ensemble members run concurrently when backends are loaded here (see load_backends)
+        store: ArtifactStore for the decoded, straightened pages and their grids (None = recompute)
+        limit: Recognize only the first N answer cells (smoke tests); the rest are NOT REQUESTED
+        visualize: Write the colored result pages to output_dir/debug_cells/
+        overlay_format: "png", "jpeg", "webp" or "json" (cell boxes and statuses, no image)
+        overlay_width: Downscale the colored pages to this width (None or 0 = full size)
+        results_store: ResultsStore the report is added to, keyed on the folder of page 1
+                       (not for --limit runs, whose reports are partial)
+
+    Returns:
+        tuple: (raw_score, report) as returned by score_results
+    """
+    if output_dir is None:
+        output_dir = os.path.dirname(p1_path)
+
+    # 1. Create the models (interleaved loads each on first use, model-major one at a time)
+    owns_backends = backends is None
+    if owns_backends:
+        backends = load_backends(backend, batch_size=batch_size, cache=cache, load=False, parallel=parallel)
+    try:
+        schedule = choose_schedule(backends, schedule, memory_budget_mb)
+        print(f"Execution schedule: {schedule}")
+
+        # 2. Stream the pages: page 2 is decoded and cropped on a background thread while
+        #    page 1 is recognized, and debug images are encoded in the background as well.
+        #    With the ceiling on, page 2 is never handed over once the ceiling falls on page 1.
+        page_paths = (p1_path, p2_path)
+        with writer_for(debug) as writer:
+            pages = [None] * len(page_paths)
+            stream = stream_pages(page_paths, output_dir, debug=writer, target_dpi=target_dpi,
+                                  row_mode=row_mode, pages_out=pages, store=store)
+            if limit is not None:
+                print(f"Limiting OCR to the first {limit} answer cells")
+                stream = limit_chunks(stream, limit)
+
+            # 3. Prefilter + batched inference
+            question_nums = range(1, len(WJ_MATH_ANSWER_KEY) + 1)
+            if schedule == "model-major":
+                # Every model needs all cells in one pass, so both pages are prepared first
+                chunks = list(stream)
+                answer_items = [item for items, _ in chunks for item in items]
+                row_images = {key: strip for _, rows in chunks for key, strip in (rows or {}).items()} or None
+                results = scan_model_major([(answer_items, row_images)], backends, blank_threshold=blank_threshold,
+                                           cascade=cascade, escalate_score=escalate_score, cache=cache,
+                                           stop_at_ceiling=not score_all, question_nums=question_nums,
+                                           digits=digits, encoder=encoder)[0]
+            else:
+                answer_items, results = scan_stream(stream, backends, blank_threshold=blank_threshold,
+                                                    cascade=cascade, escalate_score=escalate_score, cache=cache,
+                                                    stop_at_ceiling=not score_all, question_nums=question_nums,
+                                                    digits=digits, encoder=encoder)
+            if limit is not None:
+                mark_not_requested(results, question_nums, limit)
+            all_scanned_answers = [results[q] for q in question_nums]
+            write_disagreements(answer_items, [results[item[0]] for item in answer_items], output_dir, writer)
+
+            # 4. Final Scoring
+            print("\n\nCalculating Final Score...")
+            with instrumentation.span("score_results"):
+                raw_score, report = score_results(all_scanned_answers, apply_ceiling=not score_all)
+
+            # 5. Display Report
+            print_report(raw_score, report)
+            if results_store is not None and limit is not None:
+                print("Not recording a --limit run in the results store")
+            elif results_store is not None:
+                user, subject = protocol_names(p1_path)
+                results_store.add_protocol(report, raw_score, os.path.dirname(os.path.abspath(p1_path)), user=user,
+                                           subject=subject, scanned=all_scanned_answers, backend=backend)
+
+            # 6. Create colored visualization
+            if visualize:
+                with instrumentation.span("colored_visualization", cat="io"):
+                    create_colored_visualization(report, p1_path, p2_path, output_dir, pages=pages,
+                                                 target_dpi=target_dpi, store=store, image_format=overlay_format,
+                                                 max_width=overlay_width)
+        return raw_score, report
+    finally:
+        if owns_backends:
+            close_backends(backends)
+
+def create_colored_visualization(report, p1_path, p2_path, output_dir=None, pages=None, target_dpi=None, store=None,
+                                 image_format=DEFAULT_OVERLAY_FORMAT, max_width=DEFAULT_OVERLAY_WIDTH):
+    """
+    Colored result pages (or their cell statuses as JSON) in output_dir/debug_cells/.
+
+    Uses the pages and GridLayouts the scan already has; see result_overlay.write_overlays.
+
+    Args:
+        pages: PageContexts from the scan; pages it never decoded are loaded here
+        image_format: "png", "jpeg", "webp" or "json" (no image, boxes and statuses only)
+        max_width: Downscale the images to this width (None or 0 = full size)
+
+    Returns:
+        Paths written
+    """
+    if output_dir is None:
+        output_dir = os.path.dirname(p1_path)
+    # Pages the streaming pipeline never decoded (ceiling reached early) are loaded here
+    pages = [page if page is not None else load_page(p, target_dpi=target_dpi, store=store)
+             for p, page in zip((p1_path, p2_path), pages or (None, None))]
+    layouts = [page_layout(page, 10, **page_margins(p_idx)) for p_idx, page in enumerate(pages)]
+    return write_overlays(report, pages, layouts, output_dir, image_format=image_format, max_width=max_width)
+
+def visualize_pages(page_paths, output_dir, target_dpi=None, store=None, debug=True):
+    """
+    Grid overlays of the pages (debug_cells/page_N_viz.png in output_dir), without any OCR.
+
+    The overlays are encoded in the background by the DebugWriter (in its image
+    format); the *_clean intermediates are written only when its level asks for them.
+
+    Returns:
+        Paths of the overlays
+    """
+    paths = []
+    with writer_for(debug) as writer:
+        for i, p in enumerate(page_paths):
+            print(f"  -> Processing Page {i+1} grid...")
+            page = load_page(p, write_intermediates=writer.wants("intermediates"), target_dpi=target_dpi,
+                             writer=writer, store=store)
+            output_path = os.path.join(output_dir, f"debug_cells/page_{i+1}_viz.png")
+            visualize_content_box(page, output_path=output_path, writer=writer, **page_margins(i))
+            paths.append(writer.path_for(output_path))
+    return paths
+
+def build_parser():
     parser = argparse.ArgumentParser(description="WJ-IV Math Scoring Scanner")
     parser.add_argument("--viz", action="store_true", help="Generate grid visualizations and exit (no OCR)")
-    parser.add_argument("--limit", type=int, default=None, help="Limit OCR to the first N cells (for quick testing)")
-    parser.add_argument("--fpath1", type=str, help="fpath for Page 1")
-    parser.add_argument("--fpath2", type=str, help="fpath for Page 2")
+    parser.add_argument("--limit", type=positive_int, default=None, help="Recognize only the first N answer cells (quick smoke tests)")
+    parser.add_argument("--fpath1", type=str, required=True, help="fpath for Page 1")
+    parser.add_argument("--fpath2", type=str, required=True, help="fpath for Page 2")
+    parser.add_argument("--output-dir", type=str, default=None, help="Folder for debug_cells/ and the colored pages (default: folder of page 1)")
+    parser.add_argument("--no-colored-pages", action="store_true", help="Skip the colored result pages (debug_cells/colored_page_*)")
+    parser.add_argument("--overlay-format", choices=OVERLAY_FORMATS, default=DEFAULT_OVERLAY_FORMAT, help="Colored result pages as jpeg, png or webp, or json (cell boxes and statuses only)")
+    parser.add_argument("--overlay-width", type=int, default=DEFAULT_OVERLAY_WIDTH, help="Downscale the colored result pages to this width (0 = full size; full-size PNG: --overlay-format png --overlay-width 0)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mlx", help="Recognizer backend (mlx, cpu or stub)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Answer cells per model forward pass")
+    parser.add_argument("--blank-threshold", type=float, default=BLANK_INK_THRESHOLD, help="Ink ratio below which a cell is treated as EMPTY")
+    parser.add_argument("--cascade", action="store_true", help="Run the large model only on cells the small model is unsure about")
+    parser.add_argument("--escalate-score", type=float, default=ESCALATE_SCORE, help="Cascade: escalate answers below this mean token probability")
+    parser.add_argument("--cache-dir", type=str, default=DEFAULT_CACHE_DIR, help="Folder of the persistent OCR result cache")
+    parser.add_argument("--no-cache", action="store_true", help="Always run the models, bypassing the OCR cache")
+    parser.add_argument("--artifact-dir", type=str, default=DEFAULT_ARTIFACT_DIR, help="Folder of the decoded/straightened page and grid artifacts")
+    parser.add_argument("--no-artifacts", action="store_true", help="Always decode and straighten the pages, bypassing the artifact store")
+    parser.add_argument("--artifact-max-gb", type=float, default=DEFAULT_ARTIFACT_MAX_BYTES / 1024 ** 3, help="Size budget of the artifact store; least recently used artifacts are deleted beyond it")
+    parser.add_argument("--results-db", type=str, default=None, help=f"Add the report to this SQLite results store, e.g. {DEFAULT_RESULTS_DB} (default: not recorded; see results_store.py)")
+    parser.add_argument("--debug-level", choices=sorted(DEBUG_LEVELS), default="sampled", help="Debug images to write (off, sampled, full, disagreements)")
+    parser.add_argument("--no-debug", action="store_true", help="Same as --debug-level off")
+    parser.add_argument("--debug-format", choices=sorted(IMAGE_FORMATS), default="png", help="Encoding of debug images")
+    parser.add_argument("--png-compress-level", type=int, default=1, help="zlib level for PNG debug images (0-9)")
+    parser.add_argument("--target-dpi", type=int, default=None, help="Straighten pages straight to this resolution (e.g. 200)")
+    parser.add_argument("--score-all", action="store_true", help="Scan and score all 160 items, ignoring the ceiling (validation)")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every answer cell to the models, even blank ones")
+    parser.add_argument("--row-mode", action="store_true", help="Read each answer row in one model call (per-cell fallback)")
+    parser.add_argument("--digit-tier", action="store_true", help="Read confident cells with the CPU digit classifier, VLMs only for the rest")
+    parser.add_argument("--digit-model", type=str, default=DEFAULT_DIGIT_MODEL, help="Digit classifier model (see digit_classifier.py)")
+    parser.add_argument("--digit-conf", type=float, default=None, help="Calibrated confidence needed to accept a digit-tier answer (default: the threshold stored in the model)")
+    parser.add_argument("--cell-target", type=parse_cell_target, default=None, help="Normalize cells to HEIGHTxWIDTH pixels before the VLMs (e.g. 56x84 = 6 visual tokens)")
+    parser.add_argument("--cell-mode", choices=CELL_MODES, default="binary", help="Rendering of normalized cells")
+    parser.add_argument("--schedule", choices=SCHEDULES, default="auto", help="interleaved: all models resident; model-major: one model at a time; auto: decide from --memory-budget-gb")
+    parser.add_argument("--memory-budget-gb", type=float, default=None, help="Peak model memory for --schedule auto (default: no limit, interleaved)")
+    parser.add_argument("--parallel", type=int, default=1, help="Ensemble members run at the same time, each on its own worker (1 = one after another)")
+    parser.add_argument("--trace", type=str, default=None, help="Record spans and write a Chrome-trace/Perfetto JSON here")
+    parser.add_argument("--metrics", type=str, default=None, help="Append JSONL metrics (model calls, tokens/sec, cache hits) here")
+    return parser
 
-    args = parser.parse_args()
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.digit_tier and not os.path.isfile(args.digit_model):
+        print(f"No digit model at {args.digit_model}; train one with digit_classifier.py")
+        return 1
+    output_dir = args.output_dir or os.path.dirname(args.fpath1)
+    store = None if args.no_artifacts else ArtifactStore(args.artifact_dir, max_bytes=int(args.artifact_max_gb * 1024 ** 3))
+    writer = DebugWriter("off" if args.no_debug else args.debug_level, image_format=args.debug_format,
+                         png_compress_level=args.png_compress_level)
 
-    # 2. Define your paths
-    page1 = args.fpath1
-    page2 = args.fpath2
-    dirname = os.path.dirname(page1)
-    
-    # 3. Handle Logic based on flags
     if args.viz:
         print("\n[!] RUNNING IN VISUALIZATION MODE (Skipping OCR)")
-        from image_utils import force_clean, visualize_content_box
-        
-        # We assume PAGE_CONFIGS is defined globally in main_scanner.py
-        for i, p in enumerate([page1, page2]):
-            cfg = PAGE_CONFIGS[i]
-            print(f"  -> Processing Page {i+1} grid...")
-            clean = force_clean(p)
-            visualize_content_box(
-                clean, 
-                output_path=os.path.join(dirname, f"debug_cells/page_{i+1}_viz.png"),
-                top_margin=cfg['top'], 
-                bottom_margin=cfg['bottom'],
-                left_margin=cfg['left'], 
-                right_margin=cfg['right']
-            )
+        try:
+            visualize_pages((args.fpath1, args.fpath2), output_dir, target_dpi=args.target_dpi, store=store,
+                            debug=writer)
+        finally:
+            writer.close()
         print("\nDone! Check the 'debug_cells/' folder for results.")
-        sys.exit(0)
+        return 0
+
+    if args.trace or args.metrics:
+        instrumentation.enable(metrics_path=args.metrics, trace_path=args.trace)
+    cache = None if args.no_cache else OCRCache(args.cache_dir)
+    results_store = ResultsStore(args.results_db) if args.results_db else None
+    try:
+        run_precision_assessment(args.fpath1, args.fpath2, backend=args.backend, batch_size=args.batch_size,
+                                 blank_threshold=None if args.no_prefilter else args.blank_threshold,
+                                 cascade=args.cascade, escalate_score=args.escalate_score,
+                                 cache=cache, output_dir=output_dir, debug=writer, target_dpi=args.target_dpi,
+                                 score_all=args.score_all, row_mode=args.row_mode, schedule=args.schedule,
+                                 memory_budget_mb=None if args.memory_budget_gb is None else args.memory_budget_gb * 1024,
+                                 digits=DigitClassifier(args.digit_model, args.digit_conf) if args.digit_tier else None,
+                                 encoder=CellEncoder(*args.cell_target, mode=args.cell_mode) if args.cell_target else None,
+                                 parallel=args.parallel, store=store, limit=args.limit,
+                                 visualize=not args.no_colored_pages, overlay_format=args.overlay_format,
+                                 overlay_width=args.overlay_width,
+                                 results_store=results_store)
+    finally:
+        writer.close()
+        if cache is not None:
+            cache.close()
+        if results_store is not None:
+            results_store.close()
+    if store is not None:
+        print_artifact_stats(store)
+    instrumentation.finish()
+    return 0
 
-    # 4. Standard Run (passing the limit flag if you want to use it in run_precision_assessment)
-    # You could modify run_precision_assessment to accept 'limit=args.limit'
-    run_precision_assessment(page1, page2)
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
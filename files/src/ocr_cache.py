@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from PIL import Image
+import instrumentation
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "wj_scanner")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Rough per-row bookkeeping cost (key, timestamps, index entries) added to the payload size
+ROW_OVERHEAD = 96
+
+
+def cell_pixels(image):
+    """Normalize a cell (PIL image or NumPy array) to a contiguous RGB uint8 array."""
+    if isinstance(image, Image.Image):
+        arr = np.asarray(image.convert("RGB"))
+    else:
+        arr = np.asarray(image)
+        if arr.ndim == 2:
+            arr = np.stack([arr] * 3, axis=-1)
+    return np.ascontiguousarray(arr, dtype=np.uint8)
+
+
+def cell_key(image, model_id, prompt, max_tokens, temp, max_pixels):
+    """
+    Content address of one OCR request.
+
+    Hashes the normalized cell pixels (including the shape, so crops with the
+    same bytes but different geometry differ) together with every parameter
+    that can change the model output.
+    """
+    arr = cell_pixels(image)
+    h = hashlib.sha256()
+    h.update(repr(arr.shape).encode())
+    h.update(arr.tobytes())
+    h.update(f"\0{model_id}\0{prompt}\0{max_tokens}\0{temp}\0{max_pixels}".encode())
+    return h.hexdigest()
+
+
+class OCRCache:
+    """
+    Persistent SQLite cache of decoded OCR answers with size-based LRU eviction.
+
+    Args:
+        cache_dir: Folder holding ocr_cache.sqlite
+        max_bytes: Approximate size budget; least recently used entries are evicted beyond it
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "ocr_cache.sqlite")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, answer TEXT NOT NULL, score REAL NOT NULL,"
+            " size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """Look up keys; returns {key: {"ans", "score"}} for the hits and bumps their recency."""
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self.lock:
+            unique = list(dict.fromkeys(keys))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT key, answer, score FROM entries WHERE key IN ({marks})", chunk).fetchall()
+                for key, answer, score in rows:
+                    found[key] = {"ans": answer, "score": score}
+            if found:
+                self.conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                      [(now, k) for k in found])
+                self.conn.commit()
+            hits = sum(1 for k in keys if k in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items):
+        """Store (key, {"ans", "score"}) pairs, then evict down to the size budget."""
+        now = time.time()
+        rows = [(key, res["ans"], float(res["score"]), len(key) + len(res["ans"]) + ROW_OVERHEAD, now)
+                for key, res in items]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CachedBackend:
+    """
+    Wraps a recognizer backend so that only cache misses reach the model.
+
+    Exposes the same recognize() interface as RecognizerBackend; every other
+    attribute is forwarded to the wrapped backend.
+    """
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def load(self):
+        self.backend.load()
+        return self
+
+    def recognize(self, images, prompt=None, keys=None, max_tokens=None):
+        from backends import OCR_PROMPT
+        prompt = prompt or OCR_PROMPT
+        b = self.backend
+        max_tokens = max_tokens or b.max_tokens
+        with instrumentation.span("cache_lookup", cat="cache", model=b.model_id, images=len(images)):
+            hashes = [cell_key(img, b.model_id, prompt, max_tokens, b.temp, b.max_pixels) for img in images]
+            cached = self.cache.get_many(hashes)
+
+        hit_keys = set(cached)
+        miss_idx = [i for i, h in enumerate(hashes) if h not in hit_keys]
+        instrumentation.record("cache", model=b.model_id, hits=len(images) - len(miss_idx), misses=len(miss_idx))
+        if miss_idx:
+            fresh = b.recognize([images[i] for i in miss_idx], prompt=prompt,
+                                keys=None if keys is None else [keys[i] for i in miss_idx],
+                                max_tokens=max_tokens)
+            self.cache.put_many([(hashes[i], res) for i, res in zip(miss_idx, fresh)])
+            for i, res in zip(miss_idx, fresh):
+                cached[hashes[i]] = res
+        return [dict(cached[h], cached=h in hit_keys) for h in hashes]
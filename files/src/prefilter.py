@@ -0,0 +1,206 @@
+import os
+import glob
+import argparse
+import cv2
+import numpy as np
+from PIL import Image
+
+# Fraction of inked pixels in the inner answer region below which a cell is blank.
+# Calibrated on the answer cells of files/data/user-DGB/sub-test_1 against blanked
+# copies of them (python prefilter.py --pages ..., see calibrate_blank_threshold):
+# least inked answer 0.0165, most inked blank 0.0. A thin one-stroke "1" is about 0.005.
+BLANK_INK_THRESHOLD = 0.0041
+
+
+def _to_gray(cell):
+    if isinstance(cell, Image.Image):
+        return np.asarray(cell.convert("L"))
+    arr = np.asarray(cell)
+    if arr.ndim == 3:
+        return cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+    return arr
+
+
+def inner_bounds(shape, buffer_pixels=30, inset=0.08):
+    """
+    (top, bottom, left, right) of the inner answer region inside a cell crop.
+
+    Strips the cropper's context buffer (when the crop is large enough to have one)
+    and then `inset` of what remains on every side; ink_mask works on this region.
+    """
+    h, w = shape[:2]
+    b = buffer_pixels if h > 4 * buffer_pixels and w > 4 * buffer_pixels else 0
+    ih, iw = h - 2 * b, w - 2 * b
+    dy, dx = int(ih * inset), int(iw * inset)
+    return b + dy, b + ih - dy, b + dx, b + iw - dx
+
+
+def ink_mask(cell, buffer_pixels=30, inset=0.08, ink_contrast=0.35):
+    """
+    Binarized handwriting mask for the inner answer region of a cell crop.
+
+    The crop from get_individual_cells carries a context buffer on every side;
+    it is stripped first, then a small inset removes the cell borders. Printed
+    grid lines and answer underlines are removed with a morphological line
+    extraction so that only handwriting remains.
+
+    Args:
+        cell: PIL image or NumPy array (as returned by get_individual_cells)
+        buffer_pixels: Context buffer added around each cell by the cropper
+        inset: Fraction of the inner region trimmed from each side
+        ink_contrast: How much darker than the paper a pixel must be to count as ink
+
+    Returns:
+        Boolean NumPy array, True where there is ink
+    """
+    gray = _to_gray(cell)
+    y0, y1, x0, x1 = inner_bounds(gray.shape, buffer_pixels, inset)
+    inner = gray[y0:y1, x0:x1]
+    if inner.size == 0:
+        return np.zeros((0, 0), dtype=bool)
+
+    # Binarize relative to the paper brightness so shadows and tinted paper don't count
+    background = float(np.median(inner))
+    ink = (inner < background * (1.0 - ink_contrast)).astype(np.uint8)
+
+    # Remove long straight strokes (grid lines, underlines) before measuring.
+    # Vertical grid lines span the whole cell; a handwritten "1" does not.
+    ih, iw = ink.shape
+    h_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(iw // 3, 1), 1))
+    v_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(int(ih * 0.8), 1)))
+    lines = cv2.morphologyEx(ink, cv2.MORPH_OPEN, h_kernel) | cv2.morphologyEx(ink, cv2.MORPH_OPEN, v_kernel)
+    lines = cv2.dilate(lines, np.ones((3, 3), np.uint8))
+    ink = ink & (1 - lines)
+
+    # Drop isolated specks (scanner noise, paper texture)
+    ink = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    return ink.astype(bool)
+
+
+def ink_ratio(cell, **kwargs):
+    """Fraction of inked pixels in the inner answer region (see ink_mask)."""
+    mask = ink_mask(cell, **kwargs)
+    return float(mask.mean()) if mask.size else 0.0
+
+
+def classify_blank(cell, threshold=BLANK_INK_THRESHOLD, **kwargs):
+    """
+    Decide whether an answer cell is empty.
+
+    Returns:
+        tuple: (is_blank, confidence, ratio). Confidence is in [0, 1] and grows
+        the further the ink ratio is from the threshold.
+    """
+    ratio = ink_ratio(cell, **kwargs)
+    if ratio < threshold:
+        confidence = 1.0 - ratio / threshold
+        return True, confidence, ratio
+    confidence = min(1.0, (ratio - threshold) / threshold)
+    return False, confidence, ratio
+
+
+# Share of the gap between the most inked blank and the least inked answer at which the
+# threshold is put. Low, because the two errors cost differently: an answer read as
+# blank loses the item, a blank sent to the models only costs one model call.
+BLANK_SIDE = 0.25
+
+# Synthetic blanks: dark blobs narrower than this share of the crop are handwriting
+# (fraction bars and grid lines are wider, or touch the crop edge)
+HANDWRITING_MAX_WIDTH = 0.5
+
+
+def _load(cell):
+    return Image.open(cell) if isinstance(cell, str) else cell
+
+
+def synthesize_blank(cell):
+    """
+    An empty copy of an answered cell crop, for calibration.
+
+    Dark connected blobs that neither touch the crop edge nor span half its width
+    (the handwriting) are painted over from the surrounding paper; grid lines,
+    fraction bars, shadows and paper texture stay as they were. Found independently
+    of ink_mask (Otsu binarization of the whole crop), so the blank is not cleaned
+    by the very measure it calibrates.
+
+    Returns:
+        HxWx3 uint8 RGB array
+    """
+    img = _load(cell)
+    rgb = np.ascontiguousarray(img.convert("RGB") if isinstance(img, Image.Image) else img)
+    if rgb.ndim == 2:
+        rgb = cv2.cvtColor(rgb, cv2.COLOR_GRAY2RGB)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    _, dark = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(dark, connectivity=8)
+    h, w = gray.shape
+    x, y, bw, bh = stats[:, 0], stats[:, 1], stats[:, 2], stats[:, 3]
+    inside = (x > 0) & (y > 0) & (x + bw < w) & (y + bh < h) & (bw <= HANDWRITING_MAX_WIDTH * w)
+    inside[0] = False  # background label
+    handwriting = inside[labels].astype(np.uint8)
+    handwriting = cv2.dilate(handwriting, np.ones((5, 5), np.uint8), iterations=2)
+    return cv2.inpaint(rgb, handwriting, 5, cv2.INPAINT_TELEA)
+
+
+def calibrate_blank_threshold(inked_cells, blank_cells, blank_side=BLANK_SIDE, **kwargs):
+    """
+    Pick a blank/inked threshold from labeled cell crops.
+
+    The threshold sits `blank_side` of the way from the most inked blank crop to
+    the least inked answered crop. Blank crops can be real empty cells or
+    synthesize_blank copies of answered ones.
+
+    Args:
+        inked_cells: Crops (paths, PIL images or arrays) known to contain an answer
+        blank_cells: Crops known to be empty
+
+    Returns:
+        tuple: (threshold, stats dict)
+    """
+    inked = [ink_ratio(_load(c), **kwargs) for c in inked_cells]
+    blank = [ink_ratio(_load(c), **kwargs) for c in blank_cells]
+    if not inked or not blank:
+        raise ValueError("Calibration needs inked and blank samples")
+    min_inked, max_blank = min(inked), max(blank)
+    threshold = max_blank + (min_inked - max_blank) * blank_side
+    stats = {
+        "inked": len(inked), "blank": len(blank),
+        "min_inked": min_inked, "max_blank": max_blank,
+        "separable": max_blank < min_inked,
+    }
+    return threshold, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the blank-cell ink threshold")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--debug-dir", type=str, help="debug_cells folder with answer crops")
+    source.add_argument("--pages", type=str, nargs=2, metavar=("PAGE1", "PAGE2"), help="Scans whose answer cells are cropped here")
+    parser.add_argument("--blank", type=str, nargs="*", default=[], help="--debug-dir crops (file names or globs) known to be empty")
+    parser.add_argument("--no-synthetic-blanks", action="store_true", help="Only use the --blank crops, no blanked copies of the answered ones")
+    parser.add_argument("--blank-side", type=float, default=BLANK_SIDE, help="Where in the blank/inked gap the threshold goes (0 = at the blanks)")
+    args = parser.parse_args()
+
+    blank_cells = []
+    if args.pages:
+        from image_utils import iter_answer_cells, load_page
+        from main_scanner import page_margins
+        inked_cells = [cell for i, p in enumerate(args.pages)
+                       for _, _, cell in iter_answer_cells(load_page(p), **page_margins(i))]
+    else:
+        for pattern in args.blank:
+            blank_cells.extend(sorted(glob.glob(os.path.join(args.debug_dir, pattern))))
+        candidates = glob.glob(os.path.join(args.debug_dir, "Q*_page*_cell*.png")) + \
+            glob.glob(os.path.join(args.debug_dir, "page_*_answer_Q*.png"))
+        inked_cells = sorted(set(candidates) - set(blank_cells))
+        for p in inked_cells + blank_cells:
+            print(f"{os.path.basename(p)}: {ink_ratio(Image.open(p)):.5f}")
+    if not args.no_synthetic_blanks:
+        blank_cells += [synthesize_blank(c) for c in inked_cells]
+
+    threshold, stats = calibrate_blank_threshold(inked_cells, blank_cells, blank_side=args.blank_side)
+    print(f"\nInked samples: {stats['inked']} (min ratio {stats['min_inked']:.5f})")
+    print(f"Blank samples: {stats['blank']} (max ratio {stats['max_blank']:.5f})")
+    if not stats["separable"]:
+        print("Warning: blank and inked samples overlap, review the labels")
+    print(f"Suggested BLANK_INK_THRESHOLD = {threshold:.5f}")
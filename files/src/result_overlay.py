@@ -0,0 +1,191 @@
+import os
+import json
+import cv2
+import numpy as np
+from PIL import Image
+import instrumentation
+from config import NOT_REQUESTED_TIER, NOT_SCANNED_TIER
+from debug_writer import IMAGE_FORMATS
+
+# Overlay outputs: an image format, or "json" for cell boxes and statuses only
+OVERLAY_FORMATS = tuple(IMAGE_FORMATS) + ("json",)
+
+# Default overlay: a JPEG preview this wide (about 0.3 s for both pages at native
+# resolution); a full-size PNG takes about 5 s, almost all of it in the encoder
+DEFAULT_OVERLAY_FORMAT = "jpeg"
+DEFAULT_OVERLAY_WIDTH = 1200
+
+# Cell statuses in code order, with their overlay color
+STATUSES = ("correct", "empty", "wrong", "unsure", "not_scanned", "not_requested")
+STATUS_COLORS = {
+    "correct": (0, 255, 0),        # green
+    "empty": (255, 255, 0),        # yellow
+    "wrong": (255, 0, 0),          # red: confident but wrong
+    "unsure": (255, 165, 0),       # orange: wrong, models disagreed
+    "not_scanned": (128, 128, 128),  # gray: beyond ceiling, never scanned
+    "not_requested": (100, 149, 237),  # blue: left out by --limit, never scanned
+}
+
+# Opacity of the status colors (PIL's RGBA fill of 128)
+OVERLAY_ALPHA = 128 / 255
+
+# Status code of pixels and cells outside the answer grid
+NO_CELL = 255
+
+
+def cell_status(entry):
+    """Status name of one score_results report entry."""
+    if entry["tier"] == NOT_SCANNED_TIER:
+        return "not_scanned"
+    if entry["tier"] == NOT_REQUESTED_TIER:
+        return "not_requested"
+    if entry["status"] == "✅":
+        return "correct"
+    if entry["detected"] == "EMPTY":
+        return "empty"
+    return "wrong" if entry["conf"] else "unsure"
+
+
+def status_codes(report, p_idx, pairs, cols):
+    """(pairs, cols) uint8 array of STATUSES indices for one page's answer cells (NO_CELL past the report)."""
+    codes = np.full((pairs, cols), NO_CELL, dtype=np.uint8)
+    first = p_idx * pairs * cols
+    for i, entry in enumerate(report[first:first + pairs * cols]):
+        codes[i // cols, i % cols] = STATUSES.index(cell_status(entry))
+    return codes
+
+
+def status_mask(shape, layout, codes, scale=1.0):
+    """
+    uint8 status code of every pixel (NO_CELL outside the answer cells), for all cells at once.
+
+    Each pixel row is matched against the answer rows of every column in one
+    broadcast comparison, giving a (height, cols) table of codes; one gather along
+    the pixel columns then spreads it over the page. The mask follows the
+    per-column edges of a detected GridLayout.
+
+    Args:
+        shape: (height, width) of the image the mask is for
+        layout: GridLayout of the page at full resolution
+        codes: (pairs, cols) status codes (see status_codes)
+        scale: Image size relative to the layout (a downscaled preview is < 1)
+    """
+    h, w = shape
+    cols = codes.shape[1]
+    boxes = layout.answer_boxes * scale
+    ys = np.arange(h)[:, None, None] + 0.5  # pixel centers
+    inside = (ys >= boxes[None, :, :, 1]) & (ys < boxes[None, :, :, 3])  # (h, pairs, cols)
+    pair_of = inside.argmax(axis=1)
+    rows = np.full((h, cols + 1), NO_CELL, dtype=np.uint8)  # last column: outside the grid
+    rows[:, :cols] = np.where(inside.any(axis=1), codes[pair_of, np.arange(cols)], NO_CELL)
+
+    edges = layout.col_edges * scale
+    xs = np.arange(w) + 0.5
+    col_of = np.searchsorted(edges, xs, side="right") - 1
+    col_of[(xs < edges[0]) | (xs >= edges[-1])] = cols
+    return np.take(rows, col_of, axis=1)
+
+
+def render_overlay(image, layout, codes, max_width=None, alpha=OVERLAY_ALPHA):
+    """
+    The page with every answer cell tinted by its status, blended in one operation.
+
+    The status mask is turned into a color layer with one lookup table per
+    channel, the whole page is blended with it at once and the blend is kept
+    where the mask marks a cell.
+
+    Args:
+        image: HxWx3 RGB array of the straightened page
+        layout: GridLayout of the page
+        codes: (pairs, cols) status codes (see status_codes)
+        max_width: Downscale to this width first (None = full size)
+
+    Returns:
+        HxWx3 RGB uint8 array
+    """
+    h, w = image.shape[:2]
+    scale = 1.0
+    if max_width and w > max_width:
+        scale = max_width / w
+        size = (max_width, max(1, int(round(h * scale))))
+        # INTER_AREA is only fast for an exact integer reduction; the rest is a small linear step
+        factor = w // max_width
+        if factor >= 2:
+            image = cv2.resize(image[:h - h % factor, :w - w % factor], (w // factor, h // factor),
+                               interpolation=cv2.INTER_AREA)
+        image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+    mask = status_mask(image.shape[:2], layout, codes, scale)
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    lut[:len(STATUSES)] = [STATUS_COLORS[s] for s in STATUSES]
+    colors = cv2.merge([cv2.LUT(mask, np.ascontiguousarray(lut[:, k])) for k in range(3)])
+    blended = cv2.addWeighted(np.ascontiguousarray(image), 1 - alpha, colors, alpha, 0)
+    return cv2.copyTo(blended, (mask != NO_CELL).view(np.uint8), np.array(image))
+
+
+def overlay_cells(report, p_idx, layout):
+    """JSON-ready cell boxes and statuses of one page, for the web viewer."""
+    cells = []
+    pairs, cols = layout.answer_boxes.shape[:2]
+    for pair_i, row in enumerate(layout.answer_boxes.tolist()):
+        for c, box in enumerate(row):
+            question_num = (p_idx * pairs * cols) + (pair_i * cols) + c + 1
+            if question_num > len(report):
+                continue
+            entry = report[question_num - 1]
+            cells.append({"question": question_num, "box": box, "status": cell_status(entry),
+                          "detected": entry["detected"], "expected": entry["expected"],
+                          "conf": entry["conf"], "tier": entry["tier"]})
+    return cells
+
+
+def write_overlays(report, pages, layouts, output_dir, image_format=DEFAULT_OVERLAY_FORMAT,
+                   max_width=DEFAULT_OVERLAY_WIDTH, quality=85):
+    """
+    Write the colored result pages, or their cell boxes and statuses as JSON.
+
+    Images go to debug_cells/colored_page_N.<ext>. The "json" format renders no
+    image and writes debug_cells/colored_pages.json instead: for every page its
+    size and, per answer cell, the box (left, top, right, bottom in straightened
+    page pixels), status, answer and tier, plus the status colors.
+
+    Args:
+        report: score_results report (160 entries)
+        pages: PageContexts of the pages, in page order
+        layouts: Their GridLayouts
+        image_format: "png", "jpeg", "webp" or "json"
+        max_width: Downscale the images to this width (None or 0 = full size)
+
+    Returns:
+        Paths written
+    """
+    if image_format not in OVERLAY_FORMATS:
+        raise ValueError(f"Unknown overlay format '{image_format}', expected one of {list(OVERLAY_FORMATS)}")
+    folder = os.path.join(output_dir, "debug_cells")
+    os.makedirs(folder, exist_ok=True)
+    if image_format == "json":
+        data = {
+            "statuses": {s: "#%02x%02x%02x" % STATUS_COLORS[s] for s in STATUSES},
+            "pages": [{"page": p_idx + 1, "width": page.size[0], "height": page.size[1],
+                       "cells": overlay_cells(report, p_idx, layout)}
+                      for p_idx, (page, layout) in enumerate(zip(pages, layouts))],
+        }
+        path = os.path.join(folder, "colored_pages.json")
+        with open(path, "w") as f:
+            json.dump(data, f, ensure_ascii=False)
+        print(f"Cell statuses saved to: {path}")
+        return [path]
+
+    paths = []
+    for p_idx, (page, layout) in enumerate(zip(pages, layouts)):
+        pairs, cols = layout.answer_boxes.shape[:2]
+        with instrumentation.span("render_overlay", cat="image", page=p_idx + 1):
+            vis = render_overlay(page.image, layout, status_codes(report, p_idx, pairs, cols), max_width)
+        path = os.path.join(folder, f"colored_page_{p_idx+1}{IMAGE_FORMATS[image_format]}")
+        with instrumentation.span("save_overlay", cat="io", page=p_idx + 1):
+            if image_format == "png":
+                Image.fromarray(vis).save(path, compress_level=1)
+            else:
+                Image.fromarray(vis).save(path, quality=quality)
+        print(f"Colored visualization saved to: {path}")
+        paths.append(path)
+    return paths
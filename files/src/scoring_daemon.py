@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import uuid
+import queue
+import argparse
+import threading
+import instrumentation
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from backends import BACKENDS
+from batch_scanner import find_page_images
+from config import score_results
+from debug_writer import DEBUG_LEVELS, writer_for
+from cell_encoding import CELL_MODES, CellEncoder, parse_cell_target
+from digit_classifier import DEFAULT_DIGIT_MODEL, DigitClassifier
+from image_utils import load_page
+from ocr_cache import DEFAULT_CACHE_DIR, OCRCache
+from artifact_store import DEFAULT_ARTIFACT_DIR, DEFAULT_ARTIFACT_MAX_BYTES, ArtifactStore
+from results_store import DEFAULT_RESULTS_DB, ResultsStore, protocol_names
+from ensemble import close_backends
+from prefilter import BLANK_INK_THRESHOLD
+from result_overlay import DEFAULT_OVERLAY_FORMAT, DEFAULT_OVERLAY_WIDTH, OVERLAY_FORMATS
+from main_scanner import (ESCALATE_SCORE, create_colored_visualization, load_backends,
+                          prepare_pages, prepare_row_images, scan_answer_items, write_disagreements)
+
+DEFAULT_PORT = 8765
+
+# Finished jobs kept around for GET /jobs/<id>
+MAX_FINISHED_JOBS = 1000
+
+
+class ScoringDaemon:
+    """
+    Keeps the recognizer backends resident and scores protocols from a job queue.
+
+    Jobs are either two page paths or a subject folder holding two page images.
+    `concurrency` worker threads pull jobs from the queue; page preprocessing runs
+    concurrently, while model calls are serialized through a single lock because
+    the backends are not safe to call from several threads at once.
+
+    Args:
+        backends: Loaded recognizer backends (see main_scanner.load_backends)
+        concurrency: Number of worker threads
+        score_all: Scan and score all 160 items, ignoring the ceiling
+        row_mode: Read each answer row in one model call (per-cell fallback)
+        store: ArtifactStore for decoded, straightened pages (a resubmitted scan skips both)
+        results_store: ResultsStore every finished job's report is added to
+        scan_options: Keyword arguments forwarded to scan_answer_items
+    """
+
+    def __init__(self, backends, concurrency=1, score_all=False, row_mode=False, store=None, results_store=None,
+                 **scan_options):
+        self.backends = backends
+        self.store = store
+        self.results_store = results_store
+        self.concurrency = max(1, int(concurrency))
+        self.score_all = score_all
+        self.row_mode = row_mode
+        self.scan_options = dict(scan_options, stop_at_ceiling=not score_all)
+        self.jobs = {}
+        self.finished = []
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.inference_lock = threading.Lock()
+        self.running = 0
+        self.started = time.time()
+        self.workers = []
+        for i in range(self.concurrency):
+            t = threading.Thread(target=self._worker, name=f"scoring-worker-{i}", daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def submit(self, request):
+        """
+        Queue a scoring job.
+
+        Args:
+            request: {"page1": path, "page2": path} or {"subject_dir": path}, plus optional
+                     "output_dir", "visualize" (default False), "overlay_format" ("jpeg",
+                     "png", "webp" or "json", default "jpeg"), "overlay_width" (pixels, default
+                     DEFAULT_OVERLAY_WIDTH, null = full size) and "debug" (a debug level name or
+                     bool, default "off")
+
+        Returns:
+            The job dict (id, status, ...)
+        """
+        if not isinstance(request, dict):
+            raise ValueError("Job request must be a JSON object")
+        for field in ("subject_dir", "page1", "page2", "output_dir"):
+            if request.get(field) is not None and not isinstance(request[field], str):
+                raise ValueError(f"'{field}' must be a path string")
+        if "subject_dir" in request:
+            if not os.path.isdir(request["subject_dir"]):
+                raise ValueError(f"No such subject folder: {request['subject_dir']}")
+            pages = find_page_images(request["subject_dir"])
+            if len(pages) != 2:
+                raise ValueError(f"Expected 2 page images in {request['subject_dir']}, found {len(pages)}")
+            page1, page2 = pages
+            output_dir = request.get("output_dir") or request["subject_dir"]
+        elif "page1" in request and "page2" in request:
+            page1, page2 = request["page1"], request["page2"]
+            output_dir = request.get("output_dir") or os.path.dirname(page1)
+        else:
+            raise ValueError("Job needs 'page1' and 'page2' or 'subject_dir'")
+        for p in (page1, page2):
+            if not os.path.isfile(p):
+                raise ValueError(f"No such page image: {p}")
+        debug = request.get("debug", False)
+        if not isinstance(debug, (bool, str)) or (isinstance(debug, str) and debug not in DEBUG_LEVELS):
+            raise ValueError(f"Unknown debug level '{debug}', expected one of {sorted(DEBUG_LEVELS)}")
+        overlay_format = request.get("overlay_format", DEFAULT_OVERLAY_FORMAT)
+        if not isinstance(overlay_format, str) or overlay_format not in OVERLAY_FORMATS:
+            raise ValueError(f"Unknown overlay format '{overlay_format}', expected one of {list(OVERLAY_FORMATS)}")
+        overlay_width = request.get("overlay_width", DEFAULT_OVERLAY_WIDTH)
+        if overlay_width is not None and (isinstance(overlay_width, bool) or not isinstance(overlay_width, int)
+                                          or overlay_width <= 0):
+            raise ValueError(f"'overlay_width' must be a positive number of pixels, got {overlay_width!r}")
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "page1": page1,
+            "page2": page2,
+            "output_dir": output_dir,
+            "visualize": bool(request.get("visualize", False)),
+            "overlay_format": overlay_format,
+            "overlay_width": overlay_width,
+            "debug": debug,
+            "submitted": time.time(),
+            "done": threading.Event(),
+        }
+        with self.lock:
+            self.jobs[job["id"]] = job
+        self.queue.put(job)
+        return job
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                self.running += 1
+                job.update(status="running", started=time.time())
+            try:
+                with instrumentation.span("job", job=job["id"]):
+                    result = self._run_job(job)
+                self._update(job, status="done", result=result)
+            except Exception as e:
+                self._update(job, status="error", error=str(e))
+            finally:
+                self._update(job, finished=time.time())
+                instrumentation.record("job", job=job["id"], status=job["status"],
+                                       elapsed_sec=round(job["finished"] - job["started"], 3),
+                                       queue_sec=round(job["started"] - job["submitted"], 3))
+                with self.lock:
+                    self.running -= 1
+                    self.finished.append(job["id"])
+                    while len(self.finished) > MAX_FINISHED_JOBS:
+                        self.jobs.pop(self.finished.pop(0), None)
+                job["done"].set()
+                self.queue.task_done()
+
+    def _run_job(self, job):
+        with writer_for(job["debug"]) as writer:
+            pages = [load_page(p, write_intermediates=writer.wants("intermediates"), writer=writer,
+                               store=self.store)
+                     for p in (job["page1"], job["page2"])]
+            answer_items = prepare_pages(job["page1"], job["page2"], job["output_dir"], debug=writer,
+                                         pages=pages)
+            row_images = prepare_row_images(job["page1"], job["page2"], pages=pages) if self.row_mode else None
+            with instrumentation.span("wait_inference_lock"):
+                self.inference_lock.acquire()
+            try:
+                scanned = scan_answer_items(answer_items, self.backends, row_images=row_images, **self.scan_options)
+            finally:
+                self.inference_lock.release()
+            write_disagreements(answer_items, scanned, job["output_dir"], writer)
+            raw_score, report = score_results(scanned, apply_ceiling=not self.score_all)
+            if self.results_store is not None:
+                user, subject = protocol_names(job["page1"])
+                self.results_store.add_protocol(report, raw_score, os.path.dirname(os.path.abspath(job["page1"])),
+                                                user=user, subject=subject, scanned=scanned)
+            overlays = []
+            if job["visualize"]:
+                overlays = create_colored_visualization(report, job["page1"], job["page2"], job["output_dir"],
+                                                        pages=pages, image_format=job["overlay_format"],
+                                                        max_width=job["overlay_width"])
+        return {"raw_score": raw_score, "report": report, "overlays": overlays}
+
+    def _update(self, job, **fields):
+        # Handlers read jobs under the same lock (to_json), never while keys are being added
+        with self.lock:
+            job.update(fields)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def to_json(self, job):
+        """job_to_json of a consistent copy of the job, taken under the lock the worker updates it with."""
+        with self.lock:
+            job = dict(job)
+        return job_to_json(job)
+
+    def status(self):
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "running": self.running,
+                "concurrency": self.concurrency,
+                "jobs_tracked": len(self.jobs),
+                "models": [b.model_id for b in self.backends],
+                "uptime_sec": round(time.time() - self.started, 1),
+                "artifacts": self.store.stats() if self.store is not None else None,
+                "results_db": self.results_store.path if self.results_store is not None else None,
+            }
+
+
+def job_to_json(job):
+    """Public view of a job (drops the internal Event)."""
+    out = {k: v for k, v in job.items() if k != "done"}
+    if "started" in job and "finished" in job:
+        out["elapsed_sec"] = round(job["finished"] - job["started"], 3)
+    return out
+
+
+def make_handler(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/status":
+                return self._send(200, daemon.status())
+            if self.path.startswith("/jobs/"):
+                job = daemon.get(self.path[len("/jobs/"):])
+                if job is None:
+                    return self._send(404, {"error": "unknown job"})
+                return self._send(200, daemon.to_json(job))
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                return self._send(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                job = daemon.submit(request)
+            except (ValueError, json.JSONDecodeError) as e:
+                return self._send(400, {"error": str(e)})
+            # "wait": true blocks until the report is ready, otherwise poll GET /jobs/<id>
+            if request.get("wait", False):
+                job["done"].wait()
+                return self._send(200, daemon.to_json(job))
+            self._send(202, daemon.to_json(job))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(daemon, host="127.0.0.1", port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), make_handler(daemon))
+    print(f"Scoring daemon listening on http://{host}:{server.server_address[1]} "
+          f"({daemon.concurrency} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WJ-IV Math scoring daemon with resident models")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind (localhost only by default)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="HTTP port")
+    parser.add_argument("--concurrency", type=int, default=1, help="Jobs processed at the same time")
+    parser.add_argument("--parallel", type=int, default=1, help="Ensemble members run at the same time, each on its own worker (1 = one after another)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mlx", help="Recognizer backend (mlx, cpu or stub)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Answer cells per model forward pass")
+    parser.add_argument("--blank-threshold", type=float, default=BLANK_INK_THRESHOLD, help="Ink ratio below which a cell is treated as EMPTY")
+    parser.add_argument("--score-all", action="store_true", help="Scan and score all 160 items, ignoring the ceiling (validation)")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every answer cell to the models, even blank ones")
+    parser.add_argument("--row-mode", action="store_true", help="Read each answer row in one model call (per-cell fallback)")
+    parser.add_argument("--cascade", action="store_true", help="Run the large model only on cells the small model is unsure about")
+    parser.add_argument("--escalate-score", type=float, default=ESCALATE_SCORE, help="Cascade: escalate answers below this mean token probability")
+    parser.add_argument("--digit-tier", action="store_true", help="Read confident cells with the CPU digit classifier, VLMs only for the rest")
+    parser.add_argument("--digit-model", type=str, default=DEFAULT_DIGIT_MODEL, help="Digit classifier model (see digit_classifier.py)")
+    parser.add_argument("--digit-conf", type=float, default=None, help="Calibrated confidence needed to accept a digit-tier answer (default: the threshold stored in the model)")
+    parser.add_argument("--cell-target", type=parse_cell_target, default=None, help="Normalize cells to HEIGHTxWIDTH pixels before the VLMs (e.g. 56x84 = 6 visual tokens)")
+    parser.add_argument("--cell-mode", choices=CELL_MODES, default="binary", help="Rendering of normalized cells")
+    parser.add_argument("--trace", type=str, default=None, help="Stream spans to a Chrome-trace/Perfetto JSON here (completed on shutdown)")
+    parser.add_argument("--metrics", type=str, default=None, help="Append JSONL metrics (jobs, model calls, tokens/sec, cache hits) here")
+    parser.add_argument("--cache-dir", type=str, default=DEFAULT_CACHE_DIR, help="Folder of the persistent OCR result cache")
+    parser.add_argument("--no-cache", action="store_true", help="Always run the models, bypassing the OCR cache")
+    parser.add_argument("--artifact-dir", type=str, default=DEFAULT_ARTIFACT_DIR, help="Folder of the decoded/straightened page and grid artifacts")
+    parser.add_argument("--no-artifacts", action="store_true", help="Always decode and straighten the pages, bypassing the artifact store")
+    parser.add_argument("--artifact-max-gb", type=float, default=DEFAULT_ARTIFACT_MAX_BYTES / 1024 ** 3, help="Size budget of the artifact store; least recently used artifacts are deleted beyond it")
+    parser.add_argument("--results-db", type=str, default=None, help=f"Add every job's report to this SQLite results store, e.g. {DEFAULT_RESULTS_DB} (default: not recorded; see results_store.py)")
+    args = parser.parse_args()
+    if args.digit_tier and not os.path.isfile(args.digit_model):
+        parser.exit(1, f"No digit model at {args.digit_model}; train one with digit_classifier.py\n")
+
+    if args.trace or args.metrics:
+        instrumentation.enable(metrics_path=args.metrics, trace_path=args.trace)
+    cache = None if args.no_cache else OCRCache(args.cache_dir)
+    backends = load_backends(args.backend, batch_size=args.batch_size, cache=cache, parallel=args.parallel)
+    results_store = ResultsStore(args.results_db) if args.results_db else None
+    daemon = ScoringDaemon(backends, concurrency=args.concurrency,
+                           blank_threshold=None if args.no_prefilter else args.blank_threshold,
+                           cascade=args.cascade, escalate_score=args.escalate_score, cache=cache,
+                           score_all=args.score_all, row_mode=args.row_mode,
+                           store=None if args.no_artifacts else ArtifactStore(args.artifact_dir, max_bytes=int(args.artifact_max_gb * 1024 ** 3)),
+                           results_store=results_store,
+                           digits=DigitClassifier(args.digit_model, args.digit_conf) if args.digit_tier else None,
+                           encoder=CellEncoder(*args.cell_target, mode=args.cell_mode) if args.cell_target else None)
+    try:
+        serve(daemon, host=args.host, port=args.port)
+    finally:
+        close_backends(backends)
+        if cache is not None:
+            cache.close()
+        if results_store is not None:
+            results_store.close()
+    instrumentation.finish()
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import argparse
+from backends import BACKENDS, DEFAULT_MODEL_IDS, create_backend
+from batch_scanner import discover_subjects
+from cell_encoding import CELL_MODES, CellEncoder, parse_cell_target, visual_tokens
+from config import WJ_MATH_ANSWER_KEY, load_truth, normalize_answer, score_results
+from image_utils import load_page
+from prefilter import BLANK_INK_THRESHOLD
+from main_scanner import load_backends, prepare_pages, scan_answer_items
+
+# "raw" sends the crops as cut (context buffer, color, native size)
+DEFAULT_TARGETS = ["raw", "28x56", "56x56", "56x84", "84x112", "112x168"]
+
+
+class TokenMeter:
+    """Measures visual tokens, prompt tokens and time spent in recognize() of a wrapped backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.reset()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def reset(self):
+        self.images = 0
+        self.visual_tokens = 0
+        self.prompt_tokens = 0
+        self.seconds = 0.0
+
+    def recognize(self, images, **kwargs):
+        for img in images:
+            h, w = img.shape[:2] if hasattr(img, "shape") else img.size[::-1]
+            self.visual_tokens += visual_tokens(h, w, self.backend.max_pixels)
+        start = time.perf_counter()
+        results = self.backend.recognize(images, **kwargs)
+        self.seconds += time.perf_counter() - start
+        self.images += len(images)
+        self.prompt_tokens += sum(r.get("prompt_tokens", 0) for r in results)
+        return results
+
+
+def sweep_subject(subject, backends, targets, mode="binary", blank_threshold=BLANK_INK_THRESHOLD, target_dpi=None):
+    """
+    Scan one subject once per cell target with the same loaded backends (all 160 items).
+
+    Accuracy is measured against the subject's truth.json when it has one, otherwise
+    against the answer key (right for protocols filled in with the key answers).
+
+    Returns:
+        Dict with one {"tokens_per_cell", "ms_per_cell", "accuracy", ...} entry per target
+    """
+    p1, p2 = subject["pages"]
+    pages = [load_page(p, target_dpi=target_dpi) for p in (p1, p2)]
+    answer_items = prepare_pages(p1, p2, subject["dir"], debug=False, pages=pages)
+    truth = load_truth(subject["dir"]) or {i + 1: str(a) for i, a in enumerate(WJ_MATH_ANSWER_KEY)}
+
+    out = {"user": subject["user"], "subject": subject["subject"], "targets": {}}
+    for target in targets:
+        encoder = None if target == "raw" else CellEncoder(*parse_cell_target(target), mode=mode)
+        for b in backends:
+            b.reset()
+        scanned = scan_answer_items(answer_items, backends, blank_threshold=blank_threshold, encoder=encoder)
+        raw_score, report = score_results(scanned)
+        hits = sum(1 for e in report if normalize_answer(e["detected"]) == normalize_answer(truth.get(e["question"], "")))
+        images = sum(b.images for b in backends)
+        out["targets"][target] = {
+            "tokens_per_cell": round(sum(b.visual_tokens for b in backends) / images, 1) if images else 0.0,
+            "prompt_tokens_per_cell": round(sum(b.prompt_tokens for b in backends) / images, 1) if images else 0.0,
+            "ms_per_cell": round(sum(b.seconds for b in backends) / images * 1000, 2) if images else 0.0,
+            "model_images": images,
+            "raw_score": raw_score,
+            "accuracy": round(hits / len(report), 4),
+        }
+    return out
+
+
+def print_sweep(results):
+    print("\n" + "=" * 78)
+    print(f"{'subject':<28}{'target':<10}{'tokens':>8}{'prompt':>8}{'ms/cell':>10}{'raw':>6}{'accuracy':>10}")
+    print("=" * 78)
+    for r in results:
+        name = f"{r['user']}/{r['subject']}"
+        for target, e in r["targets"].items():
+            print(f"{name:<28}{target:<10}{e['tokens_per_cell']:>8}{e['prompt_tokens_per_cell']:>8}"
+                  f"{e['ms_per_cell']:>10.2f}{e['raw_score']:>6}{e['accuracy']:>10.1%}")
+            name = ""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep cell-normalization targets: accuracy vs. prefill cost")
+    parser.add_argument("--root", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data"),
+                        help="Folder containing user-*/sub-*/ subject folders (default: bundled sample data)")
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS, help="HEIGHTxWIDTH cell targets, or raw")
+    parser.add_argument("--cell-mode", choices=CELL_MODES, default="binary", help="Rendering of normalized cells")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mlx", help="Recognizer backend (mlx, cpu or stub)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per model forward pass")
+    parser.add_argument("--blank-threshold", type=float, default=BLANK_INK_THRESHOLD, help="Ink ratio below which a cell is treated as EMPTY")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every answer cell to the models, even blank ones")
+    parser.add_argument("--target-dpi", type=int, default=None, help="Straighten pages straight to this resolution (e.g. 200)")
+    parser.add_argument("--stub-token-latency", type=float, default=0.0005, help="Stub backend: simulated prefill seconds per visual token")
+    parser.add_argument("--output", type=str, default=None, help="Also write the sweep as JSON to this path")
+    args = parser.parse_args()
+    for target in args.targets:
+        if target != "raw":
+            parse_cell_target(target)
+
+    if args.backend == "stub":
+        # The stub replays the answer key, so only the cost columns are meaningful
+        answers = {i + 1: a for i, a in enumerate(WJ_MATH_ANSWER_KEY)}
+        backends = [create_backend("stub", m, answers=answers, batch_size=args.batch_size,
+                                   token_latency=args.stub_token_latency)
+                    for m in DEFAULT_MODEL_IDS]
+    else:
+        backends = load_backends(args.backend, batch_size=args.batch_size)
+    backends = [TokenMeter(b) for b in backends]
+
+    results = [sweep_subject(s, backends, args.targets, mode=args.cell_mode,
+                             blank_threshold=None if args.no_prefilter else args.blank_threshold,
+                             target_dpi=args.target_dpi)
+               for s in discover_subjects(args.root)]
+    print_sweep(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Sweep saved to: {args.output}")
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# The pipeline is a flat set of modules next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import WJ_MATH_ANSWER_KEY  # noqa: E402
+
+
+def make_cell(seed, size=(48, 64)):
+    """A small RGB cell with a unique pixel pattern (distinct cache keys, never judged blank)."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=size + (3,), dtype=np.uint8)
+
+
+@pytest.fixture
+def answer_items():
+    """All 160 answer items (question_num, page index, cell index, cell image), in question order."""
+    return [(q, (q - 1) // 80, (q - 1) % 80, make_cell(q)) for q in range(1, len(WJ_MATH_ANSWER_KEY) + 1)]
+
+
+def make_photo(size=(3900, 3000), page=(2100, 2800), angle=3.0):
+    """
+    A phone photo of a page: light paper on a slightly darker table, with the printed
+    border of a WJ page drawn `angle` degrees off. Returns (RGB array, 4x2 border corners).
+    """
+    height, width = size
+    img = np.full((height, width, 3), 225, dtype=np.uint8)
+    center = (width / 2, height / 2)
+    paper = cv2.boxPoints((center, (page[0] + 200, page[1] + 200), angle))
+    cv2.fillPoly(img, [paper.astype(np.int32)], (240, 240, 240))
+    border = cv2.boxPoints((center, page, angle))
+    cv2.polylines(img, [border.astype(np.int32)], True, (20, 20, 20), 12)
+    return img, border
@@ -0,0 +1,76 @@
+import os
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_utils
+from artifact_store import ArtifactStore
+from conftest import make_photo
+from image_utils import iter_answer_cells, load_page
+
+
+@pytest.fixture
+def scan(tmp_path):
+    path = str(tmp_path / "page.png")
+    photo, _ = make_photo(size=(1300, 1000), page=(700, 930), angle=2.0)
+    Image.fromarray(photo).save(path)
+    return path
+
+
+def test_second_load_is_served_from_the_store(tmp_path, scan, monkeypatch):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    first = load_page(scan, store=store)
+    first_cells = [cell for _, _, cell in iter_answer_cells(first)]
+
+    def no_decode(path):
+        raise AssertionError("decoded again")
+
+    monkeypatch.setattr(image_utils, "decode_image", no_decode)
+    monkeypatch.setattr(image_utils, "straighten_array", no_decode)
+    fresh = ArtifactStore(store.root)  # a later run: nothing memoized in the process
+    second = load_page(scan, store=fresh)
+    assert second.straightened and np.array_equal(second.image, first.image)
+    assert second.straighten_info == first.straighten_info
+    second_cells = [cell for _, _, cell in iter_answer_cells(second)]
+    assert all(np.array_equal(a, b) for a, b in zip(first_cells, second_cells))
+    assert fresh.stats() == {"cells": {"hits": 1, "misses": 0}, "straighten": {"hits": 1, "misses": 0}}
+
+
+def test_new_target_dpi_reuses_the_decoded_scan(tmp_path, scan, monkeypatch):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    load_page(scan, store=store)
+    monkeypatch.setattr(image_utils, "decode_image", lambda path: pytest.fail("decoded again"))
+    page = load_page(scan, target_dpi=100, store=store)
+    assert page.image.shape[1] == round(100 * 8.5)
+    # The first load missed, the second found the decoded scan
+    assert store.stats()["normalize"] == {"hits": 1, "misses": 1}
+
+
+def test_least_recently_used_artifacts_are_evicted(tmp_path):
+    image = np.zeros((100, 100, 3), np.uint8)  # 30 KB as .npy
+    store = ArtifactStore(str(tmp_path), max_bytes=3 * image.nbytes + 1000)
+    keys = [store.key("normalize", str(i)) for i in range(4)]
+    for i, key in enumerate(keys[:3]):
+        store.put_image("normalize", key, image)
+        # mtime resolution differs per filesystem; make the order explicit
+        path = store._path("normalize", key, ".npy")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() - (10 - i) * 10 ** 9))
+    assert store.get_image("normalize", keys[0]) is not None  # now the most recent
+    store.put_image("normalize", keys[3], image)
+    assert store.size() <= store.max_bytes
+    assert store.get_image("normalize", keys[1]) is None
+    assert all(store.get_image("normalize", k) is not None for k in (keys[0], keys[2], keys[3]))
+
+
+def test_an_evicted_image_is_recomputed(tmp_path, scan):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+    first = load_page(scan, store=store)
+    for dirpath, _, names in os.walk(os.path.join(store.root, "straighten")):
+        for name in names:
+            if name.endswith(".npy"):
+                os.remove(os.path.join(dirpath, name))
+    again = load_page(scan, store=store)
+    assert np.array_equal(again.image, first.image)
+    assert store.stats()["straighten"] == {"hits": 0, "misses": 2}
@@ -0,0 +1,83 @@
+import pytest
+
+from backends import OCR_PROMPT, ROW_PROMPT, RecognizerBackend, StubBackend, create_backend
+from conftest import make_cell
+
+
+class RecordingStub(StubBackend):
+    """Stub that records the template object every batch was given."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.seen_templates = []
+
+    def _recognize_batch(self, images, template, keys, max_tokens):
+        self.seen_templates.append(template)
+        return super()._recognize_batch(images, template, keys, max_tokens)
+
+
+def test_prompt_is_templated_once_per_model_and_prompt():
+    rec = RecordingStub("small", batch_size=2)
+    cells = [make_cell(i) for i in range(5)]
+    rec.recognize(cells, keys=list(range(5)))
+    rec.recognize(cells, keys=list(range(5)))
+    assert rec.calls == 6  # 3 batches per call
+    assert rec.templates_built == 1
+    assert all(t is rec.seen_templates[0] for t in rec.seen_templates)
+    assert rec.seen_templates[0].prompt == OCR_PROMPT
+    assert OCR_PROMPT in rec.seen_templates[0].text
+
+    rec.recognize([make_cell(9)], prompt=ROW_PROMPT, keys=[(1, 2)])
+    assert rec.templates_built == 2
+    assert rec.seen_templates[-1].prompt == ROW_PROMPT
+
+
+def test_templates_are_rebuilt_after_unload():
+    rec = RecordingStub("small")
+    rec.recognize([make_cell(1)], keys=[1])
+    rec.unload()
+    rec.recognize([make_cell(1)], keys=[1])
+    assert rec.templates_built == 2
+    assert rec.seen_templates[0] is not rec.seen_templates[1]
+
+
+def test_recognize_loads_lazily_and_batches():
+    rec = StubBackend("small", answers={1: " 5 ", 2: "empty"}, batch_size=4)
+    assert not rec.loaded
+    out = rec.recognize([make_cell(i) for i in range(1, 10)], keys=list(range(1, 10)))
+    assert rec.loaded and rec.loads == 1
+    assert rec.calls == 3 and rec.images_seen == 9
+    assert [r["ans"] for r in out[:3]] == ["5", "EMPTY", "EMPTY"]
+
+
+def test_base_backend_template_is_the_prompt():
+    base = RecognizerBackend("base")
+    assert base.prompt_template("p").text == "p"
+    assert base.prompt_template("p") is base.prompt_template("p")
+
+
+@pytest.mark.parametrize("name", ["mlx", "cpu", "stub"])
+def test_no_backend_claims_prefix_reuse(name):
+    # The prompt before the image is prefilled with every cell (see supports_prefix_reuse)
+    rec = create_backend(name, "small")
+    assert rec.supports_prefix_reuse is False
+
+
+def test_capabilities_pass_through_the_cache(tmp_path):
+    from ocr_cache import CachedBackend, OCRCache
+
+    with OCRCache(str(tmp_path)) as cache:
+        cached = CachedBackend(StubBackend("small"), cache)
+        assert cached.supports_prefix_reuse is False and cached.thread_safe
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_backend("tpu", "model")
+
+
+
+def test_mlx_unload_without_a_loaded_model_needs_no_mlx():
+    rec = create_backend("mlx", "mlx-community/Qwen2-VL-2B-Instruct-4bit")
+    rec.unload()
+    assert not rec.loaded
@@ -0,0 +1,33 @@
+from benchmark import STAGES, stage_times
+
+
+def span(name, ts, dur, tid=1):
+    return {"name": name, "ph": "X", "ts": ts, "dur": dur, "pid": 1, "tid": tid, "args": {}}
+
+
+def test_nested_stage_spans_count_once():
+    events = [
+        span("prepare_page", 0, 10_000),
+        span("crop_cells", 0, 9_000),
+        span("debug_save", 1_000, 2_000),
+        span("visualize_content_box", 4_000, 3_000),
+        span("debug_save", 6_000, 500),
+        # load_page is not a stage: the decode inside the visualization is still "decode"
+        span("colored_visualization", 20_000, 8_000),
+        span("load_page", 20_000, 5_000),
+        span("decode", 20_500, 4_000),
+        {"name": "scan", "ph": "C", "ts": 30_000, "pid": 1, "args": {"cells": 160}},
+    ]
+    times = stage_times(events)
+    assert set(times) == set(STAGES)
+    assert times["crop"] == 5.0
+    assert times["debug_writes"] == 5.0
+    assert times["decode"] == 4.0
+    assert times["visualization"] == 4.0
+    assert sum(times.values()) == 18.0
+
+
+def test_stages_on_other_threads_are_summed():
+    events = [span("recognize", 0, 6_000, tid=1), span("decode", 1_000, 4_000, tid=2)]
+    times = stage_times(events)
+    assert times["inference"] == 6.0 and times["decode"] == 4.0
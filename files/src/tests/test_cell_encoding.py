@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from cell_encoding import CELL_MODES, CellEncoder, encode_items, parse_cell_target, visual_tokens
+
+
+def answer_cell(digit=True, size=(284, 410)):
+    """A cropped answer cell: paper, a grid line in the context buffer, a line below the row and a digit."""
+    h, w = size
+    cell = np.full((h, w), 185, np.uint8)
+    cell[:, 10:15] = 40
+    cell[h - 20:h - 16, :] = 40
+    if digit:
+        cv2.putText(cell, "7", (170, 200), cv2.FONT_HERSHEY_SIMPLEX, 3.5, 30, 8)
+    return cv2.cvtColor(cell, cv2.COLOR_GRAY2RGB)
+
+
+def test_default_target_is_six_visual_tokens():
+    assert visual_tokens(56, 84) == 6 == CellEncoder().tokens
+    # The raw crop would cost 25 times as much
+    assert visual_tokens(284, 410) == 150
+
+
+@pytest.mark.parametrize("mode", CELL_MODES)
+def test_every_mode_fills_the_target(mode):
+    out = CellEncoder(mode=mode).encode(answer_cell())
+    assert out.shape == (56, 84, 3) and out.dtype == np.uint8
+
+
+def test_binary_keeps_only_the_handwriting():
+    out = CellEncoder().encode(answer_cell())
+    # Black on white, whatever the paper shade (the edges of the resized strokes are gray)
+    assert (out[..., 0] == out[..., 2]).all() and out.min() == 0 and np.median(out) == 255
+    ink_rows, ink_cols = np.nonzero(out[..., 0] < 128)
+    # The digit is scaled up to the canvas height, centered, with the grid lines gone
+    assert ink_rows.max() - ink_rows.min() > 0.6 * 56
+    assert abs((ink_cols.min() + ink_cols.max()) / 2 - 42) < 4
+    assert (out[:, :5] == 255).all() and (out[:, -5:] == 255).all()
+
+
+def test_blank_cell_encodes_to_white():
+    assert (CellEncoder().encode(answer_cell(digit=False)) == 255).all()
+
+
+def test_pil_input_and_items():
+    encoder = CellEncoder(28, 28, mode="gray")
+    cell = answer_cell()
+    assert np.array_equal(encoder.encode(Image.fromarray(cell)), encoder.encode(cell))
+    items = encode_items([(5, 0, 14, cell)], encoder)
+    assert items[0][:3] == (5, 0, 14) and items[0][3].shape == (28, 28, 3)
+
+
+def test_target_parsing():
+    assert parse_cell_target("56X84") == (56, 84)
+    for text in ("56", "0x84", "axb"):
+        with pytest.raises(ValueError):
+            parse_cell_target(text)
+    with pytest.raises(ValueError):
+        CellEncoder(mode="sepia")
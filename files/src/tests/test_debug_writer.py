@@ -0,0 +1,52 @@
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from debug_writer import DebugWriter, writer_for
+
+
+def test_save_blocks_once_the_queue_is_full(tmp_path, monkeypatch):
+    writer = DebugWriter("full", workers=1, max_queue=2)
+    release = threading.Event()
+    write = writer._write
+
+    def slow_write(image, path, image_format):
+        release.wait(5)
+        write(image, path, image_format)
+
+    monkeypatch.setattr(writer, "_write", slow_write)
+    image = np.zeros((8, 8, 3), dtype=np.uint8)
+    queued = []
+
+    def producer():
+        for i in range(4):
+            queued.append(writer.save(image, str(tmp_path / f"cell_{i}.png")))
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    thread.join(0.3)
+    # Two images wait for the stalled encoder; the third save() waits for a slot
+    assert thread.is_alive() and len(queued) == 2
+    release.set()
+    thread.join(5)
+    writer.close()
+    assert len(queued) == 4 and writer.written == 4
+    assert all(Image.open(p).size == (8, 8) for p in queued)
+
+
+def test_format_replaces_the_extension(tmp_path):
+    with writer_for(DebugWriter("sampled", image_format="jpeg")) as writer:
+        path = writer.save(np.zeros((8, 8, 3), dtype=np.uint8), str(tmp_path / "a.png"))
+        lossless = writer.save(np.zeros((8, 8, 3), dtype=np.uint8), str(tmp_path / "b.png"), lossless=True)
+        writer.close()
+    assert path.endswith(".jpg") and lossless.endswith(".png")
+    assert Image.open(path).format == "JPEG"
+
+
+def test_levels():
+    assert not DebugWriter(False).enabled
+    assert DebugWriter(True).wants("samples") and not DebugWriter(True).wants("all_cells")
+    with pytest.raises(ValueError):
+        DebugWriter("verbose")
@@ -0,0 +1,106 @@
+import json
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from config import WJ_MATH_ANSWER_KEY
+from digit_classifier import DigitClassifier, accept_threshold, load_labeled_crops, train_digit_model
+from main_scanner import read_digits
+
+# Writers: font and stroke thickness
+WRITERS = [(cv2.FONT_HERSHEY_SIMPLEX, 8), (cv2.FONT_HERSHEY_DUPLEX, 7), (cv2.FONT_HERSHEY_COMPLEX, 6),
+           (cv2.FONT_HERSHEY_SIMPLEX, 11)]
+
+
+def written_cell(text, writer, seed, spacing=80):
+    """An answer-cell crop with `text` handwritten by one of WRITERS."""
+    rng = np.random.default_rng(seed)
+    cell = np.clip(rng.normal(185, 4, size=(284, 410)), 0, 255).astype(np.uint8)
+    cell = cv2.cvtColor(cell, cv2.COLOR_GRAY2RGB)
+    font, thickness = WRITERS[writer]
+    x, y = 150 + int(rng.integers(-15, 15)), 200 + int(rng.integers(-10, 10))
+    for ch in text:
+        cv2.putText(cell, ch, (x, y), font, 3.0 + 0.1 * writer, (30, 30, 30), thickness)
+        x += spacing
+    return cell
+
+
+def subject_crops(writer, count=40):
+    rng = np.random.default_rng(writer)
+    crops = []
+    for i in range(count):
+        text = str(int(rng.integers(0, 100)))
+        crops.append((f"Q{i + 1}.png", written_cell(text, writer, 100 * writer + i), text, f"sub-{writer}"))
+    return crops
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("digits") / "digit_model.npz")
+    crops = [c for w in range(3) for c in subject_crops(w)]
+    return path, train_digit_model(crops, path)
+
+
+def test_training_reports_every_held_out_subject(model):
+    _, stats = model
+    assert set(stats["subjects"]) == {"sub-0", "sub-1", "sub-2"}
+    assert np.isfinite(stats["accept_conf"]) and stats["accepted_accuracy"] >= 0.99
+
+
+def test_unseen_writer_is_accepted(model):
+    clf = DigitClassifier(model[0])
+    for text in ("7", "42", "5"):
+        res = clf.read(written_cell(text, 3, 999))
+        assert res["ans"] == text and clf.accepts(res)
+
+
+def test_unreadable_cells_are_deferred(model):
+    clf = DigitClassifier(model[0])
+    touching = written_cell("88", 0, 5, spacing=30)
+    smudge = written_cell("", 0, 6)
+    cv2.rectangle(smudge, (140, 120), (300, 200), (30, 30, 30), -1)
+    for cell in (touching, smudge):
+        assert not clf.accepts(clf.read(cell))
+
+    items = [(1, 0, 10, written_cell("7", 3, 1)), (2, 0, 11, touching)]
+    accepted, pending = read_digits(items, clf, verbose=False)
+    assert accepted == {1: {"ans": "7", "conf": True, "scores": [accepted[1]["scores"][0]], "tier": "digit"}}
+    assert [item[0] for item in pending] == [2]
+
+
+def test_explicit_threshold_overrides_the_model(model):
+    clf = DigitClassifier(model[0], accept_conf=1.01)
+    assert not clf.accepts(clf.read(written_cell("7", 3, 1)))
+
+
+def test_calibration_needs_two_subjects(tmp_path):
+    with pytest.raises(ValueError):
+        train_digit_model(subject_crops(0), str(tmp_path / "m.npz"))
+
+
+def test_missing_model_is_reported(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        DigitClassifier(str(tmp_path / "none.npz"))
+
+
+def test_labels_come_from_truth_only(tmp_path):
+    wrong = "24" if str(WJ_MATH_ANSWER_KEY[0]) != "24" else "25"
+    for name, truth in (("sub-a", {"1": wrong}), ("sub-b", None)):
+        debug_dir = tmp_path / name / "debug_cells"
+        debug_dir.mkdir(parents=True)
+        Image.fromarray(written_cell(wrong, 0, 1)).save(debug_dir / "Q1_page1_cell11.png")
+        if truth is not None:
+            (tmp_path / name / "truth.json").write_text(json.dumps(truth))
+    crops = load_labeled_crops([str(tmp_path / "sub-a" / "debug_cells"), str(tmp_path / "sub-b" / "debug_cells")])
+    assert [(c[2], os.path.basename(c[3])) for c in crops] == [(wrong, "sub-a")]
+
+
+def test_threshold_is_the_lowest_that_meets_the_target():
+    conf = [0.99, 0.99, 0.9, 0.8, 0.5]
+    correct = [True, True, True, False, True]
+    assert accept_threshold(conf, correct, 0.99) == 0.9
+    assert accept_threshold(conf, correct, 0.75) == 0.5
+    assert accept_threshold([0.9], [False], 0.99) == float("inf")
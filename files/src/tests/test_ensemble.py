@@ -0,0 +1,104 @@
+import sys
+import threading
+import time
+
+from backends import StubBackend
+from conftest import make_cell
+from ensemble import ParallelEnsemble, ProcessBackend, close_backends, recognize_members
+from main_scanner import load_backends
+
+
+class RecordingStub(StubBackend):
+    """Stub that records when each batch ran and optionally waits at a barrier inside it."""
+
+    def __init__(self, *args, barrier=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.barrier = barrier
+        self.spans = []
+
+    def _recognize_batch(self, images, template, keys, max_tokens):
+        start = time.perf_counter()
+        if self.barrier is not None:
+            # Only passes when the other member is inside its forward pass at the same time
+            self.barrier.wait(timeout=10)
+        out = super()._recognize_batch(images, template, keys, max_tokens)
+        self.spans.append((start, time.perf_counter()))
+        return out
+
+
+def members(barrier=None, latency=0.0):
+    """Two stubs that answer differently."""
+    return [RecordingStub(f"m{i}", default=str(i), call_latency=latency, batch_size=16, barrier=barrier)
+            for i in range(2)]
+
+
+def recognize(backends, images):
+    return recognize_members(backends, images, keys=list(range(len(images))), verbose=False)
+
+
+def test_members_overlap():
+    images = [make_cell(i) for i in range(8)]  # one batch per member
+    sequential = recognize(members(), images)
+    with ParallelEnsemble(members(barrier=threading.Barrier(2))) as ensemble:
+        parallel = recognize(ensemble, images)
+        (a_start, a_end), = ensemble[0].spans
+        (b_start, b_end), = ensemble[1].spans
+    assert parallel == sequential
+    assert max(a_start, b_start) < min(a_end, b_end)
+
+
+def test_parallelism_one_runs_members_in_turn():
+    with ParallelEnsemble(members(latency=0.05), parallelism=1) as ensemble:
+        recognize(ensemble, [make_cell(1)])
+        (a_start, a_end), = ensemble[0].spans
+        (b_start, b_end), = ensemble[1].spans
+    assert a_end <= b_start or b_end <= a_start
+
+
+def test_answers_are_joined_per_cell():
+    members = [StubBackend("a", answers={1: "5", 2: "7"}, batch_size=1), StubBackend("b", default="9", batch_size=2)]
+    joined = {}
+    with ParallelEnsemble(members) as ensemble:
+        ensemble.recognize_all([make_cell(1), make_cell(2), make_cell(3)], keys=[1, 2, 3],
+                               on_complete=lambda i, answers: joined.setdefault(i, [a["ans"] for a in answers]))
+    assert joined == {0: ["5", "9"], 1: ["7", "9"], 2: ["EMPTY", "9"]}
+
+
+def test_close_stops_the_workers():
+    ensemble = ParallelEnsemble(members())
+    threads = list(ensemble.threads)
+    assert all(t.is_alive() for t in threads)
+    close_backends(ensemble)
+    assert not any(t.is_alive() for t in threads)
+    ensemble.close()  # closing twice is harmless
+
+
+def test_mlx_members_get_a_process_each(monkeypatch):
+    # Any import of mlx in this process would now fail
+    monkeypatch.setitem(sys.modules, "mlx", None)
+    backends = load_backends("mlx", load=False, parallel=2)
+    try:
+        assert isinstance(backends, ParallelEnsemble)
+        assert all(isinstance(rec, ProcessBackend) for rec in backends)
+        assert all(rec.process is None for rec in backends)  # nothing spawned before the first cell
+        assert backends[0].model_id.startswith("mlx-community/")
+    finally:
+        close_backends(backends)
+    assert sys.modules["mlx"] is None
+    # Thread-safe backends stay in this process
+    stubs = load_backends("stub", load=False, parallel=2)
+    assert all(isinstance(rec, StubBackend) for rec in stubs)
+    close_backends(stubs)
+
+
+def test_process_backend_round_trip():
+    rec = ProcessBackend("stub", "stub-small", batch_size=2)
+    try:
+        out = rec.recognize([make_cell(1), make_cell(2), make_cell(3)], keys=[1, 2, (3, 4)])
+        assert [r["ans"] for r in out] == ["EMPTY", "EMPTY", "EMPTY, EMPTY"]
+        assert rec.loaded and rec.process.is_alive()
+        rec.unload()
+        assert not rec.loaded
+    finally:
+        rec.close()
+    assert rec.process is None
@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+from grid_layout import PAIRS, QUESTION_FRACTION, GridLayout
+
+WIDTH, HEIGHT, COLS = 1700, 2200, 10
+
+
+def grid_page(offset=15, tilt=0, underline_at=0.5, skip_underline=None):
+    """
+    A straightened page with a printed grid: pair separators `offset` px below where the
+    margins put them (rising by `tilt` px across the page) and an answer underline in
+    every column `underline_at` of the way down each pair.
+
+    Returns:
+        (RGB page, separator y per pair edge and column, underline y per pair and column)
+    """
+    page = np.full((HEIGHT, WIDTH, 3), 235, np.uint8)
+    fixed = GridLayout.from_margins(WIDTH, HEIGHT, COLS)
+    left, right = int(fixed.col_edges[0]), int(fixed.col_edges[-1])
+    centers = (fixed.col_edges[:-1] + fixed.col_edges[1:]) / 2
+    slope = tilt / (right - left)
+    seps = fixed.pair_edges[:, 0] + offset
+    for y in seps:
+        cv2.line(page, (left, int(y)), (right, int(round(y - tilt))), (30, 30, 30), 3)
+    sep_y = seps[:, None] - slope * (centers - left)[None, :]
+    pair_h = seps[1] - seps[0]
+    und_y = sep_y[:-1] + pair_h * underline_at
+    cell_w = fixed.col_edges[1] - fixed.col_edges[0]
+    for p in range(PAIRS):
+        for c in range(COLS):
+            if c == skip_underline:
+                continue
+            y = int(round(und_y[p, c]))
+            cv2.line(page, (int(centers[c] - cell_w / 4), y), (int(centers[c] + cell_w / 4), y), (30, 30, 30), 3)
+    return page, sep_y, und_y
+
+
+def test_detect_follows_the_printed_grid():
+    page, sep_y, und_y = grid_page()
+    layout = GridLayout.detect(page, COLS)
+    assert layout.detected and layout.shift == 0.0
+    assert np.abs(layout.pair_edges - sep_y).max() <= 3
+    # Answer rows start just below their underline
+    assert np.all((layout.answer_tops - und_y >= 0) & (layout.answer_tops - und_y <= 4))
+    assert layout.answer_boxes.shape == (PAIRS, COLS, 4)
+
+
+def test_detect_follows_a_tilted_grid_per_column():
+    page, sep_y, _ = grid_page(tilt=12)
+    layout = GridLayout.detect(page, COLS)
+    assert layout.detected
+    assert np.abs(layout.pair_edges - sep_y).max() <= 3
+    assert (layout.pair_edges[:, 0] - layout.pair_edges[:, -1]).min() >= 8
+
+
+def test_column_without_underline_keeps_the_fixed_split():
+    page, sep_y, _ = grid_page(skip_underline=4)
+    layout = GridLayout.detect(page, COLS)
+    spans = layout.pair_edges[1:, 4] - layout.pair_edges[:-1, 4]
+    expected = layout.pair_edges[:-1, 4] + spans * QUESTION_FRACTION
+    assert np.abs(layout.answer_tops[:, 4] - expected).max() <= 1
+
+
+def test_blank_page_falls_back_to_the_margins():
+    page = np.full((HEIGHT, WIDTH, 3), 235, np.uint8)
+    layout = GridLayout.detect(page, COLS)
+    fixed = GridLayout.from_margins(WIDTH, HEIGHT, COLS)
+    assert not layout.detected and layout.shift == 0.05
+    assert np.array_equal(layout.answer_boxes, fixed.answer_boxes)
@@ -0,0 +1,88 @@
+import json
+import random
+import threading
+
+import pytest
+
+import instrumentation
+from instrumentation import Histogram, Tracer
+
+
+@pytest.fixture(autouse=True)
+def tracing_off():
+    yield
+    instrumentation.disable()
+
+
+def test_histogram_quantiles_match_the_samples():
+    rng = random.Random(0)
+    values = [rng.lognormvariate(4, 1) for _ in range(20000)]
+    hist = Histogram()
+    for v in values:
+        hist.add(v)
+    values.sort()
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(len(values) * q)]
+        assert hist.quantile(q) == pytest.approx(exact, rel=0.03)
+    assert hist.max == values[-1] and hist.count == len(values)
+    # Memory follows the range of the values, not their number
+    assert len(hist.buckets) < 300
+
+
+def test_histogram_handles_zero():
+    hist = Histogram()
+    for v in (0.0, 0.0, 5.0):
+        hist.add(v)
+    assert hist.quantile(0.5) == 0.0 and hist.quantile(0.99) == pytest.approx(5.0, rel=0.03)
+
+
+def test_trace_is_streamed_to_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, "FLUSH_EVENTS", 50)
+    path = tmp_path / "trace.json"
+    tracer = instrumentation.enable(trace_path=str(path))
+    for i in range(1000):
+        with instrumentation.span("cell", i=i):
+            pass
+        assert len(tracer.events) < 50
+    instrumentation.record("scan", cells=160)
+    instrumentation.finish()
+    events = json.loads(path.read_text())
+    assert sum(e["name"] == "cell" for e in events) == 1000
+    assert any(e["ph"] == "C" for e in events) and any(e["ph"] == "M" for e in events)
+
+
+def test_spans_are_not_kept_without_a_trace():
+    tracer = instrumentation.enable()
+    with instrumentation.span("cell") as sp:
+        pass
+    assert sp.duration_ms >= 0 and tracer.events == []
+    assert [e for e in instrumentation.drain() if e["ph"] == "X"] == []
+
+
+def test_drain_while_threads_start():
+    tracer = Tracer(keep_events=True)
+    stop = threading.Event()
+
+    def spans():
+        with instrumentation.Span(tracer, "work", "test", {}):
+            pass
+
+    def spawn():
+        while not stop.is_set():
+            threads = [threading.Thread(target=spans) for _ in range(20)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+    spawner = threading.Thread(target=spawn)
+    spawner.start()
+    drained = []
+    try:
+        for _ in range(200):
+            drained.extend(e for e in tracer.drain() if e["ph"] == "X")
+    finally:
+        stop.set()
+        spawner.join()
+    drained.extend(e for e in tracer.drain() if e["ph"] == "X")
+    assert drained and all(e["name"] == "work" for e in drained)
@@ -0,0 +1,68 @@
+import pytest
+
+from config import NOT_REQUESTED_TIER, NOT_SCANNED, NOT_SCANNED_TIER, WJ_MATH_ANSWER_KEY, score_results
+from main_scanner import build_parser, mark_not_requested
+from result_overlay import cell_status
+from results_store import ResultsStore
+
+QUESTIONS = range(1, len(WJ_MATH_ANSWER_KEY) + 1)
+ARGS = ["--fpath1", "p1.png", "--fpath2", "p2.png"]
+
+
+def limited_results(limit, ceiling_at=None):
+    """Scanner results of a --limit run: the key's answers, blanks from ceiling_at on, NOT SCANNED past the scan."""
+    stop = limit if ceiling_at is None else min(limit, ceiling_at + 5)
+    results = {}
+    for q, a in zip(QUESTIONS, WJ_MATH_ANSWER_KEY):
+        if q > stop:
+            results[q] = {"ans": NOT_SCANNED, "conf": None, "scores": [], "tier": NOT_SCANNED_TIER}
+        else:
+            ans = "EMPTY" if ceiling_at is not None and q >= ceiling_at else str(a)
+            results[q] = {"ans": ans, "conf": True, "scores": [1.0], "tier": "ensemble"}
+    return results
+
+
+def test_items_past_the_limit_are_not_requested():
+    results = limited_results(30)
+    mark_not_requested(results, QUESTIONS, 30)
+    assert all(results[q]["tier"] == "ensemble" for q in range(1, 31))
+    assert all(results[q]["tier"] == NOT_REQUESTED_TIER for q in range(31, 161))
+    raw_score, report = score_results([results[q] for q in QUESTIONS], apply_ceiling=True)
+    assert raw_score == 30
+    assert not any(e["ceiling"] for e in report)
+
+
+def test_a_ceiling_inside_the_limit_still_wins():
+    results = limited_results(100, ceiling_at=20)
+    mark_not_requested(results, QUESTIONS, 100)
+    assert all(results[q]["tier"] == NOT_SCANNED_TIER for q in range(26, 161))
+
+
+def test_overlay_and_store_keep_not_requested_apart(tmp_path):
+    results = limited_results(30)
+    mark_not_requested(results, QUESTIONS, 30)
+    raw_score, report = score_results([results[q] for q in QUESTIONS], apply_ceiling=True)
+    assert cell_status(report[29]) == "correct"
+    assert cell_status(report[30]) == "not_requested"
+
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    try:
+        store.add_protocol(report, raw_score, str(tmp_path / "sub-1"), user="u", subject="sub-1")
+        protocol = store.conn.execute("SELECT scanned, ceiling_item FROM protocols").fetchone()
+        assert protocol == (30, None)
+        statuses = dict(store.conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+        assert statuses == {"correct": 30, "not_requested": 130}
+        assert [s["question"] for s in store.item_stats(order="question")] == list(range(1, 31))
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("value", ["0", "-5", "two"])
+def test_limit_must_be_a_positive_integer(value):
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(ARGS + ["--limit", value])
+
+
+def test_limit_is_parsed():
+    assert build_parser().parse_args(ARGS + ["--limit", "12"]).limit == 12
+    assert build_parser().parse_args(ARGS).limit is None
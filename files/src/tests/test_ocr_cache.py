@@ -0,0 +1,95 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import ocr_cache
+
+from backends import StubBackend
+from ocr_cache import ROW_OVERHEAD, CachedBackend, OCRCache, cell_key
+from conftest import make_cell
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = OCRCache(str(tmp_path))
+    yield cache
+    cache.close()
+
+
+def test_miss_then_hit(cache):
+    stub = StubBackend("small", answers={1: "5", 2: "12"})
+    cached = CachedBackend(stub, cache)
+    cells = [make_cell(1), make_cell(2)]
+
+    first = cached.recognize(cells, keys=[1, 2])
+    assert [r["ans"] for r in first] == ["5", "12"]
+    assert not any(r["cached"] for r in first)
+    assert stub.images_seen == 2
+
+    second = cached.recognize(cells, keys=[1, 2])
+    assert [r["ans"] for r in second] == ["5", "12"]
+    assert all(r["cached"] for r in second)
+    assert stub.images_seen == 2  # answered from the cache, the model saw nothing new
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_only_misses_reach_the_model(cache):
+    stub = StubBackend("small", answers={1: "5", 2: "12", 3: "7"})
+    cached = CachedBackend(stub, cache)
+    cached.recognize([make_cell(1)], keys=[1])
+    out = cached.recognize([make_cell(1), make_cell(2), make_cell(3)], keys=[1, 2, 3])
+    assert [r["ans"] for r in out] == ["5", "12", "7"]
+    assert [r["cached"] for r in out] == [True, False, False]
+    assert stub.images_seen == 3
+
+
+def test_key_depends_on_pixels_model_and_prompt():
+    cell = make_cell(1)
+    base = cell_key(cell, "small", "prompt", 20, 0.0, 512 * 512)
+    assert cell_key(make_cell(1), "small", "prompt", 20, 0.0, 512 * 512) == base
+    assert cell_key(make_cell(2), "small", "prompt", 20, 0.0, 512 * 512) != base
+    assert cell_key(cell, "large", "prompt", 20, 0.0, 512 * 512) != base
+    assert cell_key(cell, "small", "other prompt", 20, 0.0, 512 * 512) != base
+    assert cell_key(cell, "small", "prompt", 10, 0.0, 512 * 512) != base
+
+
+def test_separate_models_do_not_share_entries(cache):
+    small = CachedBackend(StubBackend("small", default="1"), cache)
+    large = CachedBackend(StubBackend("large", default="2"), cache)
+    cell = make_cell(1)
+    assert small.recognize([cell], keys=[1])[0]["ans"] == "1"
+    assert large.recognize([cell], keys=[1])[0]["ans"] == "2"
+    assert large.recognize([cell], keys=[1])[0]["cached"]
+
+
+def test_lru_eviction_keeps_recently_used_entries(tmp_path, monkeypatch):
+    # A clock that always advances, so recency never ties
+    clock = itertools.count(1)
+    monkeypatch.setattr(ocr_cache, "time", SimpleNamespace(time=lambda: float(next(clock))))
+    key_size = 64 + 1 + ROW_OVERHEAD  # sha256 hex key, one-character answer
+    cache = OCRCache(str(tmp_path), max_bytes=3 * key_size)
+    keys = [f"{i:064x}" for i in range(4)]
+    try:
+        cache.put_many([(keys[0], {"ans": "1", "score": 1.0})])
+        cache.put_many([(keys[1], {"ans": "2", "score": 1.0})])
+        cache.put_many([(keys[2], {"ans": "3", "score": 1.0})])
+        # Touch the oldest entry so the second one becomes least recently used
+        assert keys[0] in cache.get_many([keys[0]])
+        cache.put_many([(keys[3], {"ans": "4", "score": 1.0})])
+
+        found = cache.get_many(keys)
+        assert set(found) == {keys[0], keys[2], keys[3]}
+        assert cache.stats()["entries"] == 3
+        assert cache.stats()["bytes"] <= 3 * key_size
+    finally:
+        cache.close()
+
+
+def test_cache_closes_as_a_context_manager(tmp_path):
+    with OCRCache(str(tmp_path)) as cache:
+        cache.put_many([("k", {"ans": "5", "score": 1.0})])
+    with pytest.raises(Exception):
+        cache.get_many(["k"])
+    with OCRCache(str(tmp_path)) as cache:
+        assert cache.get_many(["k"]) == {"k": {"ans": "5", "score": 1.0}}
@@ -0,0 +1,42 @@
+import numpy as np
+from PIL import Image
+
+from conftest import make_photo
+from image_utils import PageContext, decode_image, get_individual_cells, iter_answer_cells, load_page
+
+
+def save_photo(path, **kwargs):
+    photo, _ = make_photo(size=(1300, 1000), page=(700, 930), angle=2.0, **kwargs)
+    Image.fromarray(photo).save(path)
+    return photo
+
+
+def test_page_is_decoded_once_and_cropped_without_copies(tmp_path):
+    path = str(tmp_path / "page.png")
+    save_photo(path)
+    page = load_page(path)
+    assert isinstance(page, PageContext) and page.straightened
+    assert page.image.dtype == np.uint8 and page.image.shape[2] == 3
+    cells = get_individual_cells(page, str(tmp_path), debug=False)
+    assert len(cells) == 160
+    assert all(np.shares_memory(cell, page.image) for cell in cells)
+    answers = [cell for _, _, cell in iter_answer_cells(page)]
+    assert len(answers) == 80 and all(np.shares_memory(cell, page.image) for cell in answers)
+    # Both croppers see the same grid, computed once for the page
+    assert len(page.layouts) == 1
+    assert np.array_equal(answers[0], cells[10])
+
+
+def test_decode_applies_exif_orientation(tmp_path):
+    path = str(tmp_path / "rotated.jpg")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # stored sideways: display rotated 90 degrees clockwise
+    Image.fromarray(np.zeros((40, 100, 3), dtype=np.uint8)).save(path, exif=exif)
+    assert decode_image(path).shape == (100, 40, 3)
+
+
+def test_page_without_an_outline_is_used_as_is(tmp_path):
+    path = str(tmp_path / "flat.png")
+    Image.fromarray(np.full((300, 200, 3), 230, dtype=np.uint8)).save(path)
+    page = load_page(path)
+    assert not page.straightened and page.image.shape == (300, 200, 3)
@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+import pytest
+
+from prefilter import BLANK_INK_THRESHOLD, calibrate_blank_threshold, classify_blank, ink_ratio, synthesize_blank
+
+PAPER = 185
+
+
+def empty_cell(seed=0, size=(284, 410)):
+    """An answer-cell crop as the cropper returns it: paper texture, grid lines and the problem's fraction bar."""
+    rng = np.random.default_rng(seed)
+    h, w = size
+    cell = np.clip(rng.normal(PAPER, 4, size=(h, w)), 0, 255).astype(np.uint8)
+    cell[:, 26:31] = 40            # grid line on the left, through the whole crop
+    cell[h - 28:h - 24, :] = 40    # grid line below the answer row
+    cell[24:29, 90:350] = 30       # fraction bar of the problem above
+    return cv2.cvtColor(cell, cv2.COLOR_GRAY2RGB)
+
+
+def with_stroke(cell, thickness, shade):
+    h, w = cell.shape[:2]
+    out = cell.copy()
+    cv2.line(out, (w // 2, int(h * 0.4)), (w // 2 + 4, int(h * 0.62)), (shade,) * 3, thickness)
+    return out
+
+
+def with_digit(cell):
+    out = cell.copy()
+    cv2.putText(out, "7", (170, 200), cv2.FONT_HERSHEY_SIMPLEX, 3.5, (30, 30, 30), 8)
+    return out
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_blank_cell_is_empty(seed):
+    is_blank, confidence, ratio = classify_blank(empty_cell(seed))
+    assert is_blank and ratio < BLANK_INK_THRESHOLD and confidence > 0.5
+
+
+def test_faint_one_stroke_digit_is_not_empty():
+    # A thin "1" at half the paper brightness
+    is_blank, _, ratio = classify_blank(with_stroke(empty_cell(), 3, PAPER // 2))
+    assert not is_blank, ratio
+
+
+def test_written_digit_is_not_empty():
+    assert not classify_blank(with_digit(empty_cell()))[0]
+
+
+def test_synthetic_blank_keeps_the_printed_lines():
+    answered = with_digit(empty_cell(1))
+    blank = synthesize_blank(answered)
+    assert classify_blank(blank)[0]
+    # Only the handwriting is painted over
+    assert (blank[:, 26:31] < 80).all() and (blank[24:29, 90:350] < 80).all()
+    assert np.abs(blank.astype(int) - empty_cell(1)).mean() < 3
+
+
+def test_calibration_puts_the_threshold_near_the_blanks():
+    inked = [with_digit(empty_cell(s)) for s in range(3)] + [with_stroke(empty_cell(9), 3, PAPER // 2)]
+    blanks = [synthesize_blank(c) for c in inked]
+    threshold, stats = calibrate_blank_threshold(inked, blanks)
+    assert stats["separable"]
+    assert stats["max_blank"] < threshold < (stats["max_blank"] + stats["min_inked"]) / 2
+    assert threshold < ink_ratio(inked[-1])
+
+
+def test_calibration_needs_blank_samples():
+    with pytest.raises(ValueError):
+        calibrate_blank_threshold([with_digit(empty_cell())], [])
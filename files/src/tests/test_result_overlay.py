@@ -0,0 +1,99 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from config import NOT_REQUESTED_TIER, NOT_SCANNED_TIER
+from grid_layout import GridLayout
+from result_overlay import (
+    DEFAULT_OVERLAY_WIDTH, NO_CELL, OVERLAY_ALPHA, STATUS_COLORS, STATUSES,
+    render_overlay, status_codes, status_mask, write_overlays,
+)
+
+PAGE = (1600, 2000)  # width, height
+PAIRS, COLS = 8, 10
+
+
+def entry(status):
+    """A score_results report entry that cell_status maps to `status`."""
+    e = {"status": "❌", "detected": "3", "expected": "4", "conf": True, "tier": "ensemble"}
+    if status == "correct":
+        e.update(status="✅", detected="4")
+    elif status == "empty":
+        e["detected"] = "EMPTY"
+    elif status == "unsure":
+        e["conf"] = False
+    elif status == "not_scanned":
+        e["tier"] = NOT_SCANNED_TIER
+    elif status == "not_requested":
+        e["tier"] = NOT_REQUESTED_TIER
+    return e
+
+
+@pytest.fixture
+def layout():
+    return GridLayout.from_margins(*PAGE, cols=COLS)
+
+
+@pytest.fixture
+def report():
+    # Every status on both pages, in an order that does not line up with rows or columns
+    return [entry(STATUSES[(i * 7) % len(STATUSES)]) for i in range(2 * PAIRS * COLS)]
+
+
+def centers(layout, scale=1.0):
+    boxes = layout.answer_boxes * scale
+    return ((boxes[..., 0] + boxes[..., 2]) / 2).astype(int), ((boxes[..., 1] + boxes[..., 3]) / 2).astype(int)
+
+
+def test_status_codes_follow_the_report(report):
+    codes = status_codes(report, 1, PAIRS, COLS)
+    for q in range(PAIRS * COLS):
+        assert STATUSES[codes[q // COLS, q % COLS]] == STATUSES[((q + PAIRS * COLS) * 7) % len(STATUSES)]
+    assert (status_codes(report[:PAIRS * COLS + 5], 1, PAIRS, COLS).ravel()[5:] == NO_CELL).all()
+
+
+@pytest.mark.parametrize("scale", [1.0, 0.5])
+def test_mask_gives_every_cell_its_code(layout, report, scale):
+    codes = status_codes(report, 0, PAIRS, COLS)
+    shape = (int(PAGE[1] * scale), int(PAGE[0] * scale))
+    mask = status_mask(shape, layout, codes, scale)
+    assert mask.shape == shape
+    xs, ys = centers(layout, scale)
+    np.testing.assert_array_equal(mask[ys, xs], codes)
+    # Question rows, margins and everything outside the grid stay uncolored
+    qboxes = layout.question_boxes * scale
+    qx, qy = ((qboxes[..., 0] + qboxes[..., 2]) / 2).astype(int), ((qboxes[..., 1] + qboxes[..., 3]) / 2).astype(int)
+    assert (mask[qy, qx] == NO_CELL).all()
+    assert mask[0, 0] == mask[-1, -1] == NO_CELL
+    assert set(np.unique(mask)) == set(range(len(STATUSES))) | {NO_CELL}
+
+
+def test_overlay_blends_the_status_color(layout, report):
+    page = np.full((PAGE[1], PAGE[0], 3), 200, dtype=np.uint8)
+    codes = status_codes(report, 0, PAIRS, COLS)
+    vis = render_overlay(page, layout, codes)
+    xs, ys = centers(layout)
+    for pair in range(PAIRS):
+        for col in range(COLS):
+            color = np.array(STATUS_COLORS[STATUSES[codes[pair, col]]])
+            expected = 200 * (1 - OVERLAY_ALPHA) + color * OVERLAY_ALPHA
+            np.testing.assert_allclose(vis[ys[pair, col], xs[pair, col]], expected, atol=1)
+    assert (vis[0, 0] == 200).all()
+
+
+def test_default_is_a_downscaled_jpeg(tmp_path, layout, report):
+    pages = [SimpleNamespace(image=np.full((PAGE[1], PAGE[0], 3), 200, dtype=np.uint8), size=PAGE)] * 2
+    paths = write_overlays(report, pages, [layout] * 2, str(tmp_path))
+    assert [os.path.basename(p) for p in paths] == ["colored_page_1.jpg", "colored_page_2.jpg"]
+    with Image.open(paths[0]) as im:
+        assert im.format == "JPEG" and im.width == DEFAULT_OVERLAY_WIDTH
+
+
+def test_full_size_png_is_opt_in(tmp_path, layout, report):
+    pages = [SimpleNamespace(image=np.full((PAGE[1], PAGE[0], 3), 200, dtype=np.uint8), size=PAGE)]
+    path, = write_overlays(report, pages, [layout], str(tmp_path), image_format="png", max_width=0)
+    with Image.open(path) as im:
+        assert path.endswith(".png") and im.size == PAGE
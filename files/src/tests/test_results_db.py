@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+import pytest
+
+import main_scanner
+from main_scanner import build_parser, main
+from results_store import ResultsStore
+
+SAMPLE_SUBJECT = os.path.join(os.path.dirname(__file__), "..", "..", "data", "user-DGB", "sub-test_1")
+PAGES = [os.path.join(SAMPLE_SUBJECT, name) for name in ("IMG_6654.png", "IMG_6655.png")]
+
+needs_sample = pytest.mark.skipif(not all(os.path.exists(p) for p in PAGES), reason="sample pages not available")
+
+
+def run(tmp_path, *extra):
+    main(["--fpath1", PAGES[0], "--fpath2", PAGES[1], "--backend", "stub", "--no-cache", "--no-artifacts",
+          "--no-debug", "--no-colored-pages", "--output-dir", str(tmp_path), *extra])
+
+
+def stored_protocols(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT user, subject, items FROM protocols").fetchall()
+
+
+def test_results_store_is_opt_in():
+    args = build_parser().parse_args(["--fpath1", "p1.png", "--fpath2", "p2.png"])
+    assert args.results_db is None
+
+
+@needs_sample
+def test_report_is_recorded_when_asked(tmp_path):
+    db = str(tmp_path / "results.sqlite")
+    run(tmp_path, "--results-db", db)
+    assert stored_protocols(db) == [("user-DGB", "sub-test_1", 160)]
+
+
+@needs_sample
+def test_limit_runs_are_not_recorded(tmp_path):
+    db = str(tmp_path / "results.sqlite")
+    run(tmp_path, "--results-db", db, "--limit", "5")
+    assert stored_protocols(db) == []
+
+
+def test_store_closes_on_exit(tmp_path):
+    with ResultsStore(str(tmp_path / "results.sqlite")) as store:
+        assert store.protocol_count() == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.protocol_count()
+
+
+@needs_sample
+def test_main_closes_the_store(tmp_path, monkeypatch):
+    opened = []
+
+    class RecordingStore(ResultsStore):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.closed = False
+            opened.append(self)
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    monkeypatch.setattr(main_scanner, "ResultsStore", RecordingStore)
+    run(tmp_path, "--results-db", str(tmp_path / "results.sqlite"))
+    assert len(opened) == 1 and opened[0].closed
@@ -0,0 +1,35 @@
+from main_scanner import parse_row_response
+
+
+def test_parses_comma_separated_row():
+    assert parse_row_response("0, 3, 4, 2, 3, 0, 0, 3, 1, 6") == ["0", "3", "4", "2", "3", "0", "0", "3", "1", "6"]
+
+
+def test_accepts_brackets_numbering_and_blank_words():
+    text = "[1. 5\n2. empty\n3. 7\n4. -\n5. 12\n6. none\n7. 8\n8. blank\n9. 3\n10. 10]"
+    assert parse_row_response(text) == ["5", "EMPTY", "7", "EMPTY", "12", "EMPTY", "8", "EMPTY", "3", "10"]
+
+
+def test_whitespace_separated_when_no_other_separator():
+    assert parse_row_response("1 2 3", cols=3) == ["1", "2", "3"]
+
+
+def test_short_row_is_rejected():
+    assert parse_row_response("1, 2, 3, 4, 5, 6, 7, 8, 9") is None
+
+
+def test_long_row_is_rejected():
+    assert parse_row_response("1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11") is None
+
+
+def test_malformed_responses_are_rejected():
+    assert parse_row_response("") is None
+    assert parse_row_response("[]") is None
+    assert parse_row_response(", , ,") is None
+    assert parse_row_response("I cannot read this image.") is None
+
+
+def test_empty_separated_values_do_not_count():
+    # Doubled separators leave empty parts, which must not pad a short row
+    assert parse_row_response("1,,2,3,4,5,6,7,8,9") is None
+    assert parse_row_response("1,,2,3,4,5,6,7,8,9,10") == [str(i) for i in range(1, 11)]
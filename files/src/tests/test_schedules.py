@@ -0,0 +1,88 @@
+import pytest
+
+from backends import StubBackend
+from config import WJ_MATH_ANSWER_KEY
+from conftest import make_cell
+from main_scanner import scan_model_major, scan_stream
+
+QUESTIONS = range(1, len(WJ_MATH_ANSWER_KEY) + 1)
+
+
+def member_answers(protocol):
+    """
+    Answers of the small and large stub models for one protocol.
+
+    The models disagree on some cells, the small one writes non-numeric answers
+    the cascade escalates, and both answer Q50-Q59 wrong, so the ceiling falls on Q55.
+    """
+    small, large = {}, {}
+    for q, a in zip(QUESTIONS, WJ_MATH_ANSWER_KEY):
+        small[q] = large[q] = str(a)
+        if (q + protocol) % 7 == 0:
+            small[q] = "X"
+        if (q + protocol) % 11 == 0:
+            large[q] = "99"
+        if 50 <= q < 60:
+            small[q] = large[q] = "EMPTY"
+    return small, large
+
+
+def make_backends(protocols=(0,)):
+    """Fresh small/large stubs; answers are keyed by question number, per protocol offset."""
+    small, large = {}, {}
+    for p in protocols:
+        s, l = member_answers(p)
+        small.update({q + 1000 * p: a for q, a in s.items()})
+        large.update({q + 1000 * p: a for q, a in l.items()})
+    return [StubBackend("small", answers=small, score=0.9), StubBackend("large", answers=large, score=0.99)]
+
+
+def protocol_items(protocol, answer_items):
+    # Question numbers are offset per protocol so one stub can answer several protocols differently
+    if protocol == 0:
+        return answer_items
+    return [(q + 1000 * protocol, p, c, make_cell(q + 1000 * protocol)) for q, p, c, _ in answer_items]
+
+
+def row_images_for(items):
+    qs = [item[0] for item in items]
+    return {tuple(qs[i:i + 10]): make_cell(10_000 + qs[i]) for i in range(0, len(qs), 10)}
+
+
+@pytest.mark.parametrize("stop_at_ceiling", [False, True])
+@pytest.mark.parametrize("cascade", [False, True])
+@pytest.mark.parametrize("row_mode", [False, True])
+def test_model_major_matches_interleaved(answer_items, stop_at_ceiling, cascade, row_mode):
+    rows = row_images_for(answer_items) if row_mode else None
+    options = dict(blank_threshold=None, cascade=cascade, escalate_score=0.85, stop_at_ceiling=stop_at_ceiling,
+                   question_nums=QUESTIONS)
+    _, interleaved = scan_stream([(answer_items, rows)], make_backends(), **options)
+    model_major = scan_model_major([(answer_items, rows)], make_backends(), verbose=False, **options)[0]
+    assert model_major == interleaved
+    tiers = {r["tier"] for r in interleaved.values()}
+    if cascade:
+        assert {"small_row" if row_mode else "small", "large"} <= tiers
+    if stop_at_ceiling:
+        # Cells are read ten at a time, so the chunk holding the ceiling item is finished
+        assert interleaved[60]["tier"] != "beyond_ceiling"
+        assert all(interleaved[q]["tier"] == "beyond_ceiling" for q in range(61, 161))
+    else:
+        assert all(r["tier"] != "beyond_ceiling" for r in interleaved.values())
+
+
+@pytest.mark.parametrize("stop_at_ceiling", [False, True])
+def test_model_major_over_several_protocols_matches_one_run_each(answer_items, stop_at_ceiling):
+    protocols = (0, 1, 2)
+    jobs = [(protocol_items(p, answer_items), None) for p in protocols]
+    options = dict(blank_threshold=None, stop_at_ceiling=stop_at_ceiling)
+    together = scan_model_major(jobs, make_backends(protocols), verbose=False, **options)
+    for p, job in zip(protocols, jobs):
+        _, alone = scan_stream([job], make_backends(protocols), **options)
+        assert together[p] == alone
+
+
+def test_model_major_loads_each_model_once(answer_items):
+    backends = make_backends()
+    scan_model_major([(answer_items, None)], backends, blank_threshold=None, verbose=False)
+    assert [b.loads for b in backends] == [1, 1]
+    assert not any(b.loaded for b in backends)
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+from cohort_scoring import CohortAnswers, protocol_report, score_cohort
+from config import (CEILING_CONSECUTIVE_WRONG, NOT_REQUESTED, NOT_REQUESTED_TIER, NOT_SCANNED, NOT_SCANNED_TIER,
+                    WJ_MATH_ANSWER_KEY, IncrementalScorer, score_results)
+
+
+def random_protocol(seed, accuracy):
+    """160 raw answers: the key's answer with probability `accuracy`, else a blank or a wrong number."""
+    rng = random.Random(seed)
+    answers = []
+    for a in WJ_MATH_ANSWER_KEY:
+        r = rng.random()
+        answers.append(str(a) if r < accuracy else rng.choice(["EMPTY", "99", "O", "l", " 7 "]))
+    return answers
+
+
+PROTOCOLS = [random_protocol(seed, accuracy) for seed in range(20) for accuracy in (0.4, 0.8, 0.97)]
+PROTOCOLS += [[str(a) for a in WJ_MATH_ANSWER_KEY], ["EMPTY"] * len(WJ_MATH_ANSWER_KEY)]
+
+
+@pytest.mark.parametrize("answers", PROTOCOLS)
+def test_incremental_scorer_matches_score_results_with_ceiling(answers):
+    scorer = IncrementalScorer()
+    for ans in answers:
+        scorer.add(ans)
+    raw_score, report = score_results(answers, apply_ceiling=True)
+    assert scorer.raw_score == raw_score
+    past = [e["question"] for e in report if e["ceiling"]]
+    assert scorer.ceiling_item == (past[0] - 1 if past else None)
+
+
+@pytest.mark.parametrize("answers", PROTOCOLS)
+def test_incremental_scorer_matches_score_results_without_ceiling(answers):
+    scorer = IncrementalScorer(ceiling_run=len(WJ_MATH_ANSWER_KEY) + 1)
+    for ans in answers:
+        scorer.add(ans)
+    raw_score, report = score_results(answers, apply_ceiling=False)
+    assert scorer.raw_score == raw_score
+    assert not scorer.ceiling_reached
+    assert not any(e["ceiling"] for e in report)
+
+
+def test_ceiling_item_completes_the_wrong_run():
+    answers = [str(a) for a in WJ_MATH_ANSWER_KEY[:10]] + ["EMPTY"] * CEILING_CONSECUTIVE_WRONG
+    answers += [str(a) for a in WJ_MATH_ANSWER_KEY[len(answers):]]
+    scorer = IncrementalScorer()
+    for ans in answers:
+        scorer.add(ans)
+    assert scorer.ceiling_item == 10 + CEILING_CONSECUTIVE_WRONG
+    assert scorer.raw_score == 10
+    assert score_results(answers, apply_ceiling=True)[0] == 10
+    assert score_results(answers, apply_ceiling=False)[0] == len(WJ_MATH_ANSWER_KEY) - CEILING_CONSECUTIVE_WRONG
+
+
+def scanned_results(answers, stop_after=None, skipped=(NOT_SCANNED, NOT_SCANNED_TIER)):
+    """Result dicts as the scanner returns them, skipped (NOT SCANNED by default) after question stop_after."""
+    results = []
+    for q, ans in enumerate(answers, 1):
+        if stop_after is not None and q > stop_after:
+            results.append({"ans": skipped[0], "conf": None, "scores": [], "tier": skipped[1]})
+        else:
+            results.append({"ans": ans, "conf": q % 7 != 0, "scores": [1.0], "tier": "ensemble"})
+    return results
+
+
+@pytest.mark.parametrize("apply_ceiling", [True, False])
+def test_score_cohort_matches_score_results(apply_ceiling):
+    protocols = [scanned_results(a) for a in PROTOCOLS]
+    protocols += [scanned_results(a, stop_after=40 + 7 * i) for i, a in enumerate(PROTOCOLS[:10])]
+    protocols += [scanned_results(a, stop_after=20 + 9 * i, skipped=(NOT_REQUESTED, NOT_REQUESTED_TIER))
+                  for i, a in enumerate(PROTOCOLS[10:20])]
+    protocols.append(scanned_results(PROTOCOLS[0][:90]))  # shorter protocol, padded in the cohort
+    cohort = CohortAnswers.from_results(protocols)
+    scores = score_cohort(cohort, apply_ceiling=apply_ceiling)["wj_math"]
+    for row, results in enumerate(protocols):
+        expected = score_results(results, apply_ceiling=apply_ceiling)
+        assert int(scores["raw_scores"][row]) == expected[0]
+        assert protocol_report(cohort, scores, row) == expected
+
+
+def test_score_cohort_scores_several_keys():
+    answers = [str(a) for a in WJ_MATH_ANSWER_KEY]
+    other_key = ["1"] * len(WJ_MATH_ANSWER_KEY)
+    cohort = CohortAnswers.from_results([scanned_results(answers)])
+    scores = score_cohort(cohort, {"wj_math": WJ_MATH_ANSWER_KEY, "ones": other_key})
+    assert scores["wj_math"]["raw_scores"][0] == len(WJ_MATH_ANSWER_KEY)
+    assert scores["ones"]["raw_scores"][0] == sum(str(a) == "1" for a in WJ_MATH_ANSWER_KEY)
+
+
+def test_items_left_out_by_limit_are_not_past_the_ceiling():
+    answers = [str(a) for a in WJ_MATH_ANSWER_KEY]
+    raw_score, report = score_results(scanned_results(answers, stop_after=30,
+                                                      skipped=(NOT_REQUESTED, NOT_REQUESTED_TIER)), apply_ceiling=True)
+    assert raw_score == 30
+    assert all(e["status"] == "✅" and not e["ceiling"] for e in report[:30])
+    assert all(e["detected"] == NOT_REQUESTED and e["status"] == "⏭" and not e["ceiling"] for e in report[30:])
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from main_scanner import load_backends
+from scoring_daemon import ScoringDaemon, make_handler
+
+SAMPLE_SUBJECT = os.path.join(os.path.dirname(__file__), "..", "..", "data", "user-DGB", "sub-test_1")
+
+
+@pytest.fixture
+def daemon_url():
+    daemon = ScoringDaemon(load_backends("stub", load=False), concurrency=2)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(daemon))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def call(url, body=None):
+    """(status code, JSON payload) of a GET, or of a POST when body is given (bytes)."""
+    req = urllib.request.Request(url, data=body, method="GET" if body is None else "POST")
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.mark.parametrize("body", [b"[]", b'"x"', b"42", b"null", b"{not json", b"{}",
+                                  b'{"subject_dir": "/no/such/folder"}'])
+def test_bad_requests_get_a_json_400(daemon_url, body):
+    code, payload = call(daemon_url + "/jobs", body)
+    assert code == 400
+    assert "error" in payload
+
+
+@pytest.mark.skipif(not os.path.isdir(SAMPLE_SUBJECT), reason="sample subject not available")
+@pytest.mark.parametrize("field, value", [("overlay_width", [800]), ("overlay_width", {"w": 1}),
+                                          ("overlay_width", "wide"), ("overlay_width", 0), ("overlay_width", True),
+                                          ("overlay_format", ["png"]), ("debug", ["full"]), ("output_dir", 7)])
+def test_malformed_job_fields_get_a_json_400(daemon_url, field, value):
+    body = json.dumps({"subject_dir": SAMPLE_SUBJECT, field: value}).encode()
+    code, payload = call(daemon_url + "/jobs", body)
+    assert code == 400
+    assert "error" in payload
+
+
+@pytest.mark.parametrize("field", ["subject_dir", "page1"])
+def test_non_string_paths_get_a_json_400(daemon_url, field):
+    code, payload = call(daemon_url + "/jobs", json.dumps({field: ["a"], "page2": "b"}).encode())
+    assert code == 400 and field in payload["error"]
+
+
+def test_jobs_read_while_the_worker_updates_them():
+    daemon = ScoringDaemon(load_backends("stub", load=False))
+    job = {"id": "x", "status": "running", "done": threading.Event()}
+    stop = threading.Event()
+
+    def worker():
+        i = 0
+        while not stop.is_set():
+            daemon._update(job, **{f"field_{i % 500}": i})
+            i += 1
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    try:
+        for _ in range(2000):
+            view = daemon.to_json(job)
+            assert "done" not in view and view["id"] == "x"
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_unknown_paths_and_jobs_are_404(daemon_url):
+    assert call(daemon_url + "/nope")[0] == 404
+    assert call(daemon_url + "/jobs/0123")[0] == 404
+
+
+@pytest.mark.skipif(not os.path.isdir(SAMPLE_SUBJECT), reason="sample subject not available")
+def test_job_is_scored_and_polled(daemon_url, tmp_path):
+    request = {"subject_dir": SAMPLE_SUBJECT, "output_dir": str(tmp_path)}
+    code, job = call(daemon_url + "/jobs", json.dumps(request).encode())
+    assert code == 202
+    assert job["status"] in ("queued", "running")
+
+    deadline = time.time() + 120
+    while job["status"] not in ("done", "error"):
+        assert time.time() < deadline, "job did not finish"
+        time.sleep(0.1)
+        code, job = call(f"{daemon_url}/jobs/{job['id']}")
+        assert code == 200
+    assert job["status"] == "done", job.get("error")
+    report = job["result"]["report"]
+    assert len(report) == 160
+    assert job["result"]["raw_score"] == sum(e["status"] == "✅" and not e["ceiling"] for e in report)
+    assert job["result"]["overlays"] == []  # visualize defaults to off
+
+    code, status = call(daemon_url + "/status")
+    assert code == 200
+    assert status["queue_depth"] == 0 and status["running"] == 0
+    assert status["concurrency"] == 2
+    assert status["jobs_tracked"] == 1
+    assert len(status["models"]) == 2
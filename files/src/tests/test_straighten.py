@@ -0,0 +1,37 @@
+import numpy as np
+
+from conftest import make_photo
+from image_utils import DETECT_WIDTH, PAGE_WIDTH_INCHES, straighten_array
+
+
+def corner_error(found, expected):
+    """Largest distance from a found corner to the nearest expected one."""
+    found = np.asarray(found)
+    return max(np.linalg.norm(expected - p, axis=1).min() for p in found)
+
+
+def test_pyramid_matches_full_resolution_detection():
+    photo, border = make_photo()
+    assert photo.shape[1] > DETECT_WIDTH  # the pyramid path is taken
+    warped, info = straighten_array(photo, pyramid=True)
+    full, full_info = straighten_array(photo, pyramid=False)
+    assert info["scale"] > 1 and full_info["scale"] == 1
+    # Within the border line's half-thickness of the drawn outline, and of each other
+    assert corner_error(info["corners"], border) < 10
+    assert corner_error(info["corners"], np.asarray(full_info["corners"])) < 4
+    assert abs(warped.shape[0] - full.shape[0]) <= 3 and abs(warped.shape[1] - full.shape[1]) <= 3
+    # The straightened page is about the page's size, upright
+    assert abs(warped.shape[1] - 2100) < 20 and abs(warped.shape[0] - 2800) < 20
+
+
+def test_target_dpi_warps_straight_to_the_requested_width():
+    photo, _ = make_photo()
+    warped, info = straighten_array(photo, target_dpi=150)
+    assert warped.shape[1] == round(150 * PAGE_WIDTH_INCHES)
+    assert info["output_size"] == [warped.shape[1], warped.shape[0]]
+    assert abs(warped.shape[0] / warped.shape[1] - 2800 / 2100) < 0.01
+
+
+def test_page_without_an_outline_is_left_alone():
+    warped, info = straighten_array(np.full((800, 600, 3), 230, dtype=np.uint8))
+    assert warped is None and info["corners"] is None
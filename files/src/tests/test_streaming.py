@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+import main_scanner
+from backends import StubBackend
+from config import NOT_SCANNED_TIER, WJ_MATH_ANSWER_KEY
+from main_scanner import scan_stream, stream_pages
+
+PAGES = ("p1.png", "p2.png", "p3.png")
+
+
+@pytest.fixture
+def fake_pages(monkeypatch):
+    """Replace decoding and cropping; returns the started-decode events per page path."""
+    started = {p: threading.Event() for p in PAGES}
+    release = {p: threading.Event() for p in PAGES}
+
+    def load_page(path, **kwargs):
+        started[path].set()
+        release[path].wait(5)
+        return f"page:{path}"
+
+    monkeypatch.setattr(main_scanner, "load_page", load_page)
+    monkeypatch.setattr(main_scanner, "prepare_page", lambda path, p_idx, *a, **kw: [(p_idx, path)])
+    return started, release
+
+
+def test_next_page_is_decoded_while_the_current_one_is_consumed(fake_pages, tmp_path):
+    started, release = fake_pages
+    for event in release.values():
+        event.set()
+    stream = stream_pages(PAGES, str(tmp_path), debug=False, prefetch=1)
+    assert next(stream)[0] == [(0, "p1.png")]
+    # Page 2 decodes without being asked for; page 3 waits until page 2 is taken
+    assert started["p2.png"].wait(5)
+    assert not started["p3.png"].is_set()
+    assert next(stream)[0] == [(1, "p2.png")]
+    assert [chunk for chunk, _ in stream] == [[(2, "p3.png")]]
+
+
+def test_closing_the_stream_cancels_pages_not_started(fake_pages, tmp_path):
+    started, release = fake_pages
+    release["p1.png"].set()
+    pages = [None] * len(PAGES)
+    stream = stream_pages(PAGES, str(tmp_path), debug=False, prefetch=1, pages_out=pages)
+    next(stream)
+    assert started["p2.png"].wait(5)
+    release["p2.png"].set()
+    stream.close()
+    # The page being decoded is kept for the visualization, the next one never starts
+    assert pages == ["page:p1.png", "page:p2.png", None]
+    assert not started["p3.png"].is_set()
+
+
+def test_ceiling_stops_pulling_pages(answer_items):
+    answers = {q: str(a) for q, a in enumerate(WJ_MATH_ANSWER_KEY, start=1)}
+    answers.update({q: "EMPTY" for q in range(20, 30)})
+    backends = [StubBackend("small", answers=answers), StubBackend("large", answers=answers)]
+    pulled = []
+
+    def chunks():
+        for p_idx in (0, 1):
+            pulled.append(p_idx)
+            yield [item for item in answer_items if item[1] == p_idx], None
+
+    seen, results = scan_stream(chunks(), backends, blank_threshold=None, stop_at_ceiling=True,
+                                question_nums=range(1, 161))
+    assert pulled == [0]
+    assert len(seen) == 80
+    assert all(results[q]["tier"] == NOT_SCANNED_TIER for q in range(81, 161))
+    assert sum(b.calls for b in backends) > 0 and all(b.images_seen <= 30 for b in backends)